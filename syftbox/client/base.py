@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import importlib.util
 from pathlib import Path
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Any, Optional
 
 import httpx
+from loguru import logger
 from packaging import version
 from rich import print as rprint
 from typing_extensions import Protocol, Self
@@ -82,6 +84,35 @@ class SyftBoxContextInterface(Protocol):
         ...  # pragma: no cover
 
 
+def http2_available() -> bool:
+    """HTTP/2 support in httpx requires the optional `h2` package, installed with `syftbox[http2]`"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def make_client_kwargs(config: SyftClientConfig) -> dict[str, Any]:
+    """Connection settings of the server clients.
+
+    All requests of a client share a single connection pool. With HTTP/2, concurrent requests are multiplexed
+    over the pooled connections instead of opening a connection per request.
+    """
+    http2 = config.client_http2 and http2_available()
+    if config.client_http2 and not http2:
+        logger.debug("HTTP/2 is enabled but the `h2` package is not installed, falling back to HTTP/1.1")
+
+    return {
+        "base_url": str(config.server_url),
+        "follow_redirects": True,
+        "headers": ClientBase._make_headers(config),
+        "timeout": config.client_timeout,
+        "limits": httpx.Limits(
+            max_connections=config.client_max_connections,
+            max_keepalive_connections=config.client_max_keepalive_connections,
+            keepalive_expiry=config.client_keepalive_expiry,
+        ),
+        "http2": http2,
+    }
+
+
 class ClientBase:
     def __init__(self, conn: httpx.Client):
         self.conn = conn
@@ -127,11 +158,5 @@ class ClientBase:
         config: SyftClientConfig,
         transport: Optional[httpx.BaseTransport] = None,
     ) -> Self:
-        conn = httpx.Client(
-            base_url=str(config.server_url),
-            follow_redirects=True,
-            headers=cls._make_headers(config),
-            timeout=config.client_timeout,
-            transport=transport,
-        )
+        conn = httpx.Client(transport=transport, **make_client_kwargs(config))
         return cls(conn)
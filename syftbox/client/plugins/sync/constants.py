@@ -1,2 +1,27 @@
 # TODO move to client config after refactor
 MAX_FILE_SIZE_MB = 10
+
+# Uploads of at least this many bytes that the synced permission files do not allow are first checked with the
+# server, smaller files are always sent
+PERMISSION_CHECK_MIN_SIZE = 1024 * 1024
+
+# Number of worker threads used by the SyncConsumer to process queued files concurrently
+SYNC_MAX_WORKERS = 8
+
+# Number of completed actions after which the SyncConsumer persists the LocalState
+LOCAL_STATE_SAVE_INTERVAL = 100
+
+# Maximum number of per-file status entries kept in the LocalState, the oldest entries are evicted first
+MAX_STATUS_INFO_ENTRIES = 10_000
+
+# Maximum number of recent errors and rejections kept in the LocalState
+MAX_RECENT_ERRORS = 1_000
+
+# The initial bulk download is split into chunks of at most this many bytes or files
+DOWNLOAD_CHUNK_MAX_BYTES = 32 * 1024 * 1024
+DOWNLOAD_CHUNK_MAX_FILES = 500
+# Number of chunks downloaded concurrently, each chunk is a separate request
+DOWNLOAD_CONCURRENCY = 4
+# Number of times a failed chunk is retried, with exponential backoff starting at DOWNLOAD_RETRY_BACKOFF seconds
+DOWNLOAD_CHUNK_RETRIES = 3
+DOWNLOAD_RETRY_BACKOFF = 1.0
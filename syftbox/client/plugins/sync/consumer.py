@@ -1,11 +1,25 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional
 
 import httpx
 from loguru import logger
+from tqdm import tqdm
 
 from syftbox.client.base import SyftBoxContextInterface
 from syftbox.client.exceptions import SyftPermissionError, SyftServerError
+from syftbox.client.plugins.sync.constants import (
+    DOWNLOAD_CHUNK_MAX_BYTES,
+    DOWNLOAD_CHUNK_MAX_FILES,
+    DOWNLOAD_CHUNK_RETRIES,
+    DOWNLOAD_CONCURRENCY,
+    DOWNLOAD_RETRY_BACKOFF,
+    LOCAL_STATE_SAVE_INTERVAL,
+    PERMISSION_CHECK_MIN_SIZE,
+    SYNC_MAX_WORKERS,
+)
 from syftbox.client.plugins.sync.datasite_state import DatasiteState
 from syftbox.client.plugins.sync.exceptions import (
     FatalSyncError,
@@ -16,25 +30,77 @@ from syftbox.client.plugins.sync.local_state import LocalState
 from syftbox.client.plugins.sync.queue import SyncQueue, SyncQueueItem
 from syftbox.client.plugins.sync.sync_action import SyncAction, determine_sync_action
 from syftbox.client.plugins.sync.types import SyncActionType
-from syftbox.lib.hash import hash_file
+from syftbox.lib.hash import hash_file_record
 from syftbox.lib.ignore import filter_ignored_paths
-from syftbox.server.models.sync_models import FileMetadata, RelativePath
+from syftbox.lib.permissions import PermissionTree, PermissionType, SyftPermission
+from syftbox.server.models.sync_models import FileRecord
+
+
+def create_local_batch(
+    context: SyftBoxContextInterface, paths_to_download: list[Path], pbar: Optional[tqdm] = None
+) -> list[FileRecord]:
+    """
+    Download a batch of files in a single request, retried up to DOWNLOAD_CHUNK_RETRIES times.
+    Returns the downloaded files, or an empty list if all attempts failed.
+    """
+    for attempt in range(DOWNLOAD_CHUNK_RETRIES + 1):
+        try:
+            return context.client.sync.download_files_streaming(
+                paths_to_download, context.workspace.datasites, pbar=pbar
+            )
+        except (SyftServerError, httpx.HTTPError) as e:
+            if attempt == DOWNLOAD_CHUNK_RETRIES:
+                logger.error(f"Failed to download {len(paths_to_download)} files: {e}")
+                break
+            backoff = DOWNLOAD_RETRY_BACKOFF * 2**attempt
+            logger.warning(f"Failed to download {len(paths_to_download)} files, retrying in {backoff}s: {e}")
+            time.sleep(backoff)
+    return []
 
 
-def create_local_batch(context: SyftBoxContextInterface, paths_to_download: list[Path]) -> list[RelativePath]:
-    try:
-        file_list = context.client.sync.download_files_streaming(paths_to_download, context.workspace.datasites)
-    except SyftServerError as e:
-        logger.error(e)
-        return []
-    return file_list
+def split_into_chunks(
+    files: list[FileRecord],
+    max_chunk_bytes: int = DOWNLOAD_CHUNK_MAX_BYTES,
+    max_chunk_files: int = DOWNLOAD_CHUNK_MAX_FILES,
+) -> list[list[FileRecord]]:
+    """
+    Split files into chunks of at most max_chunk_bytes and max_chunk_files. Files larger than max_chunk_bytes
+    get a chunk of their own. Files are sorted by size first, so chunks have a similar number of bytes.
+    """
+    chunks: list[list[FileRecord]] = []
+    current_chunk: list[FileRecord] = []
+    current_size = 0
+    for file in sorted(files, key=lambda f: f.file_size, reverse=True):
+        if current_chunk and (current_size + file.file_size > max_chunk_bytes or len(current_chunk) >= max_chunk_files):
+            chunks.append(current_chunk)
+            current_chunk = []
+            current_size = 0
+        current_chunk.append(file)
+        current_size += file.file_size
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
 
 
 class SyncConsumer:
-    def __init__(self, context: SyftBoxContextInterface, queue: SyncQueue, local_state: LocalState):
+    def __init__(
+        self,
+        context: SyftBoxContextInterface,
+        queue: SyncQueue,
+        local_state: LocalState,
+        max_workers: int = SYNC_MAX_WORKERS,
+    ):
         self.context = context
         self.queue = queue
         self.local_state = local_state
+        self.max_workers = max_workers
+        # Synced permission files, large uploads they do not allow are checked with the server before sending
+        self.permission_tree = PermissionTree(Path(self.context.workspace.datasites), skip_invalid=True)
+
+        self._path_locks: dict[Path, threading.Lock] = {}
+        self._path_locks_lock = threading.Lock()
+        self._unsaved_actions = 0
+        self._unsaved_actions_lock = threading.Lock()
 
     def validate_sync_environment(self) -> None:
         if not Path(self.context.workspace.datasites).is_dir():
@@ -43,40 +109,108 @@ class SyncConsumer:
             raise SyncEnvironmentError("Your previous sync state has been deleted by a different process.")
 
     def consume_all(self) -> None:
-        while not self.queue.empty():
-            self.validate_sync_environment()
-            item = self.queue.get(timeout=0.1)
-            try:
+        """
+        Process all items in the queue using a pool of worker threads.
+
+        Items are dequeued in priority order. Permission files (priority 0) are always synced before
+        any other file is started, so files are never synced before the permissions that apply to them.
+        The LocalState is saved in batches of LOCAL_STATE_SAVE_INTERVAL actions, and once when the queue is empty.
+        """
+        in_flight: set[Future] = set()
+        permission_futures: list[Future] = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="SyncConsumer") as executor:
+                while not self.queue.empty():
+                    self.validate_sync_environment()
+                    # Only take as many items as there are free workers, so newer changes can still be
+                    # coalesced with queued items
+                    items = self.queue.get_many(max(1, self.max_workers - len(in_flight)))
+
+                    for item in items:
+                        if item.priority > 0 and permission_futures:
+                            # Barrier: all permission files need to be synced before other files
+                            done, in_flight = wait(in_flight)
+                            self._raise_for_fatal_errors(done)
+                            permission_futures = []
+
+                        if len(in_flight) >= self.max_workers:
+                            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                            self._raise_for_fatal_errors(done)
+
+                        future = executor.submit(self._consume_item, item)
+                        in_flight.add(future)
+                        if item.priority == 0:
+                            permission_futures.append(future)
+
+                done, in_flight = wait(in_flight)
+                self._raise_for_fatal_errors(done)
+        finally:
+            with self._path_locks_lock:
+                self._path_locks.clear()
+            self._save_local_state()
+
+    def _consume_item(self, item: SyncQueueItem) -> None:
+        try:
+            with self._lock_for_path(item.data.path):
                 self.process_filechange(item)
-            except FatalSyncError as e:
-                # Fatal error, syncing should be interrupted
-                raise e
-            except Exception as e:
-                logger.error(f"Failed to sync file {item.data.path}, it will be retried in the next sync. Reason: {e}")
+        except FatalSyncError as e:
+            # Fatal error, syncing should be interrupted
+            raise e
+        except Exception as e:
+            logger.error(f"Failed to sync file {item.data.path}, it will be retried in the next sync. Reason: {e}")
+
+    def _raise_for_fatal_errors(self, futures: Iterable[Future]) -> None:
+        for future in futures:
+            exc = future.exception()
+            if isinstance(exc, FatalSyncError):
+                raise exc
+
+    def _lock_for_path(self, path: Path) -> threading.Lock:
+        with self._path_locks_lock:
+            return self._path_locks.setdefault(path, threading.Lock())
+
+    def _on_action_completed(self) -> None:
+        with self._unsaved_actions_lock:
+            self._unsaved_actions += 1
+            should_save = self._unsaved_actions >= LOCAL_STATE_SAVE_INTERVAL
+        if should_save:
+            self._save_local_state()
+
+    def _save_local_state(self) -> None:
+        with self._unsaved_actions_lock:
+            self._unsaved_actions = 0
+        self.local_state.save()
 
     def download_all_missing(self, datasite_states: list[DatasiteState]) -> None:
+        """
+        Download all remote files that are not in the local state.
+
+        Files are downloaded in size-balanced chunks over DOWNLOAD_CONCURRENCY concurrent requests, failed chunks
+        are retried. The local state is saved after every chunk, so a restarted client only downloads the files
+        that are still missing. Files that could not be downloaded are synced individually by the consumer.
+        """
         try:
-            missing_files: list[Path] = []
+            remote_files: dict[Path, FileRecord] = {}
             for datasite_state in datasite_states:
                 if not datasite_state.remote_state:
                     continue
                 for file in datasite_state.remote_state:
-                    path = file.path
+                    path = Path(file.path)
                     if not self.local_state.states.get(path):
-                        missing_files.append(path)
-            missing_files = filter_ignored_paths(self.context.workspace.datasites, missing_files)
-
-            logger.info(f"Downloading {len(missing_files)} files in batch")
-            received_files = create_local_batch(self.context, missing_files)
-            for file_path in received_files:
-                state = self.get_current_local_metadata(Path(file_path))
-                self.local_state.insert_synced_file(
-                    path=Path(file_path),
-                    state=state,
-                    action=SyncActionType.CREATE_LOCAL,
-                    save=False,
-                )
-            self.local_state.save()
+                        remote_files[path] = file
+            missing_paths = filter_ignored_paths(self.context.workspace.datasites, list(remote_files.keys()))
+            if not missing_paths:
+                return
+
+            chunks = split_into_chunks([remote_files[path] for path in missing_paths])
+            logger.info(f"Downloading {len(missing_paths)} files in {len(chunks)} batches")
+            with tqdm(
+                total=len(missing_paths), desc="Downloading files", unit="file", mininterval=1.0, dynamic_ncols=True
+            ) as pbar:
+                with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY, thread_name_prefix="BulkDownload") as pool:
+                    futures = [pool.submit(self._download_chunk, chunk, pbar) for chunk in chunks]
+                    for future in as_completed(futures):
+                        future.result()
         except FatalSyncError as e:
             raise e
         except Exception as e:
@@ -84,6 +218,19 @@ class SyncConsumer:
                 f"Failed to download missing files, files will be downloaded individually instead. Reason: {e}"
             )
 
+    def _download_chunk(self, chunk: list[FileRecord], pbar: Optional[tqdm] = None) -> None:
+        received_files = create_local_batch(self.context, [Path(file.path) for file in chunk], pbar=pbar)
+        for record in received_files:
+            self.local_state.insert_synced_file(
+                path=Path(record.path),
+                state=record,
+                action=SyncActionType.CREATE_LOCAL,
+                save=False,
+            )
+            if SyftPermission.is_permission_file(Path(record.path)):
+                self.permission_tree.update(Path(record.path))
+        self.local_state.save()
+
     def determine_action(self, item: SyncQueueItem) -> SyncAction:
         path = item.data.path
         current_local_metadata = self.get_current_local_metadata(path)
@@ -108,6 +255,7 @@ class SyncConsumer:
         try:
             logger.info(action.info_message)
             action.validate(self.context)
+            self.check_local_permission(action)
             action.execute(self.context)
         except SyftPermissionError as e:
             action.process_rejection(self.context, reason=str(e))
@@ -121,25 +269,60 @@ class SyncConsumer:
 
         return action
 
+    def check_local_permission(self, action: SyncAction) -> None:
+        """
+        Reject large uploads that the server would reject, before sending the file.
+
+        The synced permission files are incomplete, permission files the user cannot read are not synced and can
+        give the user create or write access. If the synced permission files do not allow a large upload,
+        the server is asked for the permission, the upload is only rejected if the server denies it.
+
+        Raises:
+            SyftPermissionError: If the server does not allow the upload.
+        """
+        if action.action_type == SyncActionType.CREATE_REMOTE:
+            permission_type = PermissionType.CREATE
+        elif action.action_type == SyncActionType.MODIFY_REMOTE:
+            permission_type = PermissionType.WRITE
+        else:
+            return
+        if action.local_metadata is None or action.local_metadata.file_size < PERMISSION_CHECK_MIN_SIZE:
+            return
+        if SyftPermission.is_permission_file(action.path) or self.permission_tree.has_invalid_permfile(action.path):
+            return
+
+        permission = self.permission_tree.computed_permission(self.context.email, action.path)
+        if permission.has_permission(permission_type):
+            return
+        permission_name = permission_type.name.lower()
+        if self.context.client.sync.has_permission(action.path, permission_name) is False:
+            raise SyftPermissionError(
+                f"User {self.context.email} does not have {permission_name} permission for {action.path}"
+            )
+
     def process_filechange(self, item: SyncQueueItem) -> None:
         action = self.determine_action(item)
         if action.is_noop():
             return
 
         action = self.process_action(action)
-        self.local_state.insert_completed_action(action)
+        if SyftPermission.is_permission_file(action.path):
+            self.permission_tree.update(action.path)
+        self.local_state.insert_completed_action(action, save=False)
+        self._on_action_completed()
 
-    def get_current_local_metadata(self, path: Path) -> Optional[FileMetadata]:
+    def get_current_local_metadata(self, path: Path) -> Optional[FileRecord]:
         abs_path = self.context.workspace.datasites / path
         if not abs_path.is_file():
             return None
-        return hash_file(abs_path, root_dir=self.context.workspace.datasites)
+        return hash_file_record(abs_path, root_dir=self.context.workspace.datasites)
 
-    def get_previous_local_metadata(self, path: Path) -> Optional[FileMetadata]:
+    def get_previous_local_metadata(self, path: Path) -> Optional[FileRecord]:
         return self.local_state.states.get(path, None)
 
-    def get_current_remote_metadata(self, path: Path) -> Optional[FileMetadata]:
+    def get_current_remote_metadata(self, path: Path) -> Optional[FileRecord]:
         try:
-            return self.context.client.sync.get_metadata(path)
+            # Keep the remote signature, it is needed to calculate the diff for ModifyRemote
+            return FileRecord.from_metadata(self.context.client.sync.get_metadata(path))
         except SyftServerError:
             return None
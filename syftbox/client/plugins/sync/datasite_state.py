@@ -1,15 +1,15 @@
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Set
 
 from loguru import logger
 
 from syftbox.client.base import SyftBoxContextInterface
 from syftbox.client.plugins.sync.types import FileChangeInfo, SyncSide
-from syftbox.lib.hash import collect_files, hash_dir
-from syftbox.lib.ignore import filter_ignored_paths, get_syftignore_matches
+from syftbox.lib.hash import hash_dir, hash_file_records, stat_summary_hash, summary_hash
+from syftbox.lib.ignore import IGNORE_FILENAME, ScanResult, filter_ignored_paths, scan_dir
 from syftbox.lib.permissions import SyftPermission
-from syftbox.server.models.sync_models import FileMetadata
+from syftbox.server.models.sync_models import DirHash, FileRecord
 
 
 def format_paths(path_list: list[Path]) -> str:
@@ -46,26 +46,31 @@ class DatasiteState:
         self,
         context: SyftBoxContextInterface,
         email: str,
-        remote_state: Optional[list[FileMetadata]] = None,
+        remote_state: Optional[list[FileRecord]] = None,
+        remote_summary: Optional[str] = None,
     ) -> None:
         """A class to represent the state of a datasite
 
         Args:
             ctx (SyftClientInterface): Context of the syft client
             email (str): Email of the datasite
-            remote_state (Optional[list[FileMetadata]], optional): Remote state of the datasite.
+            remote_state (Optional[list[FileRecord]], optional): Remote state of the datasite.
                 If not provided, it will be fetched from the server. Defaults to None.
+            remote_summary (Optional[str], optional): Summary hash of the remote state, as returned by the server.
+                If not provided, it will be calculated from the remote state. Defaults to None.
         """
         self.context = context
         self.email: str = email
-        self.remote_state: Optional[list[FileMetadata]] = remote_state
+        self.remote_state: Optional[list[FileRecord]] = remote_state
+        self.remote_summary: Optional[str] = remote_summary
+        self.local_scan: Optional[ScanResult] = None
 
     def __repr__(self) -> str:
         return f"DatasiteState<{self.email}>"
 
     def tree_repr(self) -> str:
         remote_state = self.remote_state or []
-        rel_paths = sorted([file.path for file in remote_state])
+        rel_paths = sorted([Path(file.path) for file in remote_state])
         path_str = format_paths(rel_paths)
         return f"""DatasiteState:
 {path_str}
@@ -76,45 +81,131 @@ class DatasiteState:
         p = self.context.workspace.datasites / self.email
         return p.expanduser().resolve()
 
-    def get_current_local_state(self) -> list[FileMetadata]:
-        return hash_dir(self.path, root_dir=self.context.workspace.datasites)
+    def get_current_local_state(self, dirs: Optional[Set[str]] = None) -> list[FileRecord]:
+        """
+        Hash all local files in the datasite. If `dirs` is provided, only files directly in these directories are hashed.
+        """
+        if dirs is None:
+            self.local_scan = scan_dir(self.context.workspace.datasites, self.path)
+            return hash_file_records(self.local_scan.included, root_dir=self.context.workspace.datasites)
+
+        local_state = []
+        for dir in dirs:
+            local_state.extend(
+                hash_dir(
+                    self.context.workspace.datasites / dir, root_dir=self.context.workspace.datasites, recursive=False
+                )
+            )
+        return local_state
 
-    def get_remote_state(self) -> list[FileMetadata]:
+    def get_remote_state(self) -> list[FileRecord]:
         if self.remote_state is None:
             self.remote_state = self.context.client.sync.get_remote_state(Path(self.email))
         return self.remote_state
 
+    def get_remote_summary(self) -> str:
+        """Summary hash of the path and content hash of all remote files."""
+        if self.remote_summary is None:
+            self.remote_summary = summary_hash((file.path, file.hash) for file in self.get_remote_state())
+        return self.remote_summary
+
+    def get_local_summary(self) -> str:
+        """
+        Summary hash of the path, size and modification time of all local files, and the ignore file.
+        Unlike the local state, this does not read any file content.
+        """
+        ignore_file = self.context.workspace.datasites / IGNORE_FILENAME
+        ignore_file_mtime = ignore_file.stat().st_mtime_ns if ignore_file.is_file() else None
+        return summary_hash([("files", stat_summary_hash(self.path)), (IGNORE_FILENAME, str(ignore_file_mtime))])
+
+    def get_remote_tree(self) -> dict[str, DirHash]:
+        """Summary hashes of all remote directories in the datasite."""
+        return {dir_hash.path.as_posix(): dir_hash for dir_hash in self.context.client.sync.get_tree(Path(self.email))}
+
+    def get_changed_remote_dirs(self, previous_tree: dict[str, DirHash]) -> tuple[Set[str], dict[str, DirHash]]:
+        """
+        Find the remote directories with changed files since `previous_tree`, by walking down the directories
+        whose hash changed. Unchanged subtrees are not visited.
+
+        Args:
+            previous_tree (dict[str, DirHash]): Remote tree of a previous sync, as returned by `get_remote_tree`.
+
+        Returns:
+            tuple[Set[str], dict[str, DirHash]]: The directories with added, modified or deleted files,
+                and the current remote tree.
+        """
+        previous_children: dict[str, list[str]] = {}
+        for dir in previous_tree:
+            if "/" in dir:
+                previous_children.setdefault(dir.rsplit("/", 1)[0], []).append(dir)
+
+        def _remove_subtree(dir: str) -> None:
+            tree.pop(dir, None)
+            changed_dirs.add(dir)
+            for child in previous_children.get(dir, []):
+                _remove_subtree(child)
+
+        tree = dict(previous_tree)
+        changed_dirs: Set[str] = set()
+        to_visit = [self.email]
+        while to_visit:
+            dir = to_visit.pop()
+            entries = {
+                dir_hash.path.as_posix(): dir_hash for dir_hash in self.context.client.sync.get_tree(Path(dir), depth=1)
+            }
+            for child in previous_children.get(dir, []):
+                if child not in entries:
+                    _remove_subtree(child)
+
+            current = entries.pop(dir, None)
+            previous = previous_tree.get(dir)
+            if current is None:
+                if previous is not None:
+                    _remove_subtree(dir)
+                continue
+
+            tree[dir] = current
+            if previous is None or previous.files_hash != current.files_hash:
+                changed_dirs.add(dir)
+            for child, child_hash in entries.items():
+                previous_child = previous_tree.get(child)
+                if previous_child is None or previous_child.hash != child_hash.hash:
+                    to_visit.append(child)
+
+        return changed_dirs, tree
+
     def is_in_sync(self) -> bool:
         changes = self.get_datasite_changes()
         return len(changes.files) == 0 and len(changes.permissions) == 0
 
     def get_syftignore_matches(self) -> List[Path]:
         """
-        Return the paths that are ignored by the syftignore file
+        Return the paths that are ignored by the syftignore file.
+        Directories in which all files are ignored are returned as a single path, their files are not listed.
 
         NOTE: symlinks and hidden files are ignored by default, and not added here.
         This is to avoid spamming the logs with .venv and .git folders.
         """
-        all_paths = collect_files(self.path)
-        relative_paths = [file.relative_to(self.context.workspace.datasites) for file in all_paths]
-        return get_syftignore_matches(
-            datasites_dir=self.context.workspace.datasites,
-            relative_paths=relative_paths,
-            include_symlinks=False,
-        )
+        # The walk of the full local state is reused, the datasite is only walked again if it was not compared
+        if self.local_scan is None:
+            self.local_scan = scan_dir(self.context.workspace.datasites, self.path)
+        return self.local_scan.ignored
 
     def get_datasite_changes(
         self,
+        dirs: Optional[Set[str]] = None,
     ) -> DatasiteChanges:
         """
         calculate the files that are out of sync
 
+        If `dirs` is provided, only files directly in these directories are compared.
+
         NOTE: we are not handling local permissions here,
         they will be handled by the server and consumer
         TODO: we are not handling empty folders
         """
         try:
-            local_state = self.get_current_local_state()
+            local_state = self.get_current_local_state(dirs)
         except Exception as e:
             logger.error(f"Failed to get local state for {self.email}: {e}")
             return DatasiteChanges(permissions=[], files=[])
@@ -125,8 +216,11 @@ class DatasiteState:
             logger.error(f"Failed to get remote state for {self.email}: {e}")
             return DatasiteChanges(permissions=[], files=[])
 
-        local_state_dict = {file.path: file for file in local_state}
-        remote_state_dict = {file.path: file for file in remote_state}
+        if dirs is not None:
+            remote_state = [file for file in remote_state if file.path.rsplit("/", 1)[0] in dirs]
+
+        local_state_dict = {Path(file.path): file for file in local_state}
+        remote_state_dict = {Path(file.path): file for file in remote_state}
         all_files = set(local_state_dict.keys()) | set(remote_state_dict.keys())
         all_files_filtered = filter_ignored_paths(
             datasites_dir=self.context.workspace.datasites,
@@ -174,8 +268,8 @@ def split_permissions(
 def compare_fileinfo(
     local_sync_folder: Path,
     path: Path,
-    local_info: Optional[FileMetadata],
-    remote_info: Optional[FileMetadata],
+    local_info: Optional[FileRecord],
+    remote_info: Optional[FileRecord],
 ) -> Optional[FileChangeInfo]:
     if local_info is None and remote_info is None:
         return None
@@ -200,9 +294,9 @@ def compare_fileinfo(
             file_size=local_info.file_size,
         )
 
-    if local_info and remote_info and local_info.hash != remote_info.hash:
+    if local_info and remote_info and local_info.digest != remote_info.digest:
         # File is different on both sides
-        if local_info.last_modified > remote_info.last_modified:
+        if local_info.mtime_ns > remote_info.mtime_ns:
             date_last_modified = local_info.last_modified
             side_last_modified = SyncSide.LOCAL
             file_size = local_info.file_size
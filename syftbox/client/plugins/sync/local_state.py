@@ -1,19 +1,26 @@
+import sqlite3
 import threading
+from collections.abc import Iterable
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Optional
 
 from loguru import logger
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
 from typing_extensions import Self, Type
 
 from syftbox.client.base import SyftBoxContextInterface
+from syftbox.client.plugins.sync.constants import MAX_RECENT_ERRORS, MAX_STATUS_INFO_ENTRIES
 from syftbox.client.plugins.sync.exceptions import SyncEnvironmentError
 from syftbox.client.plugins.sync.sync_action import SyncAction
 from syftbox.client.plugins.sync.types import SyncActionType, SyncStatus
-from syftbox.server.models.sync_models import FileMetadata
+from syftbox.server.models.sync_models import FileMetadata, FileRecord, datetime_to_ns
 
-LOCAL_STATE_FILENAME = "local_syncstate.json"
+LOCAL_STATE_FILENAME = "local_syncstate.db"
+# LocalState was previously stored as a single JSON file, it is imported into the database on first load
+LEGACY_LOCAL_STATE_FILENAME = "local_syncstate.json"
+# Version 2 stores compact file records, without the rsync signature
+LOCAL_STATE_SCHEMA_VERSION = 2
 
 
 class SyncStatusInfo(BaseModel):
@@ -24,18 +31,54 @@ class SyncStatusInfo(BaseModel):
     action: Optional[SyncActionType] = None
 
 
+class LegacyLocalState(BaseModel):
+    states: dict[Path, FileMetadata] = {}
+    status_info: dict[Path, SyncStatusInfo] = {}
+
+
 class LocalState(BaseModel):
-    path: Path = Field(description="Path to the LocalState file")
+    """
+    The sync state of all files on their last sync.
+
+    The state is kept in memory, and persisted in an embedded SQLite database.
+    Every save only writes the rows that changed since the previous save, so the cost of saving
+    does not depend on the number of tracked files.
+
+    The status history is bounded: `status_info` keeps the most recently updated `max_status_info` entries,
+    errors and rejections are additionally kept in the `recent_errors` LRU, and `status_counts` keeps
+    the total number of status updates per status.
+    `recent_errors` is not persisted: on load it is rebuilt from `status_info`, so after a restart it only
+    contains the errors that are still in `status_info`. An error is removed once its path syncs successfully.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    path: Path = Field(description="Path to the LocalState database")
     # The state of files on last successful sync
-    states: dict[Path, FileMetadata] = {}
-    # The last sync status of each file
+    states: dict[Path, FileRecord] = {}
+    # The last sync status of each file, ordered from least to most recently updated
     status_info: dict[Path, SyncStatusInfo] = {}
+    # The most recent unresolved errors and rejections, ordered from least to most recently updated
+    recent_errors: dict[Path, SyncStatusInfo] = {}
+    # Number of status updates per status
+    status_counts: dict[SyncStatus, int] = {}
+
+    max_status_info: int = MAX_STATUS_INFO_ENTRIES
+    max_recent_errors: int = MAX_RECENT_ERRORS
+
+    # Guards states, status_info and the state file, the SyncConsumer updates the state from multiple threads
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+    _conn: Optional[sqlite3.Connection] = PrivateAttr(default=None)
+    # Paths that changed since the last save
+    _dirty_states: set[Path] = PrivateAttr(default_factory=set)
+    _dirty_status_info: set[Path] = PrivateAttr(default_factory=set)
+    _dirty_status_counts: bool = PrivateAttr(default=False)
 
     @classmethod
     def for_context(cls: Type[Self], context: SyftBoxContextInterface) -> Self:
         return cls(path=context.workspace.plugins / LOCAL_STATE_FILENAME)
 
-    def insert_completed_action(self, action: SyncAction) -> None:
+    def insert_completed_action(self, action: SyncAction, save: bool = True) -> None:
         """Insert action result into local state."""
         if action.action_type == SyncActionType.NOOP:
             return
@@ -48,6 +91,7 @@ class LocalState(BaseModel):
                 path=action.path,
                 state=action.result_local_state,
                 action=action.action_type,
+                save=save,
             )
         else:
             self.insert_status_info(
@@ -55,10 +99,11 @@ class LocalState(BaseModel):
                 status=action.status,
                 message=action.message,
                 action=action.action_type,
+                save=save,
             )
 
     def insert_synced_file(
-        self, path: Path, state: Optional[FileMetadata], action: "SyncActionType", save: bool = True
+        self, path: Path, state: Optional[FileRecord], action: "SyncActionType", save: bool = True
     ) -> None:
         if not isinstance(path, Path):
             raise ValueError(f"path must be a Path object, got {path}")
@@ -70,19 +115,21 @@ class LocalState(BaseModel):
             # during syncing and might cause unexpected behavior like deleting files on the remote
             raise SyncEnvironmentError("Your previous sync state has been deleted by a different process.")
 
-        if state is None:
-            self.states.pop(path, None)
-        else:
-            self.states[path] = state
+        with self._lock:
+            if state is None:
+                self.states.pop(path, None)
+            else:
+                self.states[path] = state.without_signature()
+            self._dirty_states.add(path)
 
-        self.insert_status_info(
-            path,
-            SyncStatus.SYNCED,
-            action=action,
-            save=False,
-        )
-        if save:
-            self.save()
+            self.insert_status_info(
+                path,
+                SyncStatus.SYNCED,
+                action=action,
+                save=False,
+            )
+            if save:
+                self.save()
 
     def insert_status_info(
         self,
@@ -94,24 +141,271 @@ class LocalState(BaseModel):
     ) -> None:
         if not isinstance(path, Path):
             raise ValueError(f"path must be a Path object, got {path}")
-        self.status_info[path] = SyncStatusInfo(path=path, status=status, message=message, action=action)
-        if save:
+        with self._lock:
+            info = SyncStatusInfo(path=path, status=status, message=message, action=action)
+            # Re-insert to keep status_info ordered by last update
+            self.status_info.pop(path, None)
+            self.status_info[path] = info
+            self._dirty_status_info.add(path)
+            self._evict_status_info()
+
+            if status in (SyncStatus.ERROR, SyncStatus.REJECTED):
+                self.recent_errors.pop(path, None)
+                self.recent_errors[path] = info
+                while len(self.recent_errors) > self.max_recent_errors:
+                    del self.recent_errors[next(iter(self.recent_errors))]
+            elif status == SyncStatus.SYNCED:
+                self.recent_errors.pop(path, None)
+
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            self._dirty_status_counts = True
+            if save:
+                self.save()
+
+    def prune_missing(self, datasites_dir: Path) -> int:
+        """
+        Remove status info of files that no longer exist locally and are not tracked in the sync state.
+        Recent errors and the status counts are kept.
+
+        Returns:
+            int: The number of removed entries.
+        """
+        with self._lock:
+            missing_paths = [
+                path for path in self.status_info if path not in self.states and not (datasites_dir / path).exists()
+            ]
+            for path in missing_paths:
+                del self.status_info[path]
+                self._dirty_status_info.add(path)
             self.save()
+        if missing_paths:
+            logger.debug(f"Removed {len(missing_paths)} status entries for files that no longer exist")
+        return len(missing_paths)
+
+    def _evict_status_info(self) -> None:
+        while len(self.status_info) > self.max_status_info:
+            oldest_path = next(iter(self.status_info))
+            del self.status_info[oldest_path]
+            self._dirty_status_info.add(oldest_path)
 
     def save(self) -> None:
+        """Write all changes since the previous save to the database, in a single transaction."""
         try:
-            with threading.Lock():
-                self.path.write_text(self.model_dump_json())
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    self._write_states(conn, self._dirty_states)
+                    self._write_status_info(conn, self._dirty_status_info)
+                    if self._dirty_status_counts:
+                        self._write_status_counts(conn)
+                self._dirty_states.clear()
+                self._dirty_status_info.clear()
+                self._dirty_status_counts = False
         except Exception as e:
             logger.exception(f"Failed to save {self.path}: {e}")
 
     def load(self) -> None:
-        with threading.Lock():
-            if self.path.exists():
-                data = self.path.read_text()
-                loaded_state = self.model_validate_json(data)
-                self.states = loaded_state.states
-                self.status_info = loaded_state.status_info
+        with self._lock:
+            conn = self._connect()
+            legacy_path = self.path.with_name(LEGACY_LOCAL_STATE_FILENAME)
+            if legacy_path.is_file():
+                self._import_legacy_state(legacy_path)
+                return
+
+            # Plain tuples are considerably faster than sqlite3.Row for large states
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            self.states = {
+                Path(path): FileRecord(path, digest, file_size, mtime_ns)
+                for path, digest, file_size, mtime_ns in cursor.execute(
+                    "SELECT path, digest, file_size, mtime_ns FROM states"
+                )
+            }
+            self.status_info = {
+                Path(row["path"]): SyncStatusInfo(
+                    path=Path(row["path"]),
+                    timestamp=row["timestamp"],
+                    status=row["status"],
+                    message=row["message"],
+                    action=row["action"],
+                )
+                for row in conn.execute("SELECT * FROM status_info ORDER BY timestamp")
+            }
+            self.recent_errors = {
+                path: info
+                for path, info in self.status_info.items()
+                if info.status in (SyncStatus.ERROR, SyncStatus.REJECTED)
+            }
+            self.status_counts = {
+                SyncStatus(row["status"]): row["count"] for row in conn.execute("SELECT * FROM status_counts")
+            }
+            self._dirty_states.clear()
+            self._dirty_status_info.clear()
+            self._dirty_status_counts = False
+
+            # Apply the retention policy to states saved with a larger limit
+            self._evict_status_info()
+            while len(self.recent_errors) > self.max_recent_errors:
+                del self.recent_errors[next(iter(self.recent_errors))]
+            self.save()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _import_legacy_state(self, legacy_path: Path) -> None:
+        logger.info(f"Migrating sync state from {legacy_path} to {self.path}")
+        legacy_state = LegacyLocalState.model_validate_json(legacy_path.read_text())
+        self.states = {
+            path: FileRecord.from_metadata(metadata).without_signature()
+            for path, metadata in legacy_state.states.items()
+        }
+        self.status_info = dict(sorted(legacy_state.status_info.items(), key=lambda item: item[1].timestamp))
+        self._dirty_states = set(self.states.keys())
+        self._dirty_status_info = set(self.status_info.keys())
+        self._evict_status_info()
+        self.save()
+        legacy_path.unlink()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            return self._conn
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        with conn:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            schema_version = conn.execute("PRAGMA user_version;").fetchone()[0]
+            if schema_version == 1:
+                self._migrate_states_v1(conn)
+            conn.execute(
+                """
+            CREATE TABLE IF NOT EXISTS states (
+                path TEXT PRIMARY KEY,
+                digest BLOB NOT NULL,
+                file_size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            )
+            """
+            )
+            conn.execute(
+                """
+            CREATE TABLE IF NOT EXISTS status_info (
+                path TEXT PRIMARY KEY,
+                timestamp TEXT NOT NULL,
+                status TEXT NOT NULL,
+                message TEXT,
+                action TEXT
+            )
+            """
+            )
+            conn.execute(
+                """
+            CREATE TABLE IF NOT EXISTS status_counts (
+                status TEXT PRIMARY KEY,
+                count INTEGER NOT NULL
+            )
+            """
+            )
+            conn.execute(f"PRAGMA user_version = {LOCAL_STATE_SCHEMA_VERSION};")
+        self._conn = conn
+        return conn
+
+    def _migrate_states_v1(self, conn: sqlite3.Connection) -> None:
+        """Convert the v1 states table, which stored the full FileMetadata, to compact file records."""
+        logger.info(f"Migrating sync state in {self.path} to schema version {LOCAL_STATE_SCHEMA_VERSION}")
+        rows = conn.execute("SELECT path, hash, file_size, last_modified FROM states").fetchall()
+        conn.execute("DROP TABLE states")
+        conn.execute(
+            """
+        CREATE TABLE states (
+            path TEXT PRIMARY KEY,
+            digest BLOB NOT NULL,
+            file_size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL
+        )
+        """
+        )
+        conn.executemany(
+            "INSERT INTO states (path, digest, file_size, mtime_ns) VALUES (?, ?, ?, ?)",
+            [
+                (
+                    row["path"],
+                    bytes.fromhex(row["hash"]),
+                    row["file_size"],
+                    datetime_to_ns(datetime.fromisoformat(row["last_modified"])),
+                )
+                for row in rows
+            ],
+        )
+
+    def _write_states(self, conn: sqlite3.Connection, paths: Iterable[Path]) -> None:
+        upserts = []
+        deletes = []
+        for path in paths:
+            state = self.states.get(path)
+            if state is None:
+                deletes.append((path.as_posix(),))
             else:
-                # Ensure the file exists for the next save
-                self.save()
+                upserts.append(
+                    (
+                        path.as_posix(),
+                        state.digest,
+                        state.file_size,
+                        state.mtime_ns,
+                    )
+                )
+        conn.executemany("DELETE FROM states WHERE path = ?", deletes)
+        conn.executemany(
+            """
+        INSERT INTO states (path, digest, file_size, mtime_ns) VALUES (?, ?, ?, ?)
+        ON CONFLICT(path) DO UPDATE SET
+            digest = excluded.digest,
+            file_size = excluded.file_size,
+            mtime_ns = excluded.mtime_ns
+        """,
+            upserts,
+        )
+
+    def _write_status_info(self, conn: sqlite3.Connection, paths: Iterable[Path]) -> None:
+        upserts = []
+        deletes = []
+        for path in paths:
+            info = self.status_info.get(path)
+            if info is None:
+                deletes.append((path.as_posix(),))
+            else:
+                upserts.append(
+                    (
+                        path.as_posix(),
+                        info.timestamp.isoformat(),
+                        info.status.value,
+                        info.message,
+                        info.action.value if info.action is not None else None,
+                    )
+                )
+        conn.executemany("DELETE FROM status_info WHERE path = ?", deletes)
+        conn.executemany(
+            """
+        INSERT INTO status_info (path, timestamp, status, message, action) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(path) DO UPDATE SET
+            timestamp = excluded.timestamp,
+            status = excluded.status,
+            message = excluded.message,
+            action = excluded.action
+        """,
+            upserts,
+        )
+
+    def _write_status_counts(self, conn: sqlite3.Connection) -> None:
+        conn.executemany(
+            """
+        INSERT INTO status_counts (status, count) VALUES (?, ?)
+        ON CONFLICT(status) DO UPDATE SET count = excluded.count
+        """,
+            [(status.value, count) for status, count in self.status_counts.items()],
+        )
@@ -12,10 +12,16 @@ from syftbox.client.plugins.sync.local_state import LocalState
 from syftbox.client.plugins.sync.producer import SyncProducer
 from syftbox.client.plugins.sync.queue import SyncQueue, SyncQueueItem
 from syftbox.client.plugins.sync.types import FileChangeInfo
+from syftbox.client.server_client import remove_temp_files
 
 
 class SyncManager:
-    def __init__(self, context: SyftBoxContextInterface, health_check_interval: int = 300):
+    def __init__(
+        self,
+        context: SyftBoxContextInterface,
+        health_check_interval: int = 300,
+        local_state_prune_interval: int = 3600,
+    ):
         self.context = context
         self.queue = SyncQueue()
         self.local_state = LocalState.for_context(context)
@@ -28,6 +34,8 @@ class SyncManager:
         self.sync_run_once = False
         self.last_health_check = 0.0
         self.health_check_interval = float(health_check_interval)
+        self.last_local_state_prune = time.time()
+        self.local_state_prune_interval = float(local_state_prune_interval)
 
         self.setup()
 
@@ -37,6 +45,11 @@ class SyncManager:
         except Exception as e:
             raise SyncEnvironmentError(f"Failed to load previous sync state: {e}") from e
 
+        # Temporary files of writes interrupted by a crash are hidden from the sync, they are removed on startup
+        num_removed = remove_temp_files(self.context.workspace.datasites)
+        if num_removed:
+            logger.info(f"Removed {num_removed} temporary files of interrupted writes")
+
     def is_alive(self) -> bool:
         return self.thread is not None and self.thread.is_alive()
 
@@ -71,6 +84,14 @@ class SyncManager:
     def _should_perform_health_check(self) -> bool:
         return time.time() - self.last_health_check > self.health_check_interval
 
+    def _should_prune_local_state(self) -> bool:
+        return time.time() - self.last_local_state_prune > self.local_state_prune_interval
+
+    def prune_local_state(self) -> None:
+        """Remove status info of files that no longer exist, to keep the local state bounded over time."""
+        self.local_state.prune_missing(self.context.workspace.datasites)
+        self.last_local_state_prune = time.time()
+
     def check_server_status(self) -> None:
         """
         check if the server is still available for syncing,
@@ -103,4 +124,7 @@ class SyncManager:
         # TODO stop consumer if self.is_stop_requested
         self.consumer.consume_all()
 
+        if self._should_prune_local_state():
+            self.prune_local_state()
+
         self.sync_run_once = True
@@ -1,3 +1,6 @@
+from pathlib import Path
+from typing import Optional
+
 from loguru import logger
 
 from syftbox.client.base import SyftBoxContextInterface
@@ -5,6 +8,8 @@ from syftbox.client.plugins.sync.datasite_state import DatasiteState
 from syftbox.client.plugins.sync.local_state import LocalState
 from syftbox.client.plugins.sync.queue import SyncQueue, SyncQueueItem
 from syftbox.client.plugins.sync.types import FileChangeInfo, SyncStatus
+from syftbox.lib.hash import EMPTY_SUMMARY_HASH
+from syftbox.server.models.sync_models import DirHash
 
 
 class SyncProducer:
@@ -12,22 +17,29 @@ class SyncProducer:
         self.context = context
         self.queue = queue
         self.local_state = local_state
+        # Ignored paths per datasite on the previous run
+        self.ignored_paths: dict[str, set[Path]] = {}
+        # (remote summary, local summary) of datasites that were in sync on the previous run
+        self.in_sync_summaries: dict[str, tuple[str, str]] = {}
+        # Remote directory hashes of datasites that were in sync on the previous run
+        self.in_sync_trees: dict[str, dict[str, DirHash]] = {}
 
     def get_datasite_states(self) -> list[DatasiteState]:
         try:
-            remote_datasite_states = self.context.client.sync.get_datasite_states()
+            remote_datasite_listings = self.context.client.sync.get_datasite_listings()
         except Exception as e:
             logger.error(f"Failed to retrieve datasites from server, only syncing own datasite. Reason: {e}")
-            remote_datasite_states = {}
-
-        # Ensure we are always syncing own datasite
-        if self.context.email not in remote_datasite_states:
-            remote_datasite_states[self.context.email] = []
+            remote_datasite_listings = {}
 
         datasite_states = [
-            DatasiteState(self.context, email, remote_state=remote_state)
-            for email, remote_state in remote_datasite_states.items()
+            DatasiteState(self.context, email, remote_state=remote_state, remote_summary=remote_summary)
+            for email, (remote_summary, remote_state) in remote_datasite_listings.items()
         ]
+
+        # Ensure we are always syncing own datasite
+        if self.context.email not in remote_datasite_listings:
+            datasite_states.append(DatasiteState(self.context, self.context.email, remote_state=[]))
+
         return datasite_states
 
     def add_ignored_to_local_state(self, datasite: DatasiteState) -> None:
@@ -37,21 +49,68 @@ class SyncProducer:
 
         NOTE: To avoid spammy behaviour symlinks and hidden files are not included in the local state ignore list.
         Example: the symlinked apps .venv folders can contain 10k+ files
+
+        NOTE: only paths that were not ignored on the previous run are added, so the local state is not rewritten
+        every run, and evicted entries are not added back.
         """
-        for path in datasite.get_syftignore_matches():
-            prev_status_info = self.local_state.status_info.get(path, None)
-            # Only add to local state if it's not already ignored previously
-            is_ignored_previously = prev_status_info is not None and prev_status_info.status == SyncStatus.IGNORED
-            if not is_ignored_previously:
-                self.local_state.insert_status_info(path, SyncStatus.IGNORED)
+        ignored_paths = set(datasite.get_syftignore_matches())
+        previously_ignored = self.ignored_paths.get(datasite.email)
+
+        if previously_ignored is None:
+            # First run for this datasite, only add to local state if it's not already ignored previously
+            new_ignored_paths = []
+            for path in ignored_paths:
+                prev_status_info = self.local_state.status_info.get(path, None)
+                is_ignored_previously = prev_status_info is not None and prev_status_info.status == SyncStatus.IGNORED
+                if not is_ignored_previously:
+                    new_ignored_paths.append(path)
+        else:
+            new_ignored_paths = list(ignored_paths - previously_ignored)
+
+        for path in new_ignored_paths:
+            self.local_state.insert_status_info(path, SyncStatus.IGNORED, save=False)
+        if new_ignored_paths:
+            self.local_state.save()
+        self.ignored_paths[datasite.email] = ignored_paths
 
     def enqueue_datasite_changes(self, datasite: DatasiteState) -> None:
         """
         Enqueue all out of sync files for the datasite,
         and track the ignored files in the local state.
+
+        If the datasite was in sync on the previous run, and both the remote and local summary hashes are unchanged,
+        comparing the datasite is skipped. If only the remote summary changed, only the remote directories
+        with changed files are compared.
         """
         try:
-            datasite_changes = datasite.get_datasite_changes()
+            # Summaries are calculated before comparing, changes made while comparing are picked up on the next run
+            summaries = (datasite.get_remote_summary(), datasite.get_local_summary())
+        except Exception as e:
+            logger.error(f"Failed to get summary hashes for {datasite.email}. Reason: {e}")
+            summaries = None
+
+        previous_summaries = self.in_sync_summaries.get(datasite.email)
+        if summaries is not None and previous_summaries == summaries:
+            logger.debug(f"Skipping {datasite.email}, no changes since the previous sync")
+            return
+
+        changed_dirs = None
+        remote_tree = None
+        previous_tree = self.in_sync_trees.get(datasite.email)
+        if (
+            summaries is not None
+            and previous_summaries is not None
+            and previous_tree is not None
+            and previous_summaries[1] == summaries[1]
+        ):
+            # Only the remote changed since the previous sync
+            try:
+                changed_dirs, remote_tree = datasite.get_changed_remote_dirs(previous_tree)
+            except Exception as e:
+                logger.warning(f"Failed to get changed directories for {datasite.email}, comparing all files: {e}")
+
+        try:
+            datasite_changes = datasite.get_datasite_changes(dirs=changed_dirs)
 
             if len(datasite_changes.permissions) or len(datasite_changes.files):
                 logger.debug(
@@ -63,7 +122,34 @@ class SyncProducer:
         for change in datasite_changes.permissions + datasite_changes.files:
             self.enqueue(change)
 
+        is_in_sync = not datasite_changes.permissions and not datasite_changes.files
+        if is_in_sync and summaries is not None:
+            self.in_sync_summaries[datasite.email] = summaries
+            self._update_in_sync_tree(datasite, summaries[0], remote_tree)
+        else:
+            self.in_sync_summaries.pop(datasite.email, None)
+            self.in_sync_trees.pop(datasite.email, None)
+
         self.add_ignored_to_local_state(datasite)
 
+    def _update_in_sync_tree(
+        self, datasite: DatasiteState, remote_summary: str, remote_tree: Optional[dict[str, DirHash]]
+    ) -> None:
+        try:
+            if remote_tree is None:
+                remote_tree = datasite.get_remote_tree()
+        except Exception as e:
+            logger.debug(f"Failed to get remote tree for {datasite.email}: {e}")
+            self.in_sync_trees.pop(datasite.email, None)
+            return
+
+        # The tree is only valid if it is the same remote state that was compared
+        root = remote_tree.get(datasite.email)
+        root_hash = root.hash if root is not None else EMPTY_SUMMARY_HASH
+        if root_hash == remote_summary:
+            self.in_sync_trees[datasite.email] = remote_tree
+        else:
+            self.in_sync_trees.pop(datasite.email, None)
+
     def enqueue(self, change: FileChangeInfo) -> None:
         self.queue.put(SyncQueueItem(priority=change.get_priority(), data=change))
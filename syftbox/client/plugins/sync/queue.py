@@ -1,44 +1,177 @@
+import itertools
 import threading
+import time
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
-from queue import PriorityQueue
-from typing import Dict, Optional
+from queue import Empty, Full
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 from syftbox.client.plugins.sync.types import FileChangeInfo
 
 
 @dataclass(order=True)
 class SyncQueueItem:
-    priority: int
+    priority: Union[int, float]
     data: FileChangeInfo
     enqueued_at: datetime = field(default_factory=lambda: datetime.now(tz=timezone.utc))
 
 
+# Heap entries are (priority, insertion order, path). Items with the same priority are returned in insertion order,
+# the insertion order is unique so paths are never compared.
+HeapEntry = Tuple[Union[int, float], int, Path]
+
+
 class SyncQueue:
     """
-    A thread-safe priority queue that supports deduplication based on the data field.
+    A thread-safe priority queue with one entry per path, implemented as an indexed binary heap.
 
-    Adding an item to the queue that already exists will be ignored, even if the priority is different.
+    Adding an item for a path that is already queued coalesces both changes into a single entry:
+    - the data of the latest change wins, the original enqueued_at is kept
+    - the priority is upgraded if the new item has a higher priority (lower value), but never downgraded.
+      This way a queued item is never delayed by a newer change, and e.g. a permission file does not have to
+      wait behind a stale entry.
     """
 
     def __init__(self, maxsize: int = 0):
-        self.queue: PriorityQueue[SyncQueueItem] = PriorityQueue(maxsize=maxsize)
+        self.maxsize = maxsize
         self.all_items: Dict[Path, SyncQueueItem] = {}
 
+        self._heap: List[HeapEntry] = []
+        # Position of each path in the heap, used for decrease-key
+        self._positions: Dict[Path, int] = {}
+        self._counter = itertools.count()
+
         self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
 
     def put(self, item: SyncQueueItem, block: bool = False, timeout: Optional[float] = None) -> None:
-        with self.lock:
-            if item.data.path not in self.all_items:
-                self.queue.put(item, block=block, timeout=timeout)
-                self.all_items[item.data.path] = item
+        path = item.data.path
+        with self.not_full:
+            if path in self.all_items:
+                self._coalesce(item)
+                return
+
+            if self.maxsize > 0:
+                self._wait_for(
+                    self.not_full,
+                    lambda: path in self.all_items or len(self._heap) < self.maxsize,
+                    block,
+                    timeout,
+                    Full,
+                )
+                # Another producer can have queued the same path while waiting
+                if path in self.all_items:
+                    self._coalesce(item)
+                    return
+
+            self._heap.append((item.priority, next(self._counter), path))
+            self._positions[path] = len(self._heap) - 1
+            self.all_items[path] = item
+            self._sift_up(len(self._heap) - 1)
+            self.not_empty.notify()
 
     def get(self, block: bool = False, timeout: Optional[float] = None) -> SyncQueueItem:
-        with self.lock:
-            item: SyncQueueItem = self.queue.get(block=block, timeout=timeout)
-            self.all_items.pop(item.data.path, None)
+        with self.not_empty:
+            self._wait_for(self.not_empty, lambda: len(self._heap) > 0, block, timeout, Empty)
+            item = self._pop()
+            self.not_full.notify()
             return item
 
+    def get_many(self, max_items: int, block: bool = False, timeout: Optional[float] = None) -> List[SyncQueueItem]:
+        """
+        Get up to `max_items` items in priority order, while holding the lock only once.
+        If the queue is empty, an empty list is returned, or waits for at least one item if `block` is True.
+        """
+        with self.not_empty:
+            try:
+                self._wait_for(self.not_empty, lambda: len(self._heap) > 0, block, timeout, Empty)
+            except Empty:
+                return []
+            items = [self._pop() for _ in range(min(max_items, len(self._heap)))]
+            self.not_full.notify(len(items))
+            return items
+
     def empty(self) -> bool:
-        return self.queue.empty()
+        with self.lock:
+            return len(self._heap) == 0
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self._heap)
+
+    def _wait_for(
+        self,
+        condition: threading.Condition,
+        predicate: Callable[[], bool],
+        block: bool,
+        timeout: Optional[float],
+        exception: type,
+    ) -> None:
+        if predicate():
+            return
+        if not block:
+            raise exception()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not predicate():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise exception()
+            condition.wait(remaining)
+
+    def _coalesce(self, item: SyncQueueItem) -> None:
+        path = item.data.path
+        queued_item = self.all_items[path]
+        priority = min(queued_item.priority, item.priority)
+        self.all_items[path] = SyncQueueItem(priority=priority, data=item.data, enqueued_at=queued_item.enqueued_at)
+
+        if priority < queued_item.priority:
+            position = self._positions[path]
+            _, order, _ = self._heap[position]
+            self._heap[position] = (priority, order, path)
+            self._sift_up(position)
+
+    def _pop(self) -> SyncQueueItem:
+        last = self._heap.pop()
+        if self._heap:
+            first = self._heap[0]
+            self._heap[0] = last
+            self._positions[last[2]] = 0
+            self._sift_down(0)
+        else:
+            first = last
+        path = first[2]
+        del self._positions[path]
+        return self.all_items.pop(path)
+
+    def _sift_up(self, position: int) -> None:
+        heap = self._heap
+        entry = heap[position]
+        while position > 0:
+            parent = (position - 1) // 2
+            if heap[parent] <= entry:
+                break
+            heap[position] = heap[parent]
+            self._positions[heap[position][2]] = position
+            position = parent
+        heap[position] = entry
+        self._positions[entry[2]] = position
+
+    def _sift_down(self, position: int) -> None:
+        heap = self._heap
+        size = len(heap)
+        entry = heap[position]
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1] < heap[child]:
+                child += 1
+            if entry <= heap[child]:
+                break
+            heap[position] = heap[child]
+            self._positions[heap[position][2]] = position
+            position = child
+        heap[position] = entry
+        self._positions[entry[2]] = position
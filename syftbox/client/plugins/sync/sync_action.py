@@ -1,10 +1,9 @@
-import hashlib
+import os
 import shutil
 from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import ClassVar, Optional
 
-import py_fast_rsync
 from loguru import logger
 
 from syftbox.client.base import SyftBoxContextInterface
@@ -12,24 +11,33 @@ from syftbox.client.exceptions import SyftPermissionError
 from syftbox.client.plugins.sync.constants import MAX_FILE_SIZE_MB
 from syftbox.client.plugins.sync.exceptions import SyncValidationError
 from syftbox.client.plugins.sync.types import SyncActionType, SyncSide, SyncStatus
+from syftbox.client.server_client import make_temp_file
 from syftbox.lib.constants import REJECTED_FILE_SUFFIX
 from syftbox.lib.permissions import SyftPermission
-from syftbox.server.models.sync_models import FileMetadata
+from syftbox.lib.rsync import (
+    EMPTY_SIGNATURE,
+    SMALL_FILE_THRESHOLD,
+    apply_diff_stream,
+    calculate_diff,
+    calculate_file_signature,
+    mmap_file,
+)
+from syftbox.server.models.sync_models import FileRecord
 
 
 def determine_sync_action(
-    current_local_metadata: Optional[FileMetadata],
-    previous_local_metadata: Optional[FileMetadata],
-    current_remote_metadata: Optional[FileMetadata],
+    current_local_metadata: Optional[FileRecord],
+    previous_local_metadata: Optional[FileRecord],
+    current_remote_metadata: Optional[FileRecord],
 ) -> "SyncAction":
     """
     Determine the action syncing should take based on the local and remote states, and the previous local state.
 
     Args:
-        current_local_metadata (Optional[FileMetadata]): Metadata of the local file, None if it does not exist.
-        previous_local_metadata (Optional[FileMetadata]): Metadata of the local file when it was last synced,
+        current_local_metadata (Optional[FileRecord]): Metadata of the local file, None if it does not exist.
+        previous_local_metadata (Optional[FileRecord]): Metadata of the local file when it was last synced,
             None if it does not exist.
-        current_remote_metadata (Optional[FileMetadata]): Metadata of the remote file, None if it does not exist.
+        current_remote_metadata (Optional[FileRecord]): Metadata of the remote file, None if it does not exist.
 
     Raises:
         ValueError: If the action cannot be determined.
@@ -89,8 +97,8 @@ def format_rejected_path(path: Path) -> Path:
 class SyncAction(ABC):
     action_type: ClassVar[SyncActionType]
     path: Path
-    local_metadata: Optional[FileMetadata]
-    remote_metadata: Optional[FileMetadata]
+    local_metadata: Optional[FileRecord]
+    remote_metadata: Optional[FileRecord]
     status: SyncStatus
     message: Optional[str]
 
@@ -99,12 +107,12 @@ class SyncAction(ABC):
             raise TypeError("SyncAction subclasses must define an action_type")
         return super().__init_subclass__()
 
-    def __init__(self, local_metadata: Optional[FileMetadata], remote_metadata: Optional[FileMetadata]):
+    def __init__(self, local_metadata: Optional[FileRecord], remote_metadata: Optional[FileRecord]):
         if not local_metadata and not remote_metadata:
             raise ValueError("At least one of local_metadata or remote_metadata must be provided")
         self.local_metadata = local_metadata
         self.remote_metadata = remote_metadata
-        self.path = local_metadata.path if local_metadata else remote_metadata.path  # type: ignore
+        self.path = Path(local_metadata.path if local_metadata else remote_metadata.path)  # type: ignore
         self.status = SyncStatus.PROCESSING
         self.message = None
 
@@ -143,7 +151,7 @@ class SyncAction(ABC):
         return self.action_type == SyncActionType.NOOP
 
     @property
-    def result_local_state(self) -> Optional[FileMetadata]:
+    def result_local_state(self) -> Optional[FileRecord]:
         """Metadata of the local file after the action is executed successfully."""
         if self.side_to_update == SyncSide.LOCAL:
             return self.remote_metadata
@@ -153,7 +161,7 @@ class SyncAction(ABC):
 class NoopAction(SyncAction):
     action_type = SyncActionType.NOOP
 
-    def __init__(self, local_metadata: FileMetadata, remote_metadata: FileMetadata) -> None:
+    def __init__(self, local_metadata: FileRecord, remote_metadata: FileRecord) -> None:
         super().__init__(local_metadata, remote_metadata)
         # noop actions are already synced
         self.status = SyncStatus.SYNCED
@@ -187,21 +195,34 @@ class ModifyLocalAction(SyncAction):
     def execute(self, context: SyftBoxContextInterface) -> None:
         if self.local_metadata is None:
             raise ValueError("Local metadata is required for modify local action")
-        # Use rsync to update the local file with the remote changes
-        diff = context.client.sync.get_diff(self.path, self.local_metadata.signature)
-
+        # Use rsync to update the local file with the remote changes.
+        # Local records do not keep a signature, it is calculated from the current file content.
+        # Small remote files are sent in full, diffing against an empty signature.
+        # The local file is memory-mapped and the diff is applied while it is downloaded, to a temporary file
+        # that replaces the local file once its hash is verified. Neither file is loaded in memory.
         abs_path = context.workspace.datasites / self.path
-        local_data = abs_path.read_bytes()
-        new_data = py_fast_rsync.apply(local_data, diff.diff_bytes)
-        new_hash = hashlib.sha256(new_data).hexdigest()
-
-        if new_hash != diff.hash:
-            # TODO error handling
-            raise ValueError("Hash mismatch after applying diff")
-
-        # TODO implement safe write with tempfile + rename
-        abs_path.parent.mkdir(parents=True, exist_ok=True)
-        abs_path.write_bytes(new_data)
+        remote_size = self.remote_metadata.file_size if self.remote_metadata is not None else None
+        with open(abs_path, "rb") as f, mmap_file(f) as base:
+            local_signature = EMPTY_SIGNATURE
+            if remote_size is None or remote_size >= SMALL_FILE_THRESHOLD:
+                local_signature = calculate_file_signature(f, len(base))
+
+            with context.client.sync.stream_diff(self.path, local_signature) as (
+                expected_hash,
+                diff_chunks,
+            ):
+                fd, tmp_path = make_temp_file(abs_path)
+                try:
+                    with os.fdopen(fd, "wb") as out:
+                        new_hash = apply_diff_stream(base, diff_chunks, out)
+                    if new_hash != expected_hash:
+                        # TODO error handling
+                        raise ValueError("Hash mismatch after applying diff")
+                except BaseException:
+                    Path(tmp_path).unlink(missing_ok=True)
+                    raise
+
+        os.replace(tmp_path, abs_path)
         self.status = SyncStatus.SYNCED
 
     def process_rejection(self, context: SyftBoxContextInterface, reason: Optional[str] = None) -> None:
@@ -250,7 +271,9 @@ class ModifyRemoteAction(SyncAction):
         local_data = abs_path.read_bytes()
         if self.remote_metadata is None:
             raise ValueError("Remote metadata is required for modify remote action")
-        diff = py_fast_rsync.diff(self.remote_metadata.signature_bytes, local_data)
+        if self.remote_metadata.signature is None:
+            raise ValueError("Remote signature is required for modify remote action")
+        diff = calculate_diff(self.remote_metadata.signature, local_data)
         if self.local_metadata is None:
             raise ValueError("Local metadata is required for modify remote action")
         context.client.sync.apply_diff(
@@ -123,6 +123,19 @@ def get_status_info(
     return items_paginated
 
 
+@router.get("/state/summary")
+def get_status_summary(sync_manager: SyncManager = Depends(get_sync_manager)) -> JSONResponse:
+    """Number of status updates per status, and the most recent errors"""
+    local_state = sync_manager.local_state
+    recent_errors = sort_status_info(list(local_state.recent_errors.values()), "timestamp", "desc")
+    return JSONResponse(
+        content={
+            "status_counts": {status.value: count for status, count in local_state.status_counts.items()},
+            "recent_errors": [info.model_dump(mode="json") for info in recent_errors],
+        }
+    )
+
+
 @router.get("/")
 def sync_dashboard(context: APIContext) -> HTMLResponse:
     template = jinja_env.get_template("sync_dashboard.jinja2")
@@ -1,26 +1,177 @@
 import base64
+import hashlib
+import os
+import queue
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Union
+from typing import Any, Iterator, Optional, Union
 
 import httpx
 import msgpack
-from pydantic import BaseModel
+from loguru import logger
 from tqdm import tqdm
 
 from syftbox.client.base import ClientBase
-from syftbox.server.models.sync_models import ApplyDiffResponse, DiffResponse, FileMetadata, RelativePath
+from syftbox.lib.compression import compress, negotiate_encoding, preferred_encoding, should_compress
+from syftbox.lib.hash import HASH_CHUNK_SIZE, summary_hash
+from syftbox.lib.http import HEADER_SYFTBOX_FILE_HASH
+from syftbox.server.models.sync_models import (
+    ApplyDiffResponse,
+    DiffResponse,
+    DirHash,
+    FileMetadata,
+    FileRecord,
+)
 
 # TODO move shared models to lib/models
 
-
-class StreamedFile(BaseModel):
-    path: RelativePath
-    content: bytes
-
-    def write_bytes(self, output_dir: Path) -> None:
-        file_path = output_dir / self.path
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        file_path.write_bytes(self.content)
+# Number of threads writing downloaded files to disk
+DOWNLOAD_WRITER_WORKERS = 4
+# Maximum number of downloaded files waiting to be written, bounds the memory used by a bulk download
+DOWNLOAD_QUEUE_SIZE = 32
+
+# Files are written to a hidden temporary file next to their destination, `.<name>.<random>.tmp`
+TEMP_FILE_PATTERN = re.compile(r"^\..+\.[a-z0-9_]{8}\.tmp$")
+
+
+def make_temp_file(abs_path: Path) -> tuple[int, str]:
+    """Create a temporary file next to `abs_path`. Temporary files are hidden, so they are never synced."""
+    return tempfile.mkstemp(dir=abs_path.parent, prefix=f".{abs_path.name}.", suffix=".tmp")
+
+
+def remove_temp_files(root: Path) -> int:
+    """
+    Remove temporary files left behind in `root` by interrupted writes. Must not run while files are written.
+
+    Returns:
+        int: The number of removed files.
+    """
+    num_removed = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if TEMP_FILE_PATTERN.match(filename):
+                try:
+                    os.unlink(os.path.join(dirpath, filename))
+                    num_removed += 1
+                except OSError as e:
+                    logger.warning(f"Failed to remove temporary file {filename} in {dirpath}: {e}")
+    return num_removed
+
+
+def write_file_atomic(output_dir: Path, relative_path: str, content: bytes) -> FileRecord:
+    """
+    Write a file to a temporary file next to its destination and rename it, so partially written files are
+    never visible. The content is hashed while it is written.
+
+    Raises:
+        ValueError: If the path is not a relative path inside output_dir.
+    """
+    path = Path(relative_path)
+    if path.is_absolute() or ".." in path.parts:
+        raise ValueError(f"Invalid path {relative_path}, path must be relative")
+
+    abs_path = output_dir / path
+    abs_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = make_temp_file(abs_path)
+    sha256 = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            view = memoryview(content)
+            for start in range(0, len(view), HASH_CHUNK_SIZE):
+                chunk = view[start : start + HASH_CHUNK_SIZE]
+                sha256.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, abs_path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+    return FileRecord(
+        path=path.as_posix(),
+        digest=sha256.digest(),
+        file_size=len(content),
+        mtime_ns=abs_path.stat().st_mtime_ns,
+    )
+
+
+def is_missing_route(response: httpx.Response) -> bool:
+    """
+    True if the server does not have the requested endpoint, for example an older server without the raw endpoints.
+    FastAPI responds to unknown routes with a 404 and the default `Not Found` detail, unlike a 404 of a handler,
+    which includes a reason like `file not found`.
+    """
+    if response.status_code != 404:
+        return False
+    try:
+        return response.json() == {"detail": "Not Found"}
+    except ValueError:
+        return False
+
+
+def encode_request_content(relative_path: Path, data: bytes, encoding: Optional[str]) -> tuple[bytes, dict[str, str]]:
+    """Raw request body and headers for uploading `data`, compressed with `encoding` if it is worth compressing."""
+    headers = {"Content-Type": "application/octet-stream"}
+    if encoding is None or not should_compress(relative_path, len(data)):
+        return data, headers
+    headers["Content-Encoding"] = encoding
+    return compress(data, encoding), headers
+
+
+class StreamedFileWriter:
+    """
+    Writes streamed files to disk with a pool of writer threads, so slow disk writes do not stall reading
+    from the network. Files are passed to the writers through a bounded queue, `put` blocks if the queue is full.
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        max_workers: int = DOWNLOAD_WRITER_WORKERS,
+        queue_size: int = DOWNLOAD_QUEUE_SIZE,
+        pbar: Optional[tqdm] = None,
+    ) -> None:
+        self.output_dir = output_dir
+        self.pbar = pbar
+        self.written_files: list[FileRecord] = []
+        self._queue: queue.Queue[Optional[tuple[str, bytes]]] = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._write_files, name=f"StreamedFileWriter-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def put(self, relative_path: str, content: bytes) -> None:
+        self._queue.put((relative_path, content))
+
+    def close(self) -> list[FileRecord]:
+        """Wait until all queued files are written, and return the written files."""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        return self.written_files
+
+    def _write_files(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            relative_path, content = item
+            try:
+                record = write_file_atomic(self.output_dir, relative_path, content)
+            except Exception as e:
+                # Files that failed to write are retried individually by the consumer
+                logger.error(f"Failed to write downloaded file {relative_path}: {e}")
+                continue
+            with self._lock:
+                self.written_files.append(record)
+            if self.pbar is not None:
+                self.pbar.update(1)
 
 
 class SyftBoxClient(ClientBase):
@@ -59,52 +210,157 @@ class AuthClient(ClientBase):
 
 
 class SyncClient(ClientBase):
-    def get_datasite_states(self) -> dict[str, list[FileMetadata]]:
+    def __init__(self, conn: httpx.Client):
+        super().__init__(conn)
+        # Compression of uploads, None if the server does not support any compression
+        self.request_encoding: Optional[str] = preferred_encoding()
+        # Servers without the raw endpoints are sent base85 encoded JSON and multipart requests
+        self.raw_endpoints = True
+
+    def _post_content(self, url: str, params: dict[str, str], relative_path: Path, data: bytes) -> httpx.Response:
+        """POST data as raw request body. If the server does not support the compression, retries with
+        an encoding from the `Accept-Encoding` header of the response."""
+        content, headers = encode_request_content(relative_path, data, self.request_encoding)
+        response = self.conn.post(url, params=params, content=content, headers=headers)
+        if response.status_code == 415 and "Content-Encoding" in headers:
+            self.request_encoding = negotiate_encoding(response.headers.get("accept-encoding"))
+            content, headers = encode_request_content(relative_path, data, self.request_encoding)
+            response = self.conn.post(url, params=params, content=content, headers=headers)
+        return response
+
+    def get_datasite_states(self) -> dict[str, list[FileRecord]]:
         response = self.conn.post("/sync/datasite_states")
         self.raise_for_status(response)
         data = response.json()
 
         result = {}
         for email, metadata_list in data.items():
-            result[email] = [FileMetadata(**item) for item in metadata_list]
+            result[email] = [FileRecord.from_json(item) for item in metadata_list]
 
         return result
 
-    def get_remote_state(self, relative_path: Path) -> list[FileMetadata]:
+    def get_datasite_listings(self) -> dict[str, tuple[str, list[FileRecord]]]:
+        """Get the files of all datasites the user can read, with the summary hash of each datasite.
+        Servers without the listings endpoint fall back to `get_datasite_states`.
+
+        Returns:
+            dict mapping each datasite to a tuple of (summary hash, files)
+        """
+        response = self.conn.post("/sync/datasite_listings")
+        if is_missing_route(response):
+            return {
+                email: (summary_hash((record.path, record.hash) for record in records), records)
+                for email, records in self.get_datasite_states().items()
+            }
+        self.raise_for_status(response)
+        data = response.json()
+
+        return {
+            email: (listing["summary_hash"], [FileRecord.from_json(item) for item in listing["files"]])
+            for email, listing in data.items()
+        }
+
+    def get_remote_state(self, relative_path: Path) -> list[FileRecord]:
         response = self.conn.post("/sync/dir_state", params={"dir": relative_path.as_posix()})
         self.raise_for_status(response)
         data = response.json()
-        return [FileMetadata(**item) for item in data]
+        return [FileRecord.from_json(item) for item in data]
+
+    def get_tree(self, relative_path: Path, depth: Optional[int] = None) -> list[DirHash]:
+        """Get the summary hashes of a directory and its subdirectories, up to `depth` levels below the directory."""
+        params: dict[str, Any] = {"path": relative_path.as_posix()}
+        if depth is not None:
+            params["depth"] = depth
+        response = self.conn.post("/sync/tree", params=params)
+        self.raise_for_status(response)
+        return [DirHash(**item) for item in response.json()]
 
     def get_metadata(self, path: Path) -> FileMetadata:
         response = self.conn.post("/sync/get_metadata", json={"path": path.as_posix()})
         self.raise_for_status(response)
         return FileMetadata(**response.json())
 
+    def has_permission(self, relative_path: Path, permission: str) -> Optional[bool]:
+        """Check if the user has `permission` (read, create, write or admin) for a path on the server.
+        Returns None if the server does not support permission checks."""
+        response = self.conn.post(
+            "/sync/has_permission", params={"path": relative_path.as_posix(), "permission": permission}
+        )
+        if is_missing_route(response):
+            return None
+        self.raise_for_status(response)
+        return response.json()
+
     def get_diff(self, relative_path: Path, signature: Union[str, bytes]) -> DiffResponse:
         """Get rsync-style diff between local and remote file.
 
         Args:
             relative_path: Path to file relative to workspace root
-            signature: b85 encoded signature of the local file
+            signature: signature of the local file, raw or b85 encoded
 
         Returns:
             DiffResponse containing the diff and expected hash
         """
-        if not isinstance(signature, str):
-            signature = base64.b85encode(signature).decode("utf-8")
+        if isinstance(signature, str):
+            signature = base64.b85decode(signature)
+
+        if self.raw_endpoints:
+            # Signatures are incompressible, they are always sent as-is
+            response = self.conn.post(
+                "/sync/get_diff_raw",
+                params={"path": relative_path.as_posix()},
+                content=signature,
+                headers={"Content-Type": "application/octet-stream"},
+            )
+            if not is_missing_route(response):
+                self.raise_for_status(response)
+                return DiffResponse(
+                    path=relative_path, diff=response.content, hash=response.headers[HEADER_SYFTBOX_FILE_HASH]
+                )
+            self.raw_endpoints = False
 
         response = self.conn.post(
             "/sync/get_diff",
             json={
                 "path": relative_path.as_posix(),
-                "signature": signature,
+                "signature": base64.b85encode(signature).decode("utf-8"),
             },
         )
 
         self.raise_for_status(response)
         return DiffResponse(**response.json())
 
+    @contextmanager
+    def stream_diff(self, relative_path: Path, signature: bytes) -> Iterator[tuple[str, Iterator[bytes]]]:
+        """Stream the rsync-style diff between local and remote file, without loading it in memory.
+
+        Args:
+            relative_path: Path to file relative to workspace root
+            signature: raw signature of the local file
+
+        Yields:
+            tuple of the hash of the remote file, and an iterator over the chunks of the diff
+        """
+        if self.raw_endpoints:
+            # Signatures are incompressible, they are always sent as-is
+            with self.conn.stream(
+                "POST",
+                "/sync/get_diff_raw",
+                params={"path": relative_path.as_posix()},
+                content=signature,
+                headers={"Content-Type": "application/octet-stream"},
+            ) as response:
+                if response.status_code != 200:
+                    response.read()
+                if not is_missing_route(response):
+                    self.raise_for_status(response)
+                    yield response.headers[HEADER_SYFTBOX_FILE_HASH], response.iter_bytes()
+                    return
+                self.raw_endpoints = False
+
+        diff = self.get_diff(relative_path, signature)
+        yield diff.hash, iter([diff.diff])
+
     def apply_diff(self, relative_path: Path, diff: Union[str, bytes], expected_hash: str) -> ApplyDiffResponse:
         """Apply an rsync-style diff to update a remote file.
 
@@ -116,14 +372,26 @@ class SyncClient(ClientBase):
         Returns:
             ApplyDiffResponse containing the result of applying the diff
         """
-        if not isinstance(diff, str):
-            diff = base64.b85encode(diff).decode("utf-8")
+        if isinstance(diff, str):
+            diff = base64.b85decode(diff)
+
+        if self.raw_endpoints:
+            response = self._post_content(
+                "/sync/apply_diff_raw",
+                params={"path": relative_path.as_posix(), "expected_hash": expected_hash},
+                relative_path=relative_path,
+                data=diff,
+            )
+            if not is_missing_route(response):
+                self.raise_for_status(response)
+                return ApplyDiffResponse(**response.json())
+            self.raw_endpoints = False
 
         response = self.conn.post(
             "/sync/apply_diff",
             json={
                 "path": relative_path.as_posix(),
-                "diff": diff,
+                "diff": base64.b85encode(diff).decode("utf-8"),
                 "expected_hash": expected_hash,
             },
         )
@@ -136,6 +404,19 @@ class SyncClient(ClientBase):
         self.raise_for_status(response)
 
     def create(self, relative_path: Path, data: bytes) -> None:
+        """Upload a new file, compressed if the file type is not compressed already."""
+        if self.raw_endpoints:
+            response = self._post_content(
+                "/sync/upload",
+                params={"path": relative_path.as_posix()},
+                relative_path=relative_path,
+                data=data,
+            )
+            if not is_missing_route(response):
+                self.raise_for_status(response)
+                return
+            self.raw_endpoints = False
+
         response = self.conn.post(
             "/sync/create",
             files={"file": (relative_path.as_posix(), data, "text/plain")},
@@ -147,34 +428,52 @@ class SyncClient(ClientBase):
         self.raise_for_status(response)
         return response.content
 
-    def download_files_streaming(self, relative_paths: list[Path], output_dir: Path) -> list[RelativePath]:
+    def download_files_streaming(
+        self, relative_paths: list[Path], output_dir: Path, pbar: Optional[tqdm] = None
+    ) -> list[FileRecord]:
+        """
+        Download files in a single streaming request, and write them to output_dir.
+
+        Args:
+            relative_paths: Paths of the files to download
+            output_dir: Directory the files are written to
+            pbar: Progress bar to update, if not provided a new progress bar is created and closed after the download.
+
+        Returns:
+            list[FileRecord]: The written files, hashed while writing.
+        """
         if not relative_paths:
             return []
         relative_str_paths: list[str] = [Path(path).as_posix() for path in relative_paths]
 
-        pbar = tqdm(
-            total=len(relative_str_paths), desc="Downloading files", unit="file", mininterval=1.0, dynamic_ncols=True
-        )
-        extracted_files = []
-
-        with self.conn.stream(
-            "POST",
-            "/sync/download_bulk",
-            json={"paths": relative_str_paths},
-        ) as response:
-            response.raise_for_status()
-
-            unpacker = msgpack.Unpacker(
-                raw=False,
+        owns_pbar = pbar is None
+        if pbar is None:
+            pbar = tqdm(
+                total=len(relative_str_paths),
+                desc="Downloading files",
+                unit="file",
+                mininterval=1.0,
+                dynamic_ncols=True,
             )
-
-            for chunk in response.iter_bytes():
-                unpacker.feed(chunk)
-                for file_json in unpacker:
-                    file = StreamedFile.model_validate(file_json)
-                    file.write_bytes(output_dir)
-                    extracted_files.append(file.path)
-                    pbar.update(1)
-
-        pbar.close()
-        return extracted_files
+        writer = StreamedFileWriter(output_dir, pbar=pbar)
+        try:
+            with self.conn.stream(
+                "POST",
+                "/sync/download_bulk",
+                json={"paths": relative_str_paths},
+            ) as response:
+                response.raise_for_status()
+
+                unpacker = msgpack.Unpacker(
+                    raw=False,
+                )
+
+                for chunk in response.iter_bytes():
+                    unpacker.feed(chunk)
+                    for file_json in unpacker:
+                        writer.put(file_json["path"], file_json["content"])
+        finally:
+            written_files = writer.close()
+            if owns_pbar:
+                pbar.close()
+        return written_files
@@ -11,6 +11,10 @@ from typing_extensions import Self
 
 from syftbox.client.utils.net import get_free_port
 from syftbox.lib.constants import (
+    DEFAULT_CLIENT_HTTP2,
+    DEFAULT_CLIENT_KEEPALIVE_EXPIRY,
+    DEFAULT_CLIENT_MAX_CONNECTIONS,
+    DEFAULT_CLIENT_MAX_KEEPALIVE_CONNECTIONS,
     DEFAULT_CLIENT_TIMEOUT,
     DEFAULT_CONFIG_PATH,
     DEFAULT_DATA_DIR,
@@ -29,6 +33,8 @@ DATA_DIR_ENV = "SYFTBOX_DATA_DIR"
 PORT_ENV = "SYFTBOX_PORT"
 ACCESS_TOKEN_ENV = "SYFTBOX_ACCESS_TOKEN"
 CLIENT_TIMEOUT_ENV = "SYFTBOX_CLIENT_TIMEOUT"
+CLIENT_MAX_CONNECTIONS_ENV = "SYFTBOX_CLIENT_MAX_CONNECTIONS"
+CLIENT_HTTP2_ENV = "SYFTBOX_CLIENT_HTTP2"
 
 # Old configuration file path for the client
 LEGACY_CONFIG_NAME = "client_config.json"
@@ -79,6 +85,28 @@ class SyftClientConfig(BaseModel):
     )
     """Timeout used by the client connection to the SyftBox server"""
 
+    client_max_connections: int = Field(
+        default=DEFAULT_CLIENT_MAX_CONNECTIONS, description="Maximum number of connections to the SyftBox server"
+    )
+    """Maximum number of connections to the SyftBox server"""
+
+    client_max_keepalive_connections: int = Field(
+        default=DEFAULT_CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+        description="Maximum number of idle connections kept open to the SyftBox server",
+    )
+    """Maximum number of idle connections kept open to the SyftBox server"""
+
+    client_keepalive_expiry: float = Field(
+        default=DEFAULT_CLIENT_KEEPALIVE_EXPIRY, description="Seconds after which an idle connection is closed"
+    )
+    """Seconds after which an idle connection is closed"""
+
+    client_http2: bool = Field(
+        default=DEFAULT_CLIENT_HTTP2,
+        description="Multiplex requests over HTTP/2 connections, if the `h2` package is installed",
+    )
+    """Multiplex requests over HTTP/2 connections, if the `h2` package is installed"""
+
     @field_validator("client_url", mode="before")
     def port_to_url(cls, val: Union[int, str]) -> Optional[str]:
         if isinstance(val, int):
@@ -113,6 +141,9 @@ class SyftClientConfig(BaseModel):
         - SYFTBOX_DATA_DIR: Directory to store synced data
         - SYFTBOX_SERVER_URL: URL of the remote SyftBox server
         - SYFTBOX_PORT: Port for the local client (defaults to 8000)
+        - SYFTBOX_CLIENT_TIMEOUT: Timeout of the connection to the SyftBox server
+        - SYFTBOX_CLIENT_MAX_CONNECTIONS: Maximum number of connections to the SyftBox server
+        - SYFTBOX_CLIENT_HTTP2: Use HTTP/2 for the connection to the SyftBox server (true/false)
 
         Raises ValueError if required configuration is missing.
         """
@@ -135,6 +166,10 @@ class SyftClientConfig(BaseModel):
             config_args["server_url"] = os.environ[SERVER_URL_ENV]
         if CLIENT_TIMEOUT_ENV in os.environ:
             config_args["client_timeout"] = float(os.environ[CLIENT_TIMEOUT_ENV])
+        if CLIENT_MAX_CONNECTIONS_ENV in os.environ:
+            config_args["client_max_connections"] = int(os.environ[CLIENT_MAX_CONNECTIONS_ENV])
+        if CLIENT_HTTP2_ENV in os.environ:
+            config_args["client_http2"] = os.environ[CLIENT_HTTP2_ENV].lower() in ("1", "true", "yes")
         if EMAIL_ENV in os.environ:
             config_args["email"] = os.environ[EMAIL_ENV]
         if ACCESS_TOKEN_ENV in os.environ:
@@ -0,0 +1,118 @@
+"""
+Compression of request bodies sent to the SyftBox server.
+
+Request bodies are compressed with zstd if the optional `zstandard` package is installed, and gzip otherwise.
+The encoding is sent in the `Content-Encoding` header. Files that are already compressed are sent as-is.
+"""
+
+import gzip
+import io
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+ENCODING_ZSTD = "zstd"
+ENCODING_GZIP = "gzip"
+ENCODING_IDENTITY = "identity"
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 5
+
+# File types that are compressed already, compressing them again only costs CPU
+COMPRESSED_SUFFIXES = frozenset(
+    {
+        # archives
+        ".7z", ".br", ".bz2", ".gz", ".lz4", ".rar", ".tgz", ".whl", ".xz", ".zip", ".zst",
+        # images, audio and video
+        ".avif", ".gif", ".heic", ".jpeg", ".jpg", ".png", ".webp",
+        ".aac", ".flac", ".m4a", ".mp3", ".ogg", ".opus",
+        ".avi", ".mkv", ".mov", ".mp4", ".webm",
+        # documents and data formats with built-in compression
+        ".docx", ".jar", ".npz", ".odt", ".parquet", ".pdf", ".pptx", ".xlsx",
+    }
+)  # fmt: skip
+
+
+def zstd_available() -> bool:
+    return zstandard is not None
+
+
+def preferred_encoding() -> str:
+    return ENCODING_ZSTD if zstd_available() else ENCODING_GZIP
+
+
+def supported_encodings() -> list[str]:
+    """Encodings that can be decompressed, in order of preference"""
+    encodings = [ENCODING_GZIP]
+    if zstd_available():
+        encodings.insert(0, ENCODING_ZSTD)
+    return encodings
+
+
+def should_compress(path: Union[str, Path], size: int) -> bool:
+    return size >= MIN_COMPRESS_SIZE and Path(path).suffix.lower() not in COMPRESSED_SUFFIXES
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == ENCODING_IDENTITY:
+        return data
+    if encoding == ENCODING_GZIP:
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    if encoding == ENCODING_ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def decompress(data: bytes, encoding: Optional[str], max_size: Optional[int] = None) -> bytes:
+    """
+    Decompress `data` compressed with `encoding`.
+
+    Raises:
+        ValueError: if the encoding is not supported, the data is invalid, or decompresses to more than `max_size` bytes.
+    """
+    encoding = (encoding or ENCODING_IDENTITY).strip().lower()
+    if encoding == ENCODING_IDENTITY:
+        return data
+
+    reader: Union[gzip.GzipFile, BinaryIO]
+    if encoding == ENCODING_GZIP:
+        reader = gzip.GzipFile(fileobj=io.BytesIO(data))
+    elif encoding == ENCODING_ZSTD and zstandard is not None:
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+    else:
+        raise ValueError(f"Unsupported encoding: {encoding}")
+
+    invalid_data_errors: tuple[type[Exception], ...] = (OSError, EOFError, zlib.error)
+    if zstandard is not None:
+        invalid_data_errors += (zstandard.ZstdError,)
+    try:
+        # Read at most max_size + 1 bytes, to protect against decompression bombs
+        with reader:
+            result = reader.read(-1 if max_size is None else max_size + 1)
+    except invalid_data_errors as e:
+        raise ValueError(f"Invalid {encoding} data: {e}") from e
+
+    if max_size is not None and len(result) > max_size:
+        raise ValueError(f"Decompressed data is larger than {max_size} bytes")
+    return result
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick the preferred supported encoding from an `Accept-Encoding` header.
+    Returns None if the header does not include any supported encoding.
+    """
+    if not accept_encoding:
+        return None
+    accepted = {value.split(";")[0].strip().lower() for value in accept_encoding.split(",")}
+    for encoding in supported_encodings():
+        if encoding in accepted:
+            return encoding
+    return None
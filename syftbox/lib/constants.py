@@ -30,3 +30,9 @@ SENDGRID_API_URL = "https://api.sendgrid.com/v3/mail/send"
 DEFAULT_BENCHMARK_RUNS = 5
 
 DEFAULT_CLIENT_TIMEOUT = 5
+
+# Connection pool of the client connection to the SyftBox server
+DEFAULT_CLIENT_MAX_CONNECTIONS = 32
+DEFAULT_CLIENT_MAX_KEEPALIVE_CONNECTIONS = 16
+DEFAULT_CLIENT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_CLIENT_HTTP2 = True
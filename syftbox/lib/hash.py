@@ -1,5 +1,6 @@
-import base64
 import hashlib
+import os
+from collections.abc import Iterable
 from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
 from functools import partial
@@ -7,10 +8,18 @@ from pathlib import Path
 from typing import Optional, Union
 
 from loguru import logger
-from py_fast_rsync import signature
 
-from syftbox.lib.ignore import filter_ignored_paths
-from syftbox.server.models.sync_models import FileMetadata
+from syftbox.lib.ignore import scan_dir
+from syftbox.lib.rsync import calculate_signature
+from syftbox.server.models.sync_models import FileMetadata, FileRecord
+
+# Files are hashed in chunks of this size, to avoid reading large files in memory
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Summary hashes are the sum of the sha256 hashes of all entries, modulo 2**256.
+# The sum does not depend on the order of the entries, and can be updated when a single entry changes.
+SUMMARY_HASH_MODULUS = 2**256
+EMPTY_SUMMARY_HASH = "0" * 64
 
 
 def hash_file(file_path: Path, root_dir: Optional[Path] = None) -> Optional[FileMetadata]:
@@ -33,7 +42,7 @@ def hash_file(file_path: Path, root_dir: Optional[Path] = None) -> Optional[File
         return FileMetadata(
             path=path,
             hash=hashlib.sha256(data).hexdigest(),
-            signature=base64.b85encode(signature.calculate(data)),
+            signature=calculate_signature(data),
             file_size=len(data),
             last_modified=datetime.fromtimestamp(file_path.stat().st_mtime, timezone.utc),
         )
@@ -42,6 +51,32 @@ def hash_file(file_path: Path, root_dir: Optional[Path] = None) -> Optional[File
         return None
 
 
+def hash_file_record(file_path: Path, root_dir: Path) -> Optional[FileRecord]:
+    """Hash a file into a FileRecord. Unlike `hash_file`, the rsync signature is not calculated."""
+    try:
+        stat = file_path.stat()
+        if stat.st_size > 100_000_000:
+            logger.warning(f"File too large: {file_path}")
+            return None
+
+        sha256 = hashlib.sha256()
+        file_size = 0
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                sha256.update(chunk)
+                file_size += len(chunk)
+
+        return FileRecord(
+            path=file_path.relative_to(root_dir).as_posix(),
+            digest=sha256.digest(),
+            file_size=file_size,
+            mtime_ns=stat.st_mtime_ns,
+        )
+    except Exception:
+        logger.error(f"Failed to hash file {file_path}")
+        return None
+
+
 def hash_files_parallel(files: list[Path], root_dir: Path) -> list[FileMetadata]:
     with ProcessPoolExecutor() as executor:
         results = list(executor.map(partial(hash_file, root_dir=root_dir), files))
@@ -53,31 +88,38 @@ def hash_files(files: list[Path], root_dir: Path) -> list[FileMetadata]:
     return [r for r in result if r is not None]
 
 
+def hash_file_records(relative_paths: Iterable[Path], root_dir: Path) -> list[FileRecord]:
+    """hash files relative to root_dir, files that cannot be hashed are skipped."""
+    records = [hash_file_record(root_dir / file, root_dir) for file in relative_paths]
+    return [r for r in records if r is not None]
+
+
 def hash_dir(
     dir: Path,
     root_dir: Path,
     filter_ignored: bool = True,
-) -> list[FileMetadata]:
+    recursive: bool = True,
+) -> list[FileRecord]:
     """
-    hash all files in dir recursively, return a list of FileMetadata.
+    hash all files in dir, recursively unless specified, return a list of FileRecord.
 
     ignore_folders should be relative to root_dir.
     returned Paths are relative to root_dir.
     """
-    files = collect_files(dir)
-
-    relative_paths = [file.relative_to(root_dir) for file in files]
     if filter_ignored:
-        relative_paths = filter_ignored_paths(root_dir, relative_paths)
+        # Ignored directories are not walked, e.g. .venv or __pycache__
+        relative_paths = scan_dir(root_dir, dir, recursive=recursive).included
+    else:
+        relative_paths = [file.relative_to(root_dir) for file in collect_files(dir, recursive=recursive)]
 
-    absolute_paths = [root_dir / file for file in relative_paths]
-    return hash_files(absolute_paths, root_dir)
+    return hash_file_records(relative_paths, root_dir)
 
 
 def collect_files(
     dir: Union[Path, str],
     include_hidden: bool = False,
     follow_symlinks: bool = False,
+    recursive: bool = True,
 ) -> list[Path]:
     """Collect files recursively, excluding files in hidden/symlinked directories unless specified."""
     dir = Path(dir)
@@ -97,10 +139,71 @@ def collect_files(
 
             if entry.is_file():
                 files.append(entry)
-            elif entry.is_dir():
+            elif recursive and entry.is_dir():
                 files.extend(collect_files(entry, include_hidden, follow_symlinks))
 
         except OSError:
             continue
 
     return files
+
+
+def summary_entry_hash(key: str, value: str) -> int:
+    return int.from_bytes(hashlib.sha256(f"{key}\0{value}".encode()).digest(), "big")
+
+
+def summary_hash(entries: Iterable[tuple[str, str]]) -> str:
+    """
+    Order independent summary hash of (key, value) entries, e.g. (path, content hash) of all files in a datasite.
+    Two sets of entries have the same summary if and only if they contain the same entries (up to hash collisions).
+    """
+    total = sum(summary_entry_hash(key, value) for key, value in entries) % SUMMARY_HASH_MODULUS
+    return f"{total:064x}"
+
+
+def dir_summary_hashes(entries: Iterable[tuple[str, str]]) -> dict[str, tuple[str, str, int]]:
+    """
+    Summary hashes of all directories in a list of (posix path, content hash) file entries.
+
+    Returns:
+        dict mapping each directory to a tuple of (summary hash of all files in the directory and its subdirectories,
+            summary hash of the files directly in the directory, number of files in the directory and its subdirectories)
+    """
+    totals: dict[str, list[int]] = {}
+    for path, hash in entries:
+        entry_hash = summary_entry_hash(path, hash)
+        parts = path.split("/")
+        for depth in range(1, len(parts)):
+            dir_total = totals.setdefault("/".join(parts[:depth]), [0, 0, 0])
+            dir_total[0] += entry_hash
+            dir_total[2] += 1
+            if depth == len(parts) - 1:
+                dir_total[1] += entry_hash
+    return {
+        dir: (f"{dir_hash % SUMMARY_HASH_MODULUS:064x}", f"{files_hash % SUMMARY_HASH_MODULUS:064x}", file_count)
+        for dir, (dir_hash, files_hash, file_count) in totals.items()
+    }
+
+
+def stat_summary_hash(dir: Path) -> str:
+    """
+    Summary hash of the relative path, size and modification time of all files in dir, without reading any file.
+    Hidden and symlinked entries are skipped, same as `collect_files`.
+    """
+    prefix_len = len(os.path.join(str(dir), ""))
+
+    def _iter_entries(path: str) -> Iterable[tuple[str, str]]:
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name.startswith(".") or entry.is_symlink():
+                        continue
+                    if entry.is_file():
+                        stat = entry.stat()
+                        yield entry.path[prefix_len:], f"{stat.st_size}:{stat.st_mtime_ns}"
+                    elif entry.is_dir():
+                        yield from _iter_entries(entry.path)
+        except OSError:
+            return
+
+    return summary_hash(_iter_entries(str(dir)))
@@ -8,6 +8,8 @@ HEADER_SYFTBOX_PYTHON = "x-syftbox-python"
 HEADER_OS_NAME = "x-os-name"
 HEADER_OS_VERSION = "x-os-ver"
 HEADER_OS_ARCH = "x-os-arch"
+# sha256 of the file a raw rsync diff applies to
+HEADER_SYFTBOX_FILE_HASH = "x-syftbox-file-hash"
 # HEADER_GEO_COUNTRY = "x-geo-country"  # Country of the user, added by Azure Front Door
 
 SYFTBOX_HEADERS = {
@@ -1,8 +1,13 @@
+import os
+import re
+import threading
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
 import pathspec
 from loguru import logger
+from pathspec.util import normalize_file
 
 from syftbox.lib.constants import REJECTED_FILE_SUFFIX
 from syftbox.lib.types import PathLike, to_path
@@ -62,32 +67,141 @@ def get_ignore_rules(dir: Path) -> Optional[pathspec.PathSpec]:
     return None
 
 
-def is_within_symlinked_path(path: Path, datasites_dir: PathLike) -> bool:
+class IgnoreMatcher:
+    """
+    Gitignore-style rules compiled into a single regex, with the same results as `pathspec.PathSpec.match_file`.
+
+    pathspec matches a path against every pattern in turn, and the last matching pattern decides if the path is
+    ignored. Here all patterns are combined into one alternation in reverse order, so the first alternative that
+    matches is the last matching pattern. Each alternative is a named group, `lastgroup` tells which one matched.
+    """
+
+    def __init__(self, spec: pathspec.PathSpec) -> None:
+        alternatives = []
+        self._includes: dict[str, bool] = {}
+        for index, pattern in reversed(list(enumerate(spec.patterns))):
+            regex = getattr(pattern, "regex", None)
+            if pattern.include is None or regex is None:
+                continue
+            name = f"p{index}"
+            # Named groups of the individual patterns would clash, they are not needed for matching
+            alternatives.append(f"(?P<{name}>{re.sub(r'[(][?]P<[^>]+>', '(?:', regex.pattern)})")
+            self._includes[name] = pattern.include
+
+        self.has_negations = not all(self._includes.values())
+        self._regex = re.compile("|".join(alternatives)) if alternatives else None
+
+    @classmethod
+    def from_lines(cls, lines: list[str]) -> "IgnoreMatcher":
+        return cls(pathspec.PathSpec.from_lines("gitwildmatch", lines))
+
+    def match_file(self, path: Union[str, Path]) -> bool:
+        """True if the path, relative to the ignore file, is ignored"""
+        if self._regex is None:
+            return False
+        match = self._regex.match(normalize_file(path))
+        if match is None:
+            return False
+        if not self.has_negations:
+            return True
+        return self._includes[match.lastgroup]  # type: ignore[index]
+
+    def match_dir(self, path: Union[str, Path]) -> bool:
+        """
+        True if all files in the directory are ignored, so it does not have to be walked.
+
+        With negated patterns a file can be re-included in an ignored directory, so nothing is pruned.
+        """
+        if self.has_negations:
+            return False
+        return self.match_file(normalize_file(path) + "/")
+
+
+# Compiled ignore rules per ignore file, invalidated when the file is modified
+_matcher_cache: dict[str, tuple[tuple[int, int], IgnoreMatcher]] = {}
+_matcher_cache_lock = threading.Lock()
+
+
+def get_ignore_matcher(dir: Path) -> Optional[IgnoreMatcher]:
+    """
+    Get the compiled ignore rules from the _.syftignore file in the dir, or None if there is no ignore file.
+
+    The rules are only parsed again if the modification time or size of the ignore file changed.
+    """
+    ignore_file = os.fspath(to_path(dir) / IGNORE_FILENAME)
+    try:
+        stat = os.stat(ignore_file)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    with _matcher_cache_lock:
+        cached = _matcher_cache.get(ignore_file)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    rules = get_ignore_rules(dir)
+    if rules is None:
+        return None
+    matcher = IgnoreMatcher(rules)
+    with _matcher_cache_lock:
+        _matcher_cache[ignore_file] = (key, matcher)
+    return matcher
+
+
+def is_within_symlinked_path(
+    path: Path,
+    datasites_dir: PathLike,
+    symlinked_dirs: Optional[dict[Path, bool]] = None,
+) -> bool:
     """
     Returns True if the path is within a symlinked path.
 
-    Symlinks are checked up to the datasites_dir.
+    Symlinks are checked up to the datasites_dir. `symlinked_dirs` is an optional cache of directories to
+    whether they are (within) a symlinked path, to avoid checking shared ancestors again for each path.
     """
     base_dir = to_path(datasites_dir)
+    if symlinked_dirs is None:
+        symlinked_dirs = {}
+
+    unchecked = []
+    result = False
     for parent in path.parents:
         if parent == base_dir:
             break
+        cached = symlinked_dirs.get(parent)
+        if cached is not None:
+            result = cached
+            break
         if parent.is_symlink():
-            return True
-    return False
+            result = True
+            # Directories below a symlink are within a symlinked path, directories above it are unknown
+            symlinked_dirs[parent] = True
+            break
+        unchecked.append(parent)
+
+    for parent in unchecked:
+        symlinked_dirs[parent] = result
+    return result
 
 
-def is_symlinked_file(abs_path: Path, datasites_dir: PathLike) -> bool:
+def is_symlinked_file(
+    abs_path: Path,
+    datasites_dir: PathLike,
+    symlinked_dirs: Optional[dict[Path, bool]] = None,
+) -> bool:
     """True if this file is a symlink, or is inside a symlinked directory (recursive)"""
-    return abs_path.is_symlink() or is_within_symlinked_path(abs_path, datasites_dir)
+    return abs_path.is_symlink() or is_within_symlinked_path(abs_path, datasites_dir, symlinked_dirs)
 
 
 def filter_symlinks(datasites_dir: Path, relative_paths: list[Path]) -> list[Path]:
     result = []
+    # Most paths share their parent directories, each directory is only checked once
+    symlinked_dirs: dict[Path, bool] = {}
     for path in relative_paths:
         abs_path = datasites_dir / path
 
-        if not is_symlinked_file(abs_path, datasites_dir):
+        if not is_symlinked_file(abs_path, datasites_dir, symlinked_dirs):
             result.append(path)
     return result
 
@@ -144,13 +258,13 @@ def filter_ignored_paths(
     if ignore_rejected_files:
         relative_paths = filter_rejected_files(relative_paths)
 
-    ignore_rules = get_ignore_rules(datasites_dir)
-    if ignore_rules is None:
+    ignore_matcher = get_ignore_matcher(datasites_dir)
+    if ignore_matcher is None:
         return relative_paths
 
     filtered_paths = []
     for path in relative_paths:
-        if not ignore_rules.match_file(path):
+        if not ignore_matcher.match_file(path):
             filtered_paths.append(path)
 
     return filtered_paths
@@ -166,18 +280,96 @@ def get_syftignore_matches(
     If include_symlinks is False, symlinks are ignored.
     """
 
-    ignore_rules = get_ignore_rules(datasites_dir)
-    if ignore_rules is None:
+    ignore_matcher = get_ignore_matcher(datasites_dir)
+    if ignore_matcher is None:
         return []
 
     filtered_paths = []
+    symlinked_dirs: dict[Path, bool] = {}
     for path in relative_paths:
         abs_path = datasites_dir / path
-        if not include_symlinks and is_symlinked_file(abs_path, datasites_dir):
+        if not include_symlinks and is_symlinked_file(abs_path, datasites_dir, symlinked_dirs):
             continue
-        elif ignore_rules.match_file(path):
+        elif ignore_matcher.match_file(path):
             filtered_paths.append(path)
         elif _is_rejected_file(path):
             filtered_paths.append(path)
 
     return filtered_paths
+
+
+@dataclass
+class ScanResult:
+    """Files found by `scan_dir`, relative to the datasites dir"""
+
+    included: list[Path] = field(default_factory=list)
+    ignored: list[Path] = field(default_factory=list)
+
+
+def scan_dir(datasites_dir: PathLike, dir: Optional[PathLike] = None, recursive: bool = True) -> ScanResult:
+    """
+    Walk `dir` once, and split the files into included and ignored files with the same rules as
+    `filter_ignored_paths` and `get_syftignore_matches`:
+    - hidden and symlinked files and directories are skipped, they are neither included nor ignored.
+    - files that match the rules in the _.syftignore file, and rejected files are ignored.
+    - directories in which all files are ignored are not walked, the directory itself is added to the ignored paths.
+
+    Args:
+        datasites_dir (PathLike): Directory containing datasites and the _.syftignore file.
+        dir (PathLike, optional): Directory to walk, inside datasites_dir. Defaults to datasites_dir.
+        recursive (bool, optional): If False, only files directly in dir are returned. Defaults to True.
+
+    Returns:
+        ScanResult: included and ignored paths, relative to datasites_dir.
+    """
+    # Paths are not resolved, that would follow a symlinked dir
+    datasites_dir = Path(datasites_dir).expanduser().absolute()
+    dir = datasites_dir if dir is None else Path(dir).expanduser().absolute()
+    result = ScanResult()
+    if not dir.is_dir():
+        return result
+
+    ignore_matcher = get_ignore_matcher(datasites_dir)
+    relative_dir = dir.relative_to(datasites_dir)
+    prefix = ""
+    if relative_dir.parts:
+        # The rules for entries inside the walk also apply to the directory that is walked
+        if any(part.startswith(".") for part in relative_dir.parts) or is_symlinked_file(dir, datasites_dir):
+            return result
+        if ignore_matcher is not None and ignore_matcher.match_dir(relative_dir):
+            result.ignored.append(relative_dir)
+            return result
+        prefix = relative_dir.as_posix() + "/"
+
+    to_visit = [(os.fspath(dir), prefix)]
+    while to_visit:
+        abs_dir, prefix = to_visit.pop()
+        try:
+            entries = list(os.scandir(abs_dir))
+        except OSError:
+            continue
+
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                # DirEntry caches the file type from the directory listing, this does not stat each entry
+                if entry.is_symlink():
+                    continue
+                relative_path = prefix + entry.name
+                if entry.is_dir():
+                    if not recursive:
+                        continue
+                    if ignore_matcher is not None and ignore_matcher.match_dir(relative_path):
+                        result.ignored.append(Path(relative_path))
+                    else:
+                        to_visit.append((entry.path, relative_path + "/"))
+                elif entry.is_file():
+                    is_ignored = REJECTED_FILE_SUFFIX in entry.name or (
+                        ignore_matcher is not None and ignore_matcher.match_file(relative_path)
+                    )
+                    (result.ignored if is_ignored else result.included).append(Path(relative_path))
+            except OSError:
+                continue
+
+    return result
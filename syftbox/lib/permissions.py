@@ -1,23 +1,31 @@
 import json
 import re
 import sqlite3
+import threading
 import traceback
 from collections import defaultdict
 from enum import Enum
+from functools import cached_property, lru_cache
 from pathlib import Path
 from typing import List, Optional, Tuple, Union
 
-import wcmatch
+import wcmatch.glob
 import yaml
 from loguru import logger
 from pydantic import BaseModel, model_validator
-from wcmatch.glob import globmatch
 
 from syftbox.lib.constants import PERM_FILE
 from syftbox.lib.lib import SyftBoxContext
 from syftbox.lib.types import PathLike
 from syftbox.server.models.sync_models import AbsolutePath, RelativePath
 
+# Rules of deeper permfiles take precedence, and within a permfile later rules take precedence.
+# Both are combined in a single effective priority, with the rule priority in the lower bits.
+RULE_PRIORITY_BITS = 32
+
+# Compiled path patterns are cached per pattern and email, for rules with a {useremail} template
+PATH_PATTERN_CACHE_SIZE = 16384
+
 
 # TODO "Client" naming for SDK is confusing, it is a context for the syftbox lib
 # util
@@ -25,6 +33,18 @@ def issubpath(path1: RelativePath, path2: RelativePath) -> bool:
     return path1 in path2.parents
 
 
+@lru_cache(maxsize=PATH_PATTERN_CACHE_SIZE)
+def compile_path_pattern(pattern: str, email: Optional[str] = None) -> "re.Pattern[str]":
+    """
+    Regex for a rule path pattern, with `{useremail}` filled in with `email` if provided.
+    Matching the regex is equivalent to `globmatch(path, pattern, flags=GLOBSTAR)`, without parsing the pattern again.
+    """
+    if email is not None:
+        pattern = pattern.replace("{useremail}", email)
+    include_patterns, _ = wcmatch.glob.translate(pattern, flags=wcmatch.glob.GLOBSTAR)
+    return re.compile("|".join(include_patterns))
+
+
 class PermissionType(Enum):
     CREATE = 1
     READ = 2
@@ -57,6 +77,11 @@ class PermissionRule(BaseModel):
     def depth(self) -> int:
         return len(self.permfile_path.parts)
 
+    @property
+    def effective_priority(self) -> int:
+        """Order in which rules are applied, rules with a higher effective priority override lower ones."""
+        return (self.depth << RULE_PRIORITY_BITS) | self.priority
+
         # write model validator that accepts either a single string or a list of strings as permissions when initializing
 
     @model_validator(mode="before")
@@ -109,7 +134,7 @@ class PermissionRule(BaseModel):
 
     @classmethod
     def from_db_row(cls, row: sqlite3.Row) -> "PermissionRule":
-        """Create a PermissionRule from a database row"""
+        """Create a PermissionRule from a database row. Rows are validated when they are inserted, not here."""
         permissions = []
         if row["can_read"]:
             permissions.append(PermissionType.READ)
@@ -120,7 +145,7 @@ class PermissionRule(BaseModel):
         if row["admin"]:
             permissions.append(PermissionType.ADMIN)
 
-        return cls(
+        return cls.model_construct(
             dir_path=Path(row["permfile_path"]).parent,
             path=row["path"],
             user=row["user"],  # Default to all users since DB schema doesn't show user field
@@ -136,6 +161,7 @@ class PermissionRule(BaseModel):
             "permfile_dir": str(self.dir_path),
             "permfile_depth": self.depth,
             "priority": self.priority,
+            "effective_priority": self.effective_priority,
             "path": self.path,
             "user": self.user,
             "can_read": PermissionType.READ in self.permissions,
@@ -164,29 +190,40 @@ class PermissionRule(BaseModel):
             res["type"] = "disallow"
         return res
 
+    @cached_property
+    def dir_prefix(self) -> str:
+        """Prefix of all paths this rule can apply to"""
+        dir_path = self.dir_path.as_posix()
+        return "" if dir_path == "." else dir_path + "/"
+
+    def relative_file_path(self, filepath: str) -> Optional[str]:
+        """Path of `filepath` relative to the permfile dir, or None if the file is not below it."""
+        prefix = self.dir_prefix
+        if not filepath.startswith(prefix) or len(filepath) == len(prefix):
+            return None
+        return filepath[len(prefix) :]
+
+    def matches_relative_path(self, relative_file_path: str, email: Optional[str] = None) -> bool:
+        """True if the path pattern, with {useremail} filled in with `email`, matches a path relative to dir_path"""
+        email = email if self.has_email_template else None
+        return compile_path_pattern(self.path, email).match(relative_file_path) is not None
+
     def filepath_matches_rule_path(self, filepath: Path) -> Tuple[bool, Optional[str]]:
-        if issubpath(self.dir_path, filepath):
-            relative_file_path = filepath.relative_to(self.dir_path)
-        else:
+        relative_file_path = self.relative_file_path(filepath.as_posix())
+        if relative_file_path is None:
             return False, None
 
         match_for_email = None
         if self.has_email_template:
             match = False
-            emails_in_file_path = [
-                part for part in str(relative_file_path).split("/") if "@" in part
-            ]  # todo: improve this
+            emails_in_file_path = [part for part in relative_file_path.split("/") if "@" in part]  # todo: improve this
             for email in emails_in_file_path:
-                if globmatch(
-                    str(relative_file_path),
-                    self.path.replace("{useremail}", email),
-                    flags=wcmatch.glob.GLOBSTAR,
-                ):
+                if self.matches_relative_path(relative_file_path, email):
                     match = True
                     match_for_email = email
                     break
         else:
-            match = globmatch(str(relative_file_path), self.path, flags=wcmatch.glob.GLOBSTAR)
+            match = self.matches_relative_path(relative_file_path)
         return match, match_for_email
 
     @property
@@ -370,22 +407,20 @@ class ComputedPermission(BaseModel):
         else:
             return False
 
-    def rule_applies_to_path(self, rule: PermissionRule) -> bool:
-        if rule.has_email_template:
-            # we fill in a/b/{useremail}/*.txt -> a/b/user@email.org/*.txt
-            resolved_path_pattern = rule.resolve_path_pattern(self.user)
-        else:
-            resolved_path_pattern = rule.path
+    @cached_property
+    def posix_file_path(self) -> str:
+        return self.file_path.as_posix()
 
+    def rule_applies_to_path(self, rule: PermissionRule) -> bool:
         # target file path (the one that we want to check permissions for relative to the syftperm file
         # we need this because the syftperm file specifies path patterns relative to its own location
-
-        if issubpath(rule.dir_path, self.file_path):
-            relative_file_path = self.file_path.relative_to(rule.dir_path)
-            return globmatch(relative_file_path, resolved_path_pattern, flags=wcmatch.glob.GLOBSTAR)
-        else:
+        relative_file_path = rule.relative_file_path(self.posix_file_path)
+        if relative_file_path is None:
             return False
 
+        # we fill in a/b/{useremail}/*.txt -> a/b/user@email.org/*.txt
+        return rule.matches_relative_path(relative_file_path, self.user)
+
     def is_invalid_permission(self, permtype: PermissionType) -> bool:
         return self.file_path.name == PERM_FILE and permtype in [PermissionType.CREATE, PermissionType.WRITE]
 
@@ -460,6 +495,96 @@ def migrate_permissions(snapshot_folder: Path) -> None:
         file.unlink()
 
 
+class PermissionTree:
+    """
+    Parsed permission files in a folder, keyed by the directory they are in, relative to the folder.
+
+    Permission files are parsed when a path below them is looked up, and parsed again when their modification
+    time or size changed, so the tree stays valid when permission files are changed by another process.
+    A lookup only visits the parent directories of a path, with one `stat` per directory.
+
+    With `skip_invalid`, permission files that cannot be parsed are logged and skipped instead of raising,
+    `has_invalid_permfile` tells if a path is affected by one.
+    """
+
+    def __init__(self, folder: Path, skip_invalid: bool = False) -> None:
+        self.folder = folder
+        self.skip_invalid = skip_invalid
+        # (mtime_ns, size) of each parsed permission file, and the permission file, None if it is invalid
+        self._permfiles: dict[Path, tuple[tuple[int, int], Optional[SyftPermission]]] = {}
+        self._lock = threading.Lock()
+
+    def _read(self, abs_path: Path) -> Optional[SyftPermission]:
+        try:
+            return SyftPermission.from_file(abs_path, self.folder)
+        except Exception as e:
+            if not self.skip_invalid:
+                raise
+            logger.warning(f"Invalid permission file {abs_path}: {e}")
+            return None
+
+    def _get_permfile(self, dir_path: Path) -> tuple[bool, Optional[SyftPermission]]:
+        """Returns if `dir_path` has a permission file, and the permission file, None if it is invalid."""
+        abs_path = self.folder / dir_path / PERM_FILE
+        try:
+            stat = abs_path.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            with self._lock:
+                self._permfiles.pop(dir_path, None)
+            return False, None
+
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._permfiles.get(dir_path)
+        if entry is not None and entry[0] == key:
+            return True, entry[1]
+
+        permfile = self._read(abs_path)
+        with self._lock:
+            self._permfiles[dir_path] = (key, permfile)
+        return True, permfile
+
+    def update(self, permfile_path: RelativePath) -> None:
+        """Drop a permission file after it was written or deleted, so it is parsed again on the next lookup,
+        even if its modification time and size did not change. `permfile_path` is relative to the folder."""
+        with self._lock:
+            self._permfiles.pop(Path(permfile_path).parent, None)
+
+    def get_rules_for_path(self, path: RelativePath) -> list[PermissionRule]:
+        """Rules of all permission files in the parent directories of `path`, in the order in which they apply."""
+        rules: list[PermissionRule] = []
+        for parent in reversed(Path(path).parents):
+            _, permfile = self._get_permfile(parent)
+            if permfile is not None:
+                rules.extend(permfile.rules)
+        return rules
+
+    def has_invalid_permfile(self, path: RelativePath) -> bool:
+        """True if a permission file in the parent directories of `path` could not be parsed."""
+        for parent in Path(path).parents:
+            exists, permfile = self._get_permfile(parent)
+            if exists and permfile is None:
+                return True
+        return False
+
+    def computed_permission(self, user: str, path: RelativePath) -> "ComputedPermission":
+        return ComputedPermission.from_user_rules_and_path(rules=self.get_rules_for_path(path), user=user, path=path)
+
+
+_permission_trees: dict[Path, PermissionTree] = {}
+_permission_trees_lock = threading.Lock()
+
+
+def get_permission_tree(folder: AbsolutePath) -> PermissionTree:
+    """The shared `PermissionTree` of a folder. Entries are checked against the permission files on every lookup."""
+    folder = Path(folder).absolute()
+    with _permission_trees_lock:
+        tree = _permission_trees.get(folder)
+        if tree is None:
+            tree = _permission_trees[folder] = PermissionTree(folder)
+        return tree
+
+
 def get_computed_permission(
     *,
     snapshot_folder: AbsolutePath,
@@ -469,19 +594,8 @@ def get_computed_permission(
     """
     Get `ComputedPermission` for a given path.
     `path` should be relative to the snapshot folder.
+
+    Permission files are only parsed again when they change, see `PermissionTree`.
     """
     path = RelativePath(path)
-    snapshot_folder = AbsolutePath(snapshot_folder)
-
-    # get all the rules
-    all_rules = []
-    for file in snapshot_folder.rglob(PERM_FILE):
-        content = file.read_text()
-        rule_dicts = yaml.safe_load(content)
-        perm_file = SyftPermission.from_rule_dicts(
-            permfile_file_path=file.relative_to(snapshot_folder), rule_dicts=rule_dicts
-        )
-        all_rules.extend(perm_file.rules)
-
-    permission = ComputedPermission.from_user_rules_and_path(rules=all_rules, user=user_email, path=path)
-    return permission
+    return get_permission_tree(AbsolutePath(snapshot_folder)).computed_permission(user_email, path)
@@ -0,0 +1,195 @@
+"""
+rsync signatures and diffs with a block size that scales with the file size.
+
+The block size is stored in the signature header, so a diff is always calculated with the block size of the
+signature it is based on, and both sides agree on it without coordination.
+Files smaller than `SMALL_FILE_THRESHOLD` are transferred as a whole, as a literal diff. Their signature is the
+signature of an empty file, which is still sent to clients: older clients diff against it without checking the size.
+"""
+
+import hashlib
+import math
+import mmap
+import os
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from typing import BinaryIO, Optional, Union
+
+import py_fast_rsync
+from py_fast_rsync import signature
+
+# Files smaller than this are sent in full, a signature would not save any bandwidth
+SMALL_FILE_THRESHOLD = 8 * 1024
+
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 128 * 1024
+
+# Signature header: 4 byte magic, 4 byte block size, 4 byte crypto hash size, all big-endian
+SIGNATURE_HEADER_SIZE = 12
+
+# Files are read in chunks of this size when calculating a signature
+SIGNATURE_CHUNK_SIZE = 4 * 1024 * 1024
+# Copied ranges of the base file are written in chunks of this size
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Diff format: magic, followed by commands until the END command. A command is an op byte, followed by
+# its arguments as big-endian integers of 1, 2, 4 or 8 bytes:
+# - LITERAL: length, followed by `length` bytes of literal data. Ops up to 0x40 have the length in the op itself.
+# - COPY: start and length of a range of the base file. The op encodes the sizes of both arguments.
+DELTA_MAGIC = b"rs\x026"
+DELTA_OP_END = 0x00
+DELTA_OP_LITERAL_MAX_IMMEDIATE = 0x40
+DELTA_OP_LITERAL_FIRST = 0x41
+DELTA_OP_LITERAL_LAST = 0x44
+DELTA_OP_COPY_FIRST = 0x45
+DELTA_OP_COPY_LAST = 0x54
+DELTA_INT_SIZES = (1, 2, 4, 8)
+
+# Signature of an empty file. A diff against this signature contains the full file as a literal.
+EMPTY_SIGNATURE = signature.calculate(b"")
+
+
+def block_size_for(file_size: int) -> int:
+    """Block size for a file of `file_size` bytes: the square root of the file size, like rsync,
+    rounded up to a power of two and clamped to [MIN_BLOCK_SIZE, MAX_BLOCK_SIZE]."""
+    if file_size <= 0:
+        return MIN_BLOCK_SIZE
+    block_size = 1 << math.ceil(math.log2(math.isqrt(file_size) or 1))
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block_size))
+
+
+def calculate_signature(data: bytes) -> bytes:
+    """Signature of `data`, or `EMPTY_SIGNATURE` if the file is small enough to always be sent in full."""
+    if len(data) < SMALL_FILE_THRESHOLD:
+        return EMPTY_SIGNATURE
+    return signature.calculate(data, block_size=block_size_for(len(data)))
+
+
+def calculate_diff(base_signature: Optional[bytes], data: bytes) -> bytes:
+    """Diff of `data` against a file with `base_signature`. Without a signature, or if `data` is small,
+    the diff is a literal copy of `data`, which can be applied to any file."""
+    if not base_signature or len(data) < SMALL_FILE_THRESHOLD:
+        base_signature = EMPTY_SIGNATURE
+    return py_fast_rsync.diff(base_signature, data)
+
+
+def signature_block_size(file_signature: bytes) -> Optional[int]:
+    """Block size stored in the header of a signature, None for small files, which are always sent in full."""
+    if len(file_signature) <= SIGNATURE_HEADER_SIZE:
+        return None
+    return int.from_bytes(file_signature[4:8], "big")
+
+
+@contextmanager
+def mmap_file(f: BinaryIO) -> Iterator[Union[bytes, mmap.mmap]]:
+    """Memory-map an open file for reading. Empty files cannot be mapped, they are returned as empty bytes."""
+    if os.fstat(f.fileno()).st_size == 0:
+        yield b""
+        return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield mapped
+
+
+def calculate_file_signature(f: BinaryIO, file_size: int) -> bytes:
+    """
+    Same as `calculate_signature`, reading the file in chunks instead of loading it in memory.
+    Blocks are independent, so the signature of a file is the concatenation of the block entries
+    of each chunk, as long as the chunks are a multiple of the block size.
+    """
+    if file_size < SMALL_FILE_THRESHOLD:
+        return EMPTY_SIGNATURE
+    block_size = block_size_for(file_size)
+    chunk_size = block_size * max(1, SIGNATURE_CHUNK_SIZE // block_size)
+
+    parts: list[bytes] = []
+    while chunk := f.read(chunk_size):
+        part = signature.calculate(chunk, block_size=block_size)
+        parts.append(part if not parts else part[SIGNATURE_HEADER_SIZE:])
+    if not parts:
+        return signature.calculate(b"", block_size=block_size)
+    return b"".join(parts)
+
+
+def _delta_command_size(op: int) -> int:
+    """Size of a delta command, including the op byte and its arguments, excluding literal data."""
+    if op <= DELTA_OP_LITERAL_MAX_IMMEDIATE:
+        return 1
+    if op <= DELTA_OP_LITERAL_LAST:
+        return 1 + DELTA_INT_SIZES[op - DELTA_OP_LITERAL_FIRST]
+    if op <= DELTA_OP_COPY_LAST:
+        index = op - DELTA_OP_COPY_FIRST
+        return 1 + DELTA_INT_SIZES[index // 4] + DELTA_INT_SIZES[index % 4]
+    raise ValueError(f"Invalid delta command: {op:#x}")
+
+
+def apply_diff_stream(base: Union[bytes, mmap.mmap], diff_chunks: Iterable[bytes], out: BinaryIO) -> str:
+    """
+    Apply a diff to `base` while it is being received, and write the result to `out`.
+
+    Unlike `py_fast_rsync.apply`, neither the diff nor the result have to fit in memory, and `base` can be
+    a memory-mapped file. The sha256 of the result is calculated while writing.
+
+    Returns:
+        str: hex sha256 of the written data.
+
+    Raises:
+        ValueError: if the diff is invalid, truncated or does not match `base`.
+    """
+    hasher = hashlib.sha256()
+
+    def write(data: Union[bytes, bytearray]) -> None:
+        out.write(data)
+        hasher.update(data)
+
+    buffer = bytearray()
+    magic_checked = False
+    ended = False
+    literal_remaining = 0
+    for chunk in diff_chunks:
+        buffer += chunk
+        pos = 0
+        while pos < len(buffer):
+            if ended:
+                raise ValueError("Unexpected data after the end of the diff")
+            if literal_remaining:
+                size = min(literal_remaining, len(buffer) - pos)
+                write(buffer[pos : pos + size])
+                pos += size
+                literal_remaining -= size
+                continue
+            if not magic_checked:
+                if len(buffer) - pos < len(DELTA_MAGIC):
+                    break
+                if buffer[pos : pos + len(DELTA_MAGIC)] != DELTA_MAGIC:
+                    raise ValueError("Invalid diff header")
+                pos += len(DELTA_MAGIC)
+                magic_checked = True
+                continue
+
+            op = buffer[pos]
+            command_size = _delta_command_size(op)
+            if len(buffer) - pos < command_size:
+                break
+            args = buffer[pos + 1 : pos + command_size]
+            pos += command_size
+
+            if op == DELTA_OP_END:
+                ended = True
+            elif op <= DELTA_OP_LITERAL_MAX_IMMEDIATE:
+                literal_remaining = op
+            elif op <= DELTA_OP_LITERAL_LAST:
+                literal_remaining = int.from_bytes(args, "big")
+            else:
+                start_size = DELTA_INT_SIZES[(op - DELTA_OP_COPY_FIRST) // 4]
+                start = int.from_bytes(args[:start_size], "big")
+                length = int.from_bytes(args[start_size:], "big")
+                if start + length > len(base):
+                    raise ValueError("Diff copies data outside of the base file")
+                # Slicing a memory-mapped file only reads the slice from disk
+                for offset in range(start, start + length, COPY_CHUNK_SIZE):
+                    write(base[offset : min(offset + COPY_CHUNK_SIZE, start + length)])
+        del buffer[:pos]
+
+    if not ended or literal_remaining or buffer:
+        raise ValueError("Truncated diff")
+    return hasher.hexdigest()
@@ -1,17 +1,19 @@
-import base64
 import hashlib
 import sqlite3
 from collections import defaultdict
-from typing import Iterator, List
+from typing import Iterator, List, Optional
 
 import msgpack
 import py_fast_rsync
 from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
-from loguru import logger
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from typing_extensions import Generator
 
+from syftbox.lib.compression import decompress, supported_encodings
+from syftbox.lib.hash import summary_hash
+from syftbox.lib.http import HEADER_SYFTBOX_FILE_HASH
 from syftbox.lib.permissions import PermissionType
+from syftbox.lib.rsync import calculate_diff
 from syftbox.server.analytics import log_file_change_event
 from syftbox.server.db.db import get_all_datasites
 from syftbox.server.db.file_store import FileStore
@@ -23,8 +25,11 @@ from ...models.sync_models import (
     ApplyDiffRequest,
     ApplyDiffResponse,
     BatchFileRequest,
+    DatasiteListing,
     DiffRequest,
     DiffResponse,
+    DirHash,
+    FileListingEntry,
     FileMetadata,
     FileMetadataRequest,
     FileRequest,
@@ -41,10 +46,30 @@ def get_db_connection(request: Request) -> Generator[sqlite3.Connection, None, N
 def get_file_store(request: Request) -> Generator[FileStore, None, None]:
     store = FileStore(
         server_settings=request.state.server_settings,
+        content_cache=getattr(request.state, "content_cache", None),
+        rules_cache=getattr(request.state, "rules_cache", None),
+        tree_cache=getattr(request.state, "tree_cache", None),
     )
     yield store
 
 
+async def get_request_content(request: Request) -> bytes:
+    """Raw request body, decompressed according to its `Content-Encoding` header."""
+    server_settings: ServerSettings = request.state.server_settings
+    body = await request.body()
+    encoding = request.headers.get("content-encoding")
+    try:
+        return decompress(body, encoding, max_size=server_settings.request_size_limit_in_mb * 1024 * 1024)
+    except ValueError as e:
+        if encoding and encoding.strip().lower() not in supported_encodings():
+            raise HTTPException(
+                status_code=415,
+                detail=f"Unsupported content encoding: {encoding}",
+                headers={"Accept-Encoding": ", ".join(supported_encodings())},
+            )
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 router = APIRouter(prefix="/sync", tags=["sync"])
 
 
@@ -58,15 +83,37 @@ def get_diff(
         file = file_store.get(req.path, email)
     except ValueError:
         raise HTTPException(status_code=404, detail="file not found")
-    diff = py_fast_rsync.diff(req.signature_bytes, file.data)
-    diff_bytes = base64.b85encode(diff).decode("utf-8")
+    diff = calculate_diff(req.signature, file.data)
     return DiffResponse(
         path=file.metadata.path.as_posix(),
-        diff=diff_bytes,
+        diff=diff,
         hash=file.metadata.hash,
     )
 
 
+@router.post("/get_diff_raw", response_class=Response)
+def get_diff_raw(
+    path: RelativePath,
+    signature: bytes = Depends(get_request_content),
+    file_store: FileStore = Depends(get_file_store),
+    email: str = Depends(get_current_user),
+) -> Response:
+    """
+    Same as `/get_diff`, with the raw signature as request body and the raw diff as response body.
+    The hash of the remote file is returned in the `x-syftbox-file-hash` header.
+    """
+    try:
+        file = file_store.get(path, email)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="file not found")
+    diff = calculate_diff(signature, file.data)
+    return Response(
+        content=diff,
+        media_type="application/octet-stream",
+        headers={HEADER_SYFTBOX_FILE_HASH: file.metadata.hash},
+    )
+
+
 @router.post("/datasite_states", response_model=dict[str, list[FileMetadata]])
 def get_datasite_states(
     file_store: FileStore = Depends(get_file_store),
@@ -82,6 +129,37 @@ def get_datasite_states(
     return dict(datasite_states)
 
 
+@router.post("/datasite_listings", response_model=dict[str, DatasiteListing])
+def get_datasite_listings(
+    file_store: FileStore = Depends(get_file_store),
+    email: str = Depends(get_current_user),
+) -> dict[str, DatasiteListing]:
+    """
+    Same as `/datasite_states`, without rsync signatures. Each listing includes a summary hash of its files,
+    clients can skip comparing a datasite if the summary did not change since the previous sync.
+    """
+    file_metadata = file_store.list_for_user(email=email)
+
+    datasite_files = defaultdict(list)
+    for metadata in file_metadata:
+        datasite_files[metadata.datasite].append(
+            FileListingEntry(
+                path=metadata.path,
+                hash=metadata.hash,
+                file_size=metadata.file_size,
+                last_modified=metadata.last_modified,
+            )
+        )
+
+    return {
+        datasite: DatasiteListing(
+            summary_hash=summary_hash((file.path.as_posix(), file.hash) for file in files),
+            files=files,
+        )
+        for datasite, files in datasite_files.items()
+    }
+
+
 @router.post("/dir_state", response_model=list[FileMetadata])
 def dir_state(
     dir: RelativePath,
@@ -92,6 +170,23 @@ def dir_state(
     return file_store.list_for_user(email=email, path=dir)
 
 
+@router.post("/tree", response_model=list[DirHash])
+def get_tree(
+    path: RelativePath,
+    depth: Optional[int] = None,
+    file_store: FileStore = Depends(get_file_store),
+    email: str = Depends(get_current_user),
+) -> list[DirHash]:
+    """
+    Summary hashes of the directory at `path` and its subdirectories, up to `depth` levels below `path`.
+    Only directories with files readable by the user are included. Clients can compare these with the hashes
+    of a previous sync, and only reconcile the directories that changed.
+    """
+    if depth is not None and depth < 0:
+        raise HTTPException(status_code=400, detail="depth must be non-negative")
+    return file_store.get_tree(path, email, depth)
+
+
 @router.post("/get_metadata", response_model=FileMetadata)
 def get_metadata(
     req: FileMetadataRequest,
@@ -105,33 +200,72 @@ def get_metadata(
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.post("/apply_diff", response_model=ApplyDiffResponse)
-def apply_diffs(
-    req: ApplyDiffRequest,
+@router.post("/has_permission", response_model=bool)
+def has_permission(
+    path: RelativePath,
+    permission: str,
     file_store: FileStore = Depends(get_file_store),
     email: str = Depends(get_current_user),
+) -> bool:
+    """
+    Check if the user has `permission` (read, create, write or admin) for `path`, which does not have to exist.
+    Clients use this to skip uploads that would be rejected, without sending the file.
+    """
+    try:
+        permission_type = PermissionType[permission.upper()]
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown permission: {permission}")
+    return file_store.check_permissions(email, [path], permission_type)[path]
+
+
+def _apply_diff(
+    endpoint: str, path: RelativePath, diff: bytes, expected_hash: str, file_store: FileStore, email: str
 ) -> ApplyDiffResponse:
     try:
-        file = file_store.get(req.path, email)
+        file = file_store.get(path, email)
     except ValueError:
         raise HTTPException(status_code=404, detail="file not found")
 
-    result = py_fast_rsync.apply(file.data, req.diff_bytes)
+    result = py_fast_rsync.apply(file.data, diff)
     new_hash = hashlib.sha256(result).hexdigest()
 
-    if new_hash != req.expected_hash:
+    if new_hash != expected_hash:
         raise HTTPException(status_code=400, detail="hash mismatch, skipped writing")
 
-    file_store.put(req.path, result, user=email, check_permission=PermissionType.WRITE)
+    file_store.put(path, result, user=email, check_permission=PermissionType.WRITE)
 
     log_file_change_event(
-        "/sync/apply_diff",
+        endpoint,
         email=email,
-        relative_path=req.path,
+        relative_path=path,
         file_store=file_store,
     )
 
-    return ApplyDiffResponse(path=req.path, current_hash=new_hash, previous_hash=file.metadata.hash)
+    return ApplyDiffResponse(path=path, current_hash=new_hash, previous_hash=file.metadata.hash)
+
+
+@router.post("/apply_diff", response_model=ApplyDiffResponse)
+def apply_diffs(
+    req: ApplyDiffRequest,
+    file_store: FileStore = Depends(get_file_store),
+    email: str = Depends(get_current_user),
+) -> ApplyDiffResponse:
+    return _apply_diff("/sync/apply_diff", req.path, req.diff_bytes, req.expected_hash, file_store, email)
+
+
+@router.post("/apply_diff_raw", response_model=ApplyDiffResponse)
+def apply_diff_raw(
+    path: RelativePath,
+    expected_hash: str,
+    diff: bytes = Depends(get_request_content),
+    file_store: FileStore = Depends(get_file_store),
+    email: str = Depends(get_current_user),
+) -> ApplyDiffResponse:
+    """
+    Same as `/apply_diff`, with the raw diff as request body instead of a base85 encoded JSON field.
+    The body can be compressed, with the compression set in the `Content-Encoding` header.
+    """
+    return _apply_diff("/sync/apply_diff_raw", path, diff, expected_hash, file_store, email)
 
 
 @router.post("/delete", response_class=JSONResponse)
@@ -151,21 +285,15 @@ def delete_file(
     return JSONResponse(content={"status": "success"})
 
 
-@router.post("/create", response_class=JSONResponse)
-def create_file(
-    file: UploadFile,
-    file_store: FileStore = Depends(get_file_store),
-    email: str = Depends(get_current_user),
-) -> JSONResponse:
-    relative_path = RelativePath(file.filename)
-    if "%" in file.filename:
+def _create_file(
+    endpoint: str, relative_path: RelativePath, contents: bytes, file_store: FileStore, email: str
+) -> None:
+    if "%" in relative_path.as_posix():
         raise HTTPException(status_code=400, detail="filename cannot contain '%'")
 
     if file_store.exists(relative_path):
         raise HTTPException(status_code=400, detail="file already exists")
 
-    contents = file.file.read()
-
     file_store.put(
         relative_path,
         contents,
@@ -174,11 +302,35 @@ def create_file(
     )
 
     log_file_change_event(
-        "/sync/create",
+        endpoint,
         email=email,
         relative_path=relative_path,
         file_store=file_store,
     )
+
+
+@router.post("/create", response_class=JSONResponse)
+def create_file(
+    file: UploadFile,
+    file_store: FileStore = Depends(get_file_store),
+    email: str = Depends(get_current_user),
+) -> JSONResponse:
+    _create_file("/sync/create", RelativePath(file.filename), file.file.read(), file_store, email)
+    return JSONResponse(content={"status": "success"})
+
+
+@router.post("/upload", response_class=JSONResponse)
+def upload_file(
+    path: RelativePath,
+    contents: bytes = Depends(get_request_content),
+    file_store: FileStore = Depends(get_file_store),
+    email: str = Depends(get_current_user),
+) -> JSONResponse:
+    """
+    Same as `/create`, with the file content as raw request body instead of a multipart form.
+    The body can be compressed, with the compression set in the `Content-Encoding` header.
+    """
+    _create_file("/sync/upload", path, contents, file_store, email)
     return JSONResponse(content={"status": "success"})
 
 
@@ -204,17 +356,13 @@ def get_datasites(
 
 
 def file_streamer(files: List[RelativePath], file_store: FileStore, email: str) -> Iterator[bytes]:
-    for path in files:
-        try:
-            file = file_store.get(path, email)
-            metadata = {
-                "path": file.metadata.path.as_posix(),
-                "content": file.data,
-            }
-            yield msgpack.packb(metadata)
-        except ValueError:
-            logger.warning(f"File not found: {path}")
-            continue
+    # Permissions of all files are checked up front, unreadable and missing files are skipped
+    for file in file_store.get_many(files, email):
+        metadata = {
+            "path": file.metadata.path.as_posix(),
+            "content": file.data,
+        }
+        yield msgpack.packb(metadata)
 
 
 @router.post("/download_bulk")
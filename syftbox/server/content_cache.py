@@ -0,0 +1,187 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+from syftbox.lib.rsync import SMALL_FILE_THRESHOLD, calculate_signature
+
+SIGNATURE_SUFFIX = ".sig"
+
+
+class LRUByteCache:
+    """A thread-safe LRU cache of bytes values, evicting the least recently used items when the total size
+    of the values exceeds `max_bytes`. Values larger than `max_item_bytes` are not cached."""
+
+    def __init__(self, max_bytes: int, max_item_bytes: Optional[int] = None) -> None:
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_bytes if max_item_bytes is None else min(max_item_bytes, max_bytes)
+        self.size = 0
+        self._items: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: bytes) -> bool:
+        """Add a value to the cache, returns False if the value is too large to be cached."""
+        if len(value) > self.max_item_bytes:
+            return False
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+
+class DiskSignatureCache:
+    """
+    rsync signatures stored as files in `cache_dir`, named by the sha256 of the file they belong to.
+    Least recently used signatures are deleted when the total size exceeds `max_bytes`.
+    The recency is tracked per process, and initialized from the modification times of the cached files.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sizes: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def _path(self, digest: str) -> Path:
+        return self.cache_dir / digest[:2] / f"{digest}{SIGNATURE_SUFFIX}"
+
+    def _load_index(self) -> None:
+        if not self.cache_dir.is_dir():
+            return
+        entries = []
+        for path in self.cache_dir.glob(f"*/*{SIGNATURE_SUFFIX}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, path.name[: -len(SIGNATURE_SUFFIX)], stat.st_size))
+        for _, digest, size in sorted(entries):
+            self._sizes[digest] = size
+            self.size += size
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self._lock:
+            if digest not in self._sizes:
+                return None
+            self._sizes.move_to_end(digest)
+        try:
+            return self._path(digest).read_bytes()
+        except FileNotFoundError:
+            # Evicted by another process
+            with self._lock:
+                size = self._sizes.pop(digest, None)
+                if size is not None:
+                    self.size -= size
+            return None
+
+    def put(self, digest: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{digest}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            previous = self._sizes.pop(digest, None)
+            if previous is not None:
+                self.size -= previous
+            self._sizes[digest] = len(value)
+            self.size += len(value)
+            evicted = []
+            while self.size > self.max_bytes:
+                evicted_digest, evicted_size = self._sizes.popitem(last=False)
+                self.size -= evicted_size
+                evicted.append(evicted_digest)
+        for evicted_digest in evicted:
+            self._path(evicted_digest).unlink(missing_ok=True)
+
+
+class ContentCache:
+    """
+    Cache of file contents and rsync signatures, keyed by the sha256 of the file content.
+
+    Contents and signatures are kept in memory, with size-aware LRU eviction. Signatures are also cached on disk,
+    file contents are not: they are already stored on disk in the snapshot folder.
+    Because entries are keyed by content hash, they never become stale; a modified file has a new hash.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int,
+        cache_dir: Optional[Path] = None,
+        max_disk_bytes: int = 0,
+        max_item_bytes: Optional[int] = None,
+    ) -> None:
+        self.memory = LRUByteCache(max_memory_bytes, max_item_bytes=max_item_bytes or max_memory_bytes // 8)
+        self.disk: Optional[DiskSignatureCache] = None
+        if cache_dir is not None and max_disk_bytes > 0:
+            self.disk = DiskSignatureCache(cache_dir, max_disk_bytes)
+
+    def get_content(self, digest: str) -> Optional[bytes]:
+        return self.memory.get(f"content:{digest}")
+
+    def put_content(self, digest: str, data: bytes) -> None:
+        self.memory.put(f"content:{digest}", data)
+
+    def get_signature(self, digest: str) -> Optional[bytes]:
+        key = f"signature:{digest}"
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(digest)
+            if value is not None:
+                self.memory.put(key, value)
+        return value
+
+    def put_signature(self, digest: str, value: bytes) -> None:
+        self.memory.put(f"signature:{digest}", value)
+        if self.disk is not None:
+            try:
+                self.disk.put(digest, value)
+            except OSError as e:
+                logger.warning(f"Failed to cache signature {digest}: {e}")
+
+    def get_or_calculate_signature(self, data: bytes, digest: Optional[str] = None) -> bytes:
+        if len(data) < SMALL_FILE_THRESHOLD:
+            # Small files are always sent in full, their signature is the empty signature
+            return calculate_signature(data)
+        digest = digest or hashlib.sha256(data).hexdigest()
+        value = self.get_signature(digest)
+        if value is None:
+            value = calculate_signature(data)
+            self.put_signature(digest, value)
+        return value
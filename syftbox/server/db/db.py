@@ -1,12 +1,19 @@
 import sqlite3
+import threading
 from pathlib import Path
 from typing import Optional
 
+from syftbox.lib.hash import SUMMARY_HASH_MODULUS, summary_entry_hash
 from syftbox.lib.permissions import PermissionRule, SyftPermission
-from syftbox.server.models.sync_models import FileMetadata, RelativePath
+from syftbox.server.models.sync_models import DirHash, FileMetadata, RelativePath
 
+# SQLite limits the number of parameters in a query, long IN lists are split
+MAX_QUERY_PARAMETERS = 500
 
-def save_file_metadata(conn: sqlite3.Connection, metadata: FileMetadata) -> None:
+
+def save_file_metadata(conn: sqlite3.Connection, metadata: FileMetadata) -> bool:
+    """Insert or update the metadata of a file, returns True if the file is new."""
+    previous_hash = get_file_hash(conn, str(metadata.path))
     # Insert the metadata into the database or update if a conflict on 'path' occurs
     conn.execute(
         """
@@ -28,13 +35,106 @@ def save_file_metadata(conn: sqlite3.Connection, metadata: FileMetadata) -> None
             metadata.last_modified.isoformat(),
         ),
     )
+    update_dir_hashes(conn, str(metadata.path), previous_hash, metadata.hash)
+    return previous_hash is None
 
 
 def delete_file_metadata(conn: sqlite3.Connection, path: str) -> None:
+    previous_hash = get_file_hash(conn, path)
     cur = conn.execute("DELETE FROM file_metadata WHERE path = ?", (path,))
     # get number of changes
     if cur.rowcount != 1:
         raise ValueError(f"Failed to delete metadata for {path}.")
+    update_dir_hashes(conn, path, previous_hash, None)
+
+
+def get_file_id(conn: sqlite3.Connection, path: str) -> int:
+    row = conn.execute("SELECT id FROM file_metadata WHERE path = ?", (path,)).fetchone()
+    if row is None:
+        raise ValueError(f"No metadata for {path}")
+    return row[0]
+
+
+def get_file_hash(conn: sqlite3.Connection, path: str) -> Optional[str]:
+    row = conn.execute("SELECT hash FROM file_metadata WHERE path = ?", (path,)).fetchone()
+    return row[0] if row else None
+
+
+def update_dir_hashes(
+    conn: sqlite3.Connection, path: str, previous_hash: Optional[str], new_hash: Optional[str]
+) -> None:
+    """
+    Update the rolling hashes of all parent directories of a file that was added, modified or deleted.
+
+    The hash of a directory is the summary hash (see `syftbox.lib.hash.summary_hash`) of the path and hash of
+    all files in the directory and its subdirectories, `files_hash` only includes the files directly in the directory.
+    Summary hashes are sums, so a change only has to add the difference to each parent, instead of rehashing
+    the whole directory. Directories without files are removed.
+    """
+    if previous_hash == new_hash:
+        return
+
+    delta = 0
+    count_delta = 0
+    if previous_hash is not None:
+        delta -= summary_entry_hash(path, previous_hash)
+        count_delta -= 1
+    if new_hash is not None:
+        delta += summary_entry_hash(path, new_hash)
+        count_delta += 1
+
+    parts = path.split("/")
+    for depth in range(1, len(parts)):
+        dir_path = "/".join(parts[:depth])
+        files_delta = delta if depth == len(parts) - 1 else 0
+        row = conn.execute(
+            "SELECT hash, files_hash, file_count FROM dir_hashes WHERE path = ?",
+            (dir_path,),
+        ).fetchone()
+        if row is None:
+            dir_hash, files_hash, file_count = 0, 0, 0
+        else:
+            dir_hash, files_hash, file_count = int(row[0], 16), int(row[1], 16), row[2]
+
+        file_count += count_delta
+        if file_count <= 0:
+            conn.execute("DELETE FROM dir_hashes WHERE path = ?", (dir_path,))
+            continue
+
+        conn.execute(
+            """
+        INSERT INTO dir_hashes (path, depth, hash, files_hash, file_count) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(path) DO UPDATE SET
+            hash = excluded.hash,
+            files_hash = excluded.files_hash,
+            file_count = excluded.file_count
+        """,
+            (
+                dir_path,
+                depth,
+                f"{(dir_hash + delta) % SUMMARY_HASH_MODULUS:064x}",
+                f"{(files_hash + files_delta) % SUMMARY_HASH_MODULUS:064x}",
+                file_count,
+            ),
+        )
+
+
+def get_dir_hashes(conn: sqlite3.Connection, path: str, depth: Optional[int] = None) -> list[sqlite3.Row]:
+    """
+    Get the rolling hashes of a directory and its subdirectories.
+
+    Args:
+        path: directory path, relative to the snapshot folder
+        depth: maximum depth of subdirectories relative to path, all subdirectories if None
+    """
+    if "%" in path:
+        raise ValueError("we don't support % in paths")
+    query = "SELECT * FROM dir_hashes WHERE (path = ? OR path LIKE ? ESCAPE '\\')"
+    params: list = [path, path.replace("_", "\\_") + "/%"]
+    if depth is not None:
+        query += " AND depth <= ?"
+        params.append(len(path.split("/")) + depth)
+    return conn.execute(query + " ORDER BY path", params).fetchall()
 
 
 def get_all_metadata(conn: sqlite3.Connection, path_like: Optional[str] = None) -> list[FileMetadata]:
@@ -63,6 +163,18 @@ def get_one_metadata(conn: sqlite3.Connection, path: str) -> FileMetadata:
     return FileMetadata.from_row(row)
 
 
+def get_metadata_for_paths(conn: sqlite3.Connection, paths: list[str]) -> dict[str, FileMetadata]:
+    """Metadata of all existing files in `paths`, by path."""
+    result = {}
+    for i in range(0, len(paths), MAX_QUERY_PARAMETERS):
+        chunk = paths[i : i + MAX_QUERY_PARAMETERS]
+        placeholders = ",".join("?" * len(chunk))
+        cursor = conn.execute(f"SELECT * FROM file_metadata WHERE path IN ({placeholders})", chunk)
+        for row in cursor:
+            result[row["path"]] = FileMetadata.from_row(row)
+    return result
+
+
 def get_all_datasites(conn: sqlite3.Connection) -> list[str]:
     # INSTR(path, '/'): Finds the position of the first slash in the path.
     cursor = conn.execute(
@@ -114,16 +226,103 @@ def get_all_files_under_syftperm(cursor: sqlite3.Cursor, permfile: SyftPermissio
 
 
 def get_rules_for_path(connection: sqlite3.Connection, path: Path) -> list[PermissionRule]:
-    parents = path.parents
-    placeholders = ",".join("?" * len(parents))
+    return get_rules_for_dirs(connection, [x.as_posix() for x in path.parents])
+
+
+def get_rules_for_dirs(connection: sqlite3.Connection, dirs: list[str]) -> list[PermissionRule]:
+    """All rules of the permfiles in `dirs`, in the order in which they are applied."""
+    rows: list[sqlite3.Row] = []
     cursor = connection.cursor()
-    cursor.execute(
-        """
-        SELECT * FROM rules WHERE permfile_dir in ({})
-    """.format(placeholders),
-        [x.as_posix() for x in parents],
-    )
-    return [PermissionRule.from_db_row(row) for row in cursor.fetchall()]
+    for i in range(0, len(dirs), MAX_QUERY_PARAMETERS):
+        chunk = dirs[i : i + MAX_QUERY_PARAMETERS]
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(
+            """
+            SELECT * FROM rules WHERE permfile_dir in ({})
+        """.format(placeholders),
+            chunk,
+        )
+        rows.extend(cursor.fetchall())
+    rows.sort(key=lambda row: row["effective_priority"])
+    return [PermissionRule.from_db_row(row) for row in rows]
+
+
+class AncestorRulesCache:
+    """
+    Rules that can apply to files in a directory: the rules of the permfiles in the directory and all its parents,
+    cached per directory. The cache has to be cleared whenever the rules of a permfile change.
+    """
+
+    def __init__(self, max_dirs: int = 10_000) -> None:
+        self.max_dirs = max_dirs
+        self._rules: dict[str, list[PermissionRule]] = {}
+        # Incremented on clear, rules that were read before a clear are not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, connection: sqlite3.Connection, dir: Path) -> list[PermissionRule]:
+        key = dir.as_posix()
+        with self._lock:
+            rules = self._rules.get(key)
+            generation = self._generation
+        if rules is not None:
+            return rules
+
+        rules = get_rules_for_dirs(connection, [key] + [parent.as_posix() for parent in dir.parents])
+        with self._lock:
+            if generation == self._generation:
+                if len(self._rules) >= self.max_dirs:
+                    self._rules.clear()
+                self._rules[key] = rules
+        return rules
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rules.clear()
+            self._generation += 1
+
+
+class UserTreeCache:
+    """
+    Directory hashes of the files a user can read, as returned by `FileStore.get_tree`, cached per user, directory
+    and depth. Each entry is stored with the hash of its datasite, which changes with every file or permfile that is
+    written or deleted in the datasite, and is only returned while the datasite hash is unchanged.
+    The cache has to be cleared whenever the rules of a permfile change, for permfiles outside of the datasite.
+    """
+
+    def __init__(self, max_entries: int = 10_000) -> None:
+        self.max_entries = max_entries
+        self._trees: dict[tuple[str, str, Optional[int]], tuple[Optional[str], list[DirHash]]] = {}
+        # Incremented on clear, trees that were calculated before a clear are not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def get(self, key: tuple[str, str, Optional[int]], datasite_hash: Optional[str]) -> Optional[list[DirHash]]:
+        with self._lock:
+            entry = self._trees.get(key)
+        if entry is None or entry[0] != datasite_hash:
+            return None
+        return entry[1]
+
+    def set(
+        self, key: tuple[str, str, Optional[int]], datasite_hash: Optional[str], tree: list[DirHash], generation: int
+    ) -> None:
+        with self._lock:
+            if generation != self._generation:
+                return
+            if len(self._trees) >= self.max_entries:
+                self._trees.clear()
+            self._trees[key] = (datasite_hash, tree)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._trees.clear()
+            self._generation += 1
 
 
 def set_rules_for_permfile(connection: sqlite3.Connection, file: SyftPermission) -> None:
@@ -158,10 +357,11 @@ def set_rules_for_permfile(connection: sqlite3.Connection, file: SyftPermission)
         cursor.executemany(
             """
         INSERT INTO rules (
-            permfile_path, permfile_dir, permfile_depth, priority, path, user,
+            permfile_path, permfile_dir, permfile_depth, priority, effective_priority, path, user,
             can_read, can_create, can_write, admin, disallow
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ON CONFLICT(permfile_path, priority) DO UPDATE SET
+            effective_priority = excluded.effective_priority,
             path = excluded.path,
             user = excluded.user,
             can_read = excluded.can_read,
@@ -196,15 +396,20 @@ def get_metadata_for_file(connection: sqlite3.Connection, path: Path) -> tuple[i
     )
 
 
-def link_existing_rules_to_file(connection: sqlite3.Connection, path: Path) -> None:
+def link_existing_rules_to_file(
+    connection: sqlite3.Connection, path: Path, rules_cache: Optional[AncestorRulesCache] = None
+) -> None:
     # 1 find all rules in that branch of the tree
     # 2 check which rules apply to the file
     # 3 link them
 
-    perm_rules = get_rules_for_path(connection, path)
+    if rules_cache is not None:
+        perm_rules = rules_cache.get(connection, path.parent)
+    else:
+        perm_rules = get_rules_for_path(connection, path)
 
     rule2files = []
-    _id, _ = get_metadata_for_file(connection, path)
+    _id = get_file_id(connection, str(path))
 
     for rule in perm_rules:
         match, match_for_email = rule.filepath_matches_rule_path(path)
@@ -240,9 +445,13 @@ def get_read_permissions_for_user(
 
     These bits are combined with a final OR operation.
     """
-
     cursor = connection.cursor()
+    query, query_params = read_permissions_query(user, path_like)
+    return cursor.execute(query, query_params).fetchall()
+
 
+def read_permissions_query(user: str, path_like: Optional[str] = None) -> tuple[str, list]:
+    """Query and parameters for `get_read_permissions_for_user`"""
     params: list = []
     path_condition = ""
     if path_like:
@@ -253,30 +462,52 @@ def get_read_permissions_for_user(
         path_condition = "AND f.path LIKE ? ESCAPE '\\'"
         params.append(escaped_path)
 
+    # The rules that apply to the user are looked up with an index for each way a rule can match the user,
+    # an OR of these conditions would scan all rules. Rules with a {useremail} template only apply to
+    # files where the template matched the user, like `ComputedPermission` does.
     query = """
     -- First get all rules that apply to this user, including wildcards and email matches
     WITH
     user_matching_rules AS (
-        SELECT r.*, rf.file_id, rf.match_for_email
+        -- Direct user match
+        SELECT r.effective_priority, r.can_read, r.admin, r.disallow, rf.file_id
         FROM rules r
         JOIN rule_files rf
             ON r.permfile_path = rf.permfile_path
             AND r.priority = rf.priority
-        WHERE r.user = ? -- Direct user match
-        OR r.user = '*' -- Wildcard match
-        OR rf.match_for_email = ? -- Email pattern match
+        WHERE r.user = ? AND rf.match_for_email IS NULL
+
+        UNION ALL
+
+        -- Wildcard match
+        SELECT r.effective_priority, r.can_read, r.admin, r.disallow, rf.file_id
+        FROM rules r
+        JOIN rule_files rf
+            ON r.permfile_path = rf.permfile_path
+            AND r.priority = rf.priority
+        WHERE r.user = '*' AND rf.match_for_email IS NULL
+
+        UNION ALL
+
+        -- Email pattern match, the rule path template matched the user email
+        SELECT r.effective_priority, r.can_read, r.admin, r.disallow, rf.file_id
+        FROM rule_files rf
+        JOIN rules r
+            ON r.permfile_path = rf.permfile_path
+            AND r.priority = rf.priority
+        WHERE rf.match_for_email = ? AND (r.user = ? OR r.user = '*')
     ),
 
     -- Then calculate effective permissions by taking the highest priority rule
-    -- Higher depth * 1000 + priority means more specific rules take precedence
-    -- Caveat: using 1000 means we can't have more than 1000 rules in the same permission file
+    -- Rules in deeper permission files, and later rules in the same file take precedence, see
+    -- PermissionRule.effective_priority
     permission_priorities AS (
         SELECT
             file_id,
-            MAX(CASE WHEN can_read AND NOT disallow THEN permfile_depth * 1000 + priority ELSE 0 END) as read_allow_prio,
-            MAX(CASE WHEN can_read AND disallow THEN permfile_depth * 1000 + priority ELSE 0 END) as read_deny_prio,
-            MAX(CASE WHEN admin AND NOT disallow THEN permfile_depth * 1000 + priority ELSE 0 END) as admin_allow_prio,
-            MAX(CASE WHEN admin AND disallow THEN permfile_depth * 1000 + priority ELSE 0 END) as admin_deny_prio
+            MAX(CASE WHEN can_read AND NOT disallow THEN effective_priority ELSE 0 END) as read_allow_prio,
+            MAX(CASE WHEN can_read AND disallow THEN effective_priority ELSE 0 END) as read_deny_prio,
+            MAX(CASE WHEN admin AND NOT disallow THEN effective_priority ELSE 0 END) as admin_allow_prio,
+            MAX(CASE WHEN admin AND disallow THEN effective_priority ELSE 0 END) as admin_deny_prio
         FROM user_matching_rules
         GROUP BY file_id
     ),
@@ -308,10 +539,9 @@ def get_read_permissions_for_user(
     WHERE 1=1 {path_condition}
     """.format(path_condition=path_condition)
 
-    # Add parameters in order: 2 user checks + 1 datasite check + optional path
-    query_params = [user, user, user] + params
-
-    return cursor.execute(query, query_params).fetchall()
+    # Add parameters in order: 3 user checks + 1 datasite check + optional path
+    query_params = [user, user, user, user] + params
+    return query, query_params
 
 
 def print_table(connection: sqlite3.Connection, table: str) -> None:
@@ -1,27 +1,38 @@
+import hashlib
 import sqlite3
+from collections import defaultdict
+from collections.abc import Iterator
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Optional
 
 import yaml
 from fastapi import HTTPException
+from loguru import logger
 from pydantic import BaseModel
 
 from syftbox.lib.constants import PERM_FILE
-from syftbox.lib.hash import hash_file
+from syftbox.lib.hash import dir_summary_hashes
 from syftbox.lib.permissions import (
     ComputedPermission,
     PermissionRule,
     PermissionType,
     SyftPermission,
+    get_permission_tree,
 )
+from syftbox.lib.rsync import calculate_signature
+from syftbox.server.content_cache import ContentCache
 from syftbox.server.db import db
 from syftbox.server.db.db import (
+    AncestorRulesCache,
+    UserTreeCache,
+    get_rules_for_dirs,
     get_rules_for_path,
     link_existing_rules_to_file,
     set_rules_for_permfile,
 )
 from syftbox.server.db.schema import get_db
-from syftbox.server.models.sync_models import AbsolutePath, FileMetadata, RelativePath
+from syftbox.server.models.sync_models import AbsolutePath, DirHash, FileMetadata, RelativePath
 from syftbox.server.settings import ServerSettings
 
 
@@ -36,9 +47,43 @@ def computed_permission_for_user_and_path(connection: sqlite3.Connection, user:
     return ComputedPermission.from_user_rules_and_path(rules=rules, user=user, path=path)
 
 
+def computed_permissions_for_user_and_paths(
+    connection: sqlite3.Connection, user: str, paths: List[Path]
+) -> dict[Path, ComputedPermission]:
+    """Same as `computed_permission_for_user_and_path` for many paths, with a single query for all rules."""
+    dirs = {parent.as_posix() for path in paths for parent in path.parents}
+    rules_by_dir: dict[str, List[PermissionRule]] = defaultdict(list)
+    for rule in get_rules_for_dirs(connection, sorted(dirs)):
+        rules_by_dir[rule.dir_path.as_posix()].append(rule)
+
+    result = {}
+    for path in paths:
+        # Rules of higher permfiles are applied first, same as ordering all rules by effective priority
+        rules = [rule for parent in reversed(path.parents) for rule in rules_by_dir.get(parent.as_posix(), [])]
+        result[path] = ComputedPermission.from_user_rules_and_path(rules=rules, user=user, path=path)
+    return result
+
+
 class FileStore:
-    def __init__(self, server_settings: ServerSettings) -> None:
+    def __init__(
+        self,
+        server_settings: ServerSettings,
+        content_cache: Optional[ContentCache] = None,
+        rules_cache: Optional[AncestorRulesCache] = None,
+        tree_cache: Optional[UserTreeCache] = None,
+    ) -> None:
         self.server_settings = server_settings
+        # Shared between requests, file contents and signatures are cached by content hash
+        self.content_cache = content_cache
+        # Shared between requests, cleared when a permfile is written or deleted
+        self.rules_cache = rules_cache
+        self.tree_cache = tree_cache
+
+    def _clear_rules_cache(self) -> None:
+        if self.rules_cache is not None:
+            self.rules_cache.clear()
+        if self.tree_cache is not None:
+            self.tree_cache.clear()
 
     @property
     def db_path(self) -> AbsolutePath:
@@ -55,12 +100,13 @@ class FileStore:
                         detail=f"User {user} does not have permission to edit syftperm file for {path}",
                     )
 
-            computed_perm = computed_permission_for_user_and_path(conn, user, path)
-            if not computed_perm.has_permission(PermissionType.WRITE):
-                raise HTTPException(
-                    status_code=403,
-                    detail=f"User {user} does not have write permission for {path}",
-                )
+            if not skip_permission_check:
+                computed_perm = computed_permission_for_user_and_path(conn, user, path)
+                if not computed_perm.has_permission(PermissionType.WRITE):
+                    raise HTTPException(
+                        status_code=403,
+                        detail=f"User {user} does not have write permission for {path}",
+                    )
 
             cursor = conn.cursor()
             cursor.execute("BEGIN IMMEDIATE;")
@@ -76,9 +122,16 @@ class FileStore:
 
             abs_path = self.server_settings.snapshot_folder / path
             abs_path.unlink(missing_ok=True)
+            if path.name.endswith(PERM_FILE):
+                # Clear before committing, other writers can only link files with fresh rules after the commit
+                self._clear_rules_cache()
             conn.commit()
             cursor.close()
 
+        if path.name.endswith(PERM_FILE):
+            self._clear_rules_cache()
+            get_permission_tree(self.server_settings.snapshot_folder).update(path)
+
     def get(self, path: RelativePath, user: str) -> SyftFile:
         with get_db(self.db_path) as conn:
             computed_perm = computed_permission_for_user_and_path(conn, user, path)
@@ -96,7 +149,49 @@ class FileStore:
                 raise ValueError("File not found")
             return SyftFile(
                 metadata=metadata,
-                data=self._read_bytes(abs_path),
+                data=self._read_content(abs_path, metadata.hash),
+                absolute_path=abs_path,
+            )
+
+    def check_permissions(self, user: str, paths: List[RelativePath], perm: PermissionType) -> dict[Path, bool]:
+        """Check a permission for many paths at once, returns if the user has `perm` for each path."""
+        with get_db(self.db_path) as conn:
+            permissions = computed_permissions_for_user_and_paths(conn, user, paths)
+        return {path: permission.has_permission(perm) for path, permission in permissions.items()}
+
+    def get_many(self, paths: List[RelativePath], user: str) -> Iterator[SyftFile]:
+        """
+        Get all files in `paths` that the user can read, in the requested order, including duplicates.
+        Files without read permission or that do not exist are skipped. Like `get`, the metadata of files that no
+        longer exist on disk is deleted.
+        Permissions and metadata of all files are fetched up front, file contents are read while iterating.
+        """
+        readable = self.check_permissions(user, paths, PermissionType.READ)
+        for path, allowed in readable.items():
+            if not allowed:
+                logger.warning(f"User {user} does not have read permission for {path}")
+
+        with get_db(self.db_path) as conn:
+            metadata_by_path = db.get_metadata_for_paths(
+                conn, [path.as_posix() for path, allowed in readable.items() if allowed]
+            )
+
+        for path in paths:
+            if not readable[path]:
+                continue
+            metadata = metadata_by_path.get(path.as_posix())
+            if metadata is None:
+                logger.warning(f"File not found: {path}")
+                continue
+            abs_path = self.server_settings.snapshot_folder / path
+            if not abs_path.exists():
+                logger.warning(f"File not found: {path}, deleting its metadata")
+                self.delete(path, user, skip_permission_check=True)
+                del metadata_by_path[path.as_posix()]
+                continue
+            yield SyftFile(
+                metadata=metadata,
+                data=self._read_content(abs_path, metadata.hash),
                 absolute_path=abs_path,
             )
 
@@ -125,6 +220,36 @@ class FileStore:
         with open(path, "rb") as f:
             return f.read()
 
+    def _read_content(self, path: AbsolutePath, digest: str) -> bytes:
+        """Read a file with content hash `digest`, from the content cache if possible."""
+        if self.content_cache is None:
+            return self._read_bytes(path)
+
+        data = self.content_cache.get_content(digest)
+        if data is None:
+            data = self._read_bytes(path)
+            # The file can be modified between reading the metadata and the content, only cache matching content
+            if hashlib.sha256(data).hexdigest() == digest:
+                self.content_cache.put_content(digest, data)
+        return data
+
+    def _file_metadata(self, path: Path, abs_path: AbsolutePath, contents: bytes) -> FileMetadata:
+        """Metadata of a file that was just written with `contents`, without reading it back from disk."""
+        digest = hashlib.sha256(contents).hexdigest()
+        if self.content_cache is not None:
+            file_signature = self.content_cache.get_or_calculate_signature(contents, digest)
+            self.content_cache.put_content(digest, contents)
+        else:
+            file_signature = calculate_signature(contents)
+
+        return FileMetadata(
+            path=path,
+            hash=digest,
+            signature=file_signature,
+            file_size=len(contents),
+            last_modified=datetime.fromtimestamp(abs_path.stat().st_mtime, timezone.utc),
+        )
+
     def put(
         self,
         path: Path,
@@ -169,13 +294,8 @@ class FileStore:
             # Because: if we insert first and write the file later, the date modified it not known yet.
             # If we write the file first and then insert, we might have to revert the file, but we need to
             # set it to the old date modified.
-            metadata = hash_file(abs_path, root_dir=self.server_settings.snapshot_folder)
-            if metadata is None:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Failed to hash file {abs_path}",
-                )
-            db.save_file_metadata(conn, metadata)
+            metadata = self._file_metadata(path, abs_path, contents)
+            is_new_file = db.save_file_metadata(conn, metadata)
             if path.name.endswith(PERM_FILE):
                 try:
                     permfile = SyftPermission.from_bytes(contents, path)
@@ -186,11 +306,70 @@ class FileStore:
                     )
                 set_rules_for_permfile(conn, permfile)
 
-            link_existing_rules_to_file(conn, path)
+            # Modifying a file does not change which rules apply to it, the existing links are kept.
+            # The cached rules do not include uncommitted changes to permfiles, new permfiles are linked without it.
+            if is_new_file:
+                rules_cache = None if path.name.endswith(PERM_FILE) else self.rules_cache
+                link_existing_rules_to_file(conn, path, rules_cache)
 
+            if path.name.endswith(PERM_FILE):
+                # Clear before committing, other writers can only link files with fresh rules after the commit
+                self._clear_rules_cache()
             conn.commit()
             cursor.close()
 
+        if path.name.endswith(PERM_FILE):
+            self._clear_rules_cache()
+            get_permission_tree(self.server_settings.snapshot_folder).update(path)
+
+    def get_tree(self, path: RelativePath, user: str, depth: Optional[int] = None) -> list[DirHash]:
+        """
+        Get the summary hashes of a directory and its subdirectories, up to `depth` levels below the directory.
+
+        Datasite owners can read all files in their datasite, so the stored hashes are returned.
+        For other users the hashes are calculated from the files they can read, and cached until a file or permfile
+        in the datasite changes.
+        """
+        dir_path = path.as_posix()
+        if path.parts and path.parts[0] == user:
+            with get_db(self.db_path) as conn:
+                rows = db.get_dir_hashes(conn, dir_path, depth)
+            return [
+                DirHash(
+                    path=Path(row["path"]), hash=row["hash"], files_hash=row["files_hash"], file_count=row["file_count"]
+                )
+                for row in rows
+            ]
+
+        if self.tree_cache is None or not path.parts:
+            return self._get_readable_tree(path, user, depth)
+
+        key = (user, dir_path, depth)
+        generation = self.tree_cache.generation
+        with get_db(self.db_path) as conn:
+            datasite_rows = db.get_dir_hashes(conn, path.parts[0], depth=0)
+        datasite_hash = datasite_rows[0]["hash"] if datasite_rows else None
+        tree = self.tree_cache.get(key, datasite_hash)
+        if tree is None:
+            tree = self._get_readable_tree(path, user, depth)
+            self.tree_cache.set(key, datasite_hash, tree, generation)
+        return tree
+
+    def _get_readable_tree(self, path: RelativePath, user: str, depth: Optional[int]) -> list[DirHash]:
+        dir_path = path.as_posix()
+        max_depth = len(path.parts) + depth if depth is not None else None
+        readable_files = [
+            (file.path.as_posix(), file.hash)
+            for file in self.list_for_user(email=user, path=path)
+            if file.path.as_posix().startswith(dir_path + "/")
+        ]
+        return [
+            DirHash(path=Path(dir), hash=dir_hash, files_hash=files_hash, file_count=file_count)
+            for dir, (dir_hash, files_hash, file_count) in sorted(dir_summary_hashes(readable_files).items())
+            if (dir == dir_path or dir.startswith(dir_path + "/"))
+            and (max_depth is None or len(dir.split("/")) <= max_depth)
+        ]
+
     def list_for_user(
         self,
         *,
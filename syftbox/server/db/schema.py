@@ -24,13 +24,26 @@ def get_db(path: PathLike) -> sqlite3.Connection:
             datasite TEXT NOT NULL,
             path TEXT NOT NULL UNIQUE,
             hash TEXT NOT NULL,
-            signature TEXT NOT NULL,
+            signature BLOB NOT NULL,
             file_size INTEGER NOT NULL,
             last_modified TEXT NOT NULL        )
         """
         )
         # TODO: migrate file_metadata id?
 
+        # Rolling summary hashes of all directories that contain files, see db.update_dir_hashes
+        conn.execute(
+            """
+        CREATE TABLE IF NOT EXISTS dir_hashes (
+            path TEXT PRIMARY KEY,
+            depth INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            files_hash TEXT NOT NULL,
+            file_count INTEGER NOT NULL
+        )
+        """
+        )
+
         # Create a table for storing file information
         conn.execute(
             """
@@ -39,6 +52,7 @@ def get_db(path: PathLike) -> sqlite3.Connection:
                 permfile_dir varchar(1000) NOT NULL,
                 permfile_depth INTEGER NOT NULL,
                 priority INTEGER NOT NULL,
+                effective_priority INTEGER NOT NULL,
                 path varchar(1000) NOT NULL,
                 user varchar(1000) NOT NULL,
                 can_read bool NOT NULL,
@@ -64,4 +78,31 @@ def get_db(path: PathLike) -> sqlite3.Connection:
         );
         """
         )
+
+        # Indexes for resolving permissions, see db.get_read_permissions_for_user.
+        # The rule indexes include all columns that are needed to resolve a permission, so the rules table
+        # itself is not read. The file_id index is also used when file metadata is deleted (ON DELETE CASCADE).
+        conn.execute(
+            """
+        CREATE INDEX IF NOT EXISTS idx_rules_user ON rules (
+            user, permfile_path, priority, effective_priority, can_read, admin, disallow
+        )
+        """
+        )
+        conn.execute(
+            """
+        CREATE INDEX IF NOT EXISTS idx_rules_permfile_dir ON rules (permfile_dir)
+        """
+        )
+        conn.execute(
+            """
+        CREATE INDEX IF NOT EXISTS idx_rule_files_file_id ON rule_files (file_id, permfile_path, priority)
+        """
+        )
+        conn.execute(
+            """
+        CREATE INDEX IF NOT EXISTS idx_rule_files_match_for_email ON rule_files (match_for_email)
+        WHERE match_for_email IS NOT NULL
+        """
+        )
     return conn
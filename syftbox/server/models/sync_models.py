@@ -1,11 +1,11 @@
 import base64
 import enum
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Annotated, Any, Optional
 
-from pydantic import AfterValidator, BaseModel, Field
+from pydantic import AfterValidator, BaseModel, BeforeValidator, Field, PlainSerializer
 
 
 def should_be_relative(v: Path) -> Path:
@@ -25,23 +25,37 @@ RelativePath = Annotated[Path, AfterValidator(should_be_relative)]
 AbsolutePath = Annotated[Path, AfterValidator(should_be_absolute)]
 
 
+def b85_to_bytes(v: Any) -> Any:
+    if isinstance(v, str):
+        return base64.b85decode(v)
+    return v
+
+
+def bytes_to_b85(v: bytes) -> str:
+    return base64.b85encode(v).decode("utf-8")
+
+
+# Raw bytes, base85 encoded in JSON. Validation accepts both raw bytes and base85 strings.
+Base85Bytes = Annotated[bytes, BeforeValidator(b85_to_bytes), PlainSerializer(bytes_to_b85, when_used="json")]
+
+
 class DiffRequest(BaseModel):
     path: RelativePath
-    signature: str
+    signature: Base85Bytes
 
     @property
     def signature_bytes(self) -> bytes:
-        return base64.b85decode(self.signature)
+        return self.signature
 
 
 class DiffResponse(BaseModel):
     path: RelativePath
-    diff: str
+    diff: Base85Bytes
     hash: str
 
     @property
     def diff_bytes(self) -> bytes:
-        return base64.b85decode(self.diff)
+        return self.diff
 
 
 class SignatureError(str, enum.Enum):
@@ -71,12 +85,12 @@ class BatchFileRequest(BaseModel):
 
 class ApplyDiffRequest(BaseModel):
     path: RelativePath
-    diff: str
+    diff: Base85Bytes
     expected_hash: str
 
     @property
     def diff_bytes(self) -> bytes:
-        return base64.b85decode(self.diff)
+        return self.diff
 
 
 class ApplyDiffResponse(BaseModel):
@@ -88,7 +102,7 @@ class ApplyDiffResponse(BaseModel):
 class FileMetadata(BaseModel):
     path: Path
     hash: str
-    signature: str
+    signature: Base85Bytes
     file_size: int = 0
     last_modified: datetime
 
@@ -108,7 +122,15 @@ class FileMetadata(BaseModel):
 
     @property
     def signature_bytes(self) -> bytes:
-        return base64.b85decode(self.signature)
+        return self.signature
+
+    @property
+    def block_size(self) -> Optional[int]:
+        """rsync block size of the signature, None if the file is small and has no signature"""
+        # syftbox.lib imports the models, importing it at the top of this module is circular
+        from syftbox.lib.rsync import signature_block_size
+
+        return signature_block_size(self.signature)
 
     @property
     def hash_bytes(self) -> bytes:
@@ -124,6 +146,136 @@ class FileMetadata(BaseModel):
         return self.path == value.path and self.hash == value.hash
 
 
+class FileListingEntry(BaseModel):
+    """FileMetadata without the rsync signature, used for listing the files of a datasite."""
+
+    path: Path
+    hash: str
+    file_size: int = 0
+    last_modified: datetime
+
+
+class DatasiteListing(BaseModel):
+    summary_hash: str = Field(description="Summary hash of the path and hash of all files in the listing")
+    files: list[FileListingEntry]
+
+
+class DirHash(BaseModel):
+    path: RelativePath
+    hash: str = Field(description="Summary hash of all files in the directory and its subdirectories")
+    files_hash: str = Field(description="Summary hash of the files directly in the directory")
+    file_count: int = Field(description="Number of files in the directory and its subdirectories")
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def datetime_to_ns(dt: datetime) -> int:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - EPOCH) // timedelta(microseconds=1) * 1000
+
+
+def ns_to_datetime(ns: int) -> datetime:
+    return EPOCH + timedelta(microseconds=ns // 1000)
+
+
+class FileRecord:
+    """
+    Compact representation of `FileMetadata`, used on the client sync path. Records should not be modified.
+
+    The client builds and compares these for every file on every sync, `FileMetadata` is only used at API boundaries.
+    Two records are equal if they have the same path and content hash, same as `FileMetadata`.
+
+    Attributes:
+        path: posix path, relative to the datasites folder
+        digest: raw sha256 digest of the file content
+        file_size: file size in bytes
+        mtime_ns: last modified time in nanoseconds since the epoch, truncated to microseconds like the datetimes
+            of `FileMetadata`, so local and remote times can be compared
+        signature: raw rsync signature, only set if it was received from the server
+    """
+
+    __slots__ = ("path", "digest", "file_size", "mtime_ns", "signature")
+
+    path: str
+    digest: bytes
+    file_size: int
+    mtime_ns: int
+    signature: Optional[bytes]
+
+    def __init__(
+        self, path: str, digest: bytes, file_size: int, mtime_ns: int, signature: Optional[bytes] = None
+    ) -> None:
+        self.path = path
+        self.digest = digest
+        self.file_size = file_size
+        self.mtime_ns = mtime_ns - mtime_ns % 1000
+        self.signature = signature
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, FileRecord):
+            return False
+        return self.path == other.path and self.digest == other.digest
+
+    def __hash__(self) -> int:
+        return hash((self.path, self.digest))
+
+    def __repr__(self) -> str:
+        return f"FileRecord(path={self.path!r}, hash={self.hash[:8]}, file_size={self.file_size})"
+
+    @property
+    def hash(self) -> str:
+        """sha256 hex digest, same as `FileMetadata.hash`"""
+        return self.digest.hex()
+
+    @property
+    def last_modified(self) -> datetime:
+        return ns_to_datetime(self.mtime_ns)
+
+    @property
+    def datasite(self) -> str:
+        return self.path.split("/", 1)[0]
+
+    @classmethod
+    def from_metadata(cls, metadata: FileMetadata) -> "FileRecord":
+        return cls(
+            path=metadata.path.as_posix(),
+            digest=bytes.fromhex(metadata.hash),
+            file_size=metadata.file_size,
+            mtime_ns=datetime_to_ns(metadata.last_modified),
+            signature=metadata.signature_bytes,
+        )
+
+    @classmethod
+    def from_json(cls, data: dict) -> "FileRecord":
+        """Create a FileRecord from a serialized `FileMetadata`, without validating it. Signatures are not kept."""
+        last_modified = data["last_modified"]
+        if last_modified.endswith("Z"):
+            # fromisoformat only supports the Z suffix from python 3.11
+            last_modified = last_modified[:-1] + "+00:00"
+        return cls(
+            path=data["path"],
+            digest=bytes.fromhex(data["hash"]),
+            file_size=data.get("file_size", 0),
+            mtime_ns=datetime_to_ns(datetime.fromisoformat(last_modified)),
+        )
+
+    def without_signature(self) -> "FileRecord":
+        if self.signature is None:
+            return self
+        return FileRecord(self.path, self.digest, self.file_size, self.mtime_ns)
+
+    def to_metadata(self) -> FileMetadata:
+        return FileMetadata(
+            path=Path(self.path),
+            hash=self.hash,
+            signature=self.signature or b"",
+            file_size=self.file_size,
+            last_modified=self.last_modified,
+        )
+
+
 class SyncLog(BaseModel):
     path: Path
     method: str  # pull or push
@@ -13,6 +13,8 @@ from typing_extensions import AsyncGenerator, Optional
 from syftbox import __version__
 from syftbox.server.api.v1.main_router import main_router
 from syftbox.server.api.v1.sync_router import router as sync_router
+from syftbox.server.content_cache import ContentCache
+from syftbox.server.db.db import AncestorRulesCache, UserTreeCache
 from syftbox.server.emails.router import router as emails_router
 from syftbox.server.logger import setup_logger
 from syftbox.server.middleware import LoguruMiddleware, RequestSizeLimitMiddleware, VersionCheckMiddleware
@@ -38,8 +40,19 @@ def _server_setup(app: FastAPI, settings: ServerSettings) -> dict[str, Any]:
     else:
         logger.info("OTel Exporter is DISABLED")
 
+    content_cache = None
+    if settings.content_cache_size_in_mb > 0:
+        content_cache = ContentCache(
+            max_memory_bytes=settings.content_cache_size_in_mb * 1024 * 1024,
+            cache_dir=settings.cache_folder / "signatures",
+            max_disk_bytes=settings.signature_cache_size_in_mb * 1024 * 1024,
+        )
+
     return {
         "server_settings": settings,
+        "content_cache": content_cache,
+        "rules_cache": AncestorRulesCache(),
+        "tree_cache": UserTreeCache(),
     }
 
 
@@ -60,6 +60,12 @@ class ServerSettings(BaseSettings):
     request_size_limit_in_mb: int = 10
     """Request size limit in MB"""
 
+    content_cache_size_in_mb: int = 256
+    """Memory used for caching file contents and rsync signatures in MB, 0 disables the cache"""
+
+    signature_cache_size_in_mb: int = 1024
+    """Disk space used for caching rsync signatures in MB, 0 disables the disk cache"""
+
     @field_validator("data_folder", mode="after")
     def data_folder_abs(cls, v: Path) -> Path:
         return Path(v).expanduser().resolve()
@@ -93,6 +99,10 @@ class ServerSettings(BaseSettings):
     def logs_folder(self) -> Path:
         return self.data_folder / "logs"
 
+    @property
+    def cache_folder(self) -> Path:
+        return self.data_folder / "cache"
+
     @property
     def user_file_path(self) -> Path:
         return self.data_folder / "users.json"
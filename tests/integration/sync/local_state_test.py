@@ -0,0 +1,171 @@
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+
+from syftbox.client.plugins.sync.local_state import (
+    LEGACY_LOCAL_STATE_FILENAME,
+    LOCAL_STATE_FILENAME,
+    LegacyLocalState,
+    LocalState,
+)
+from syftbox.client.plugins.sync.types import SyncActionType, SyncStatus
+from syftbox.server.models.sync_models import FileMetadata, FileRecord, datetime_to_ns
+
+
+def make_record(path: Path, digest: bytes = b"hash") -> FileRecord:
+    return FileRecord(
+        path=path.as_posix(),
+        digest=digest,
+        file_size=10,
+        mtime_ns=datetime_to_ns(datetime.now(tz=timezone.utc)),
+    )
+
+
+def count_rows(db_path: Path, table: str) -> int:
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_local_state_save_and_load(tmp_path: Path):
+    state = LocalState(path=tmp_path / LOCAL_STATE_FILENAME)
+    state.load()
+    assert state.path.is_file()
+
+    paths = [Path(f"user@openmined.org/file_{i}.txt") for i in range(10)]
+    for path in paths:
+        state.insert_synced_file(path, make_record(path), action=SyncActionType.CREATE_REMOTE)
+    state.insert_status_info(paths[0], SyncStatus.ERROR, message="error", action=SyncActionType.MODIFY_REMOTE)
+    state.insert_synced_file(paths[1], None, action=SyncActionType.DELETE_LOCAL)
+
+    loaded_state = LocalState(path=state.path)
+    loaded_state.load()
+    assert set(loaded_state.states.keys()) == set(paths[2:]) | {paths[0]}
+    assert loaded_state.states[paths[2]] == state.states[paths[2]]
+    assert loaded_state.status_info[paths[0]].status == SyncStatus.ERROR
+    assert loaded_state.status_info[paths[0]].message == "error"
+    assert loaded_state.status_info[paths[1]].action == SyncActionType.DELETE_LOCAL
+
+
+def test_local_state_save_is_incremental(tmp_path: Path):
+    state = LocalState(path=tmp_path / LOCAL_STATE_FILENAME)
+    state.load()
+
+    paths = [Path(f"user@openmined.org/file_{i}.txt") for i in range(100)]
+    for path in paths:
+        state.insert_synced_file(path, make_record(path), action=SyncActionType.CREATE_REMOTE, save=False)
+    state.save()
+    assert count_rows(state.path, "states") == len(paths)
+
+    # A single update only writes the changed rows: the state, its status info and the status count
+    conn = state._connect()
+    changes_before = conn.total_changes
+    state.insert_synced_file(paths[0], make_record(paths[0], digest=b"new_hash"), action=SyncActionType.MODIFY_LOCAL)
+    assert conn.total_changes - changes_before == 3
+
+    loaded_state = LocalState(path=state.path)
+    loaded_state.load()
+    assert loaded_state.states[paths[0]].digest == b"new_hash"
+
+
+def test_local_state_migrate_legacy_json(tmp_path: Path):
+    path = Path("user@openmined.org/file.txt")
+    legacy_path = tmp_path / LEGACY_LOCAL_STATE_FILENAME
+    metadata = FileMetadata(
+        path=path,
+        hash="ab" * 32,
+        signature="signature",
+        file_size=10,
+        last_modified=datetime.now(tz=timezone.utc),
+    )
+    legacy_state = LegacyLocalState(states={path: metadata})
+    legacy_path.write_text(legacy_state.model_dump_json())
+
+    state = LocalState(path=tmp_path / LOCAL_STATE_FILENAME)
+    state.load()
+    assert state.states[path] == FileRecord.from_metadata(metadata)
+    assert state.states[path].signature is None
+    assert not legacy_path.exists()
+
+    loaded_state = LocalState(path=state.path)
+    loaded_state.load()
+    assert loaded_state.states[path] == FileRecord.from_metadata(metadata)
+    assert loaded_state.states[path].last_modified == metadata.last_modified
+
+
+def test_local_state_migrate_schema_v1(tmp_path: Path):
+    path = Path("user@openmined.org/file.txt")
+    last_modified = datetime.now(tz=timezone.utc)
+    db_path = tmp_path / LOCAL_STATE_FILENAME
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE states (path TEXT PRIMARY KEY, hash TEXT, signature TEXT, file_size INTEGER, last_modified TEXT)"
+        )
+        conn.execute(
+            "INSERT INTO states VALUES (?, ?, ?, ?, ?)",
+            (path.as_posix(), "ab" * 32, "signature", 10, last_modified.isoformat()),
+        )
+        conn.execute("PRAGMA user_version = 1")
+
+    state = LocalState(path=db_path)
+    state.load()
+    assert state.states[path].hash == "ab" * 32
+    assert state.states[path].file_size == 10
+    assert state.states[path].last_modified == last_modified
+
+
+def test_local_state_status_info_is_bounded(tmp_path: Path):
+    state = LocalState(path=tmp_path / LOCAL_STATE_FILENAME, max_status_info=10, max_recent_errors=3)
+    state.load()
+
+    paths = [Path(f"user@openmined.org/file_{i}.txt") for i in range(25)]
+    for path in paths:
+        state.insert_status_info(path, SyncStatus.IGNORED, save=False)
+    for path in paths[:5]:
+        state.insert_status_info(path, SyncStatus.ERROR, message="error", save=False)
+    state.save()
+
+    # Most recently updated entries are kept
+    assert list(state.status_info.keys()) == paths[20:] + paths[:5]
+    assert list(state.recent_errors.keys()) == paths[2:5]
+    assert state.status_counts == {SyncStatus.IGNORED: 25, SyncStatus.ERROR: 5}
+    assert count_rows(state.path, "status_info") == 10
+
+    loaded_state = LocalState(path=state.path, max_status_info=10, max_recent_errors=3)
+    loaded_state.load()
+    assert set(loaded_state.status_info.keys()) == set(state.status_info.keys())
+    assert loaded_state.status_counts == state.status_counts
+    # recent_errors is rebuilt from the errors that are still in status_info
+    assert list(loaded_state.recent_errors.keys()) == paths[2:5]
+
+
+def test_local_state_recent_errors_resolved(tmp_path: Path):
+    state = LocalState(path=tmp_path / LOCAL_STATE_FILENAME)
+    state.load()
+
+    path = Path("user@openmined.org/file.txt")
+    state.insert_status_info(path, SyncStatus.ERROR, message="error")
+    assert set(state.recent_errors.keys()) == {path}
+
+    state.insert_status_info(path, SyncStatus.SYNCED)
+    assert state.recent_errors == {}
+
+
+def test_local_state_prune_missing(tmp_path: Path):
+    datasites_dir = tmp_path / "datasites"
+    state = LocalState(path=tmp_path / LOCAL_STATE_FILENAME)
+    state.load()
+
+    existing_path = Path("user@openmined.org/existing.txt")
+    (datasites_dir / existing_path).parent.mkdir(parents=True)
+    (datasites_dir / existing_path).write_text("content")
+    deleted_path = Path("user@openmined.org/deleted.txt")
+    error_path = Path("user@openmined.org/error.txt")
+
+    state.insert_status_info(existing_path, SyncStatus.IGNORED)
+    state.insert_status_info(deleted_path, SyncStatus.IGNORED)
+    state.insert_status_info(error_path, SyncStatus.ERROR, message="error")
+
+    assert state.prune_missing(datasites_dir) == 2
+    assert set(state.status_info.keys()) == {existing_path}
+    assert set(state.recent_errors.keys()) == {error_path}
+    assert count_rows(state.path, "status_info") == 1
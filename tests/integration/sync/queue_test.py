@@ -1,4 +1,6 @@
 import random
+import threading
+import time
 from pathlib import Path
 from queue import Empty
 
@@ -55,3 +57,94 @@ def test_sync_queue_dedupe():
     queue.get()
     assert len(queue.all_items) == 0
     assert queue.empty()
+
+
+def test_sync_queue_upgrade_priority():
+    queue = SyncQueue()
+
+    paths = [Path(f"file_{i}.txt") for i in range(10)]
+    for i, path in enumerate(paths):
+        queue.put(SyncQueueItem(100 + i, MockFileChangeInfo(path=path)))
+
+    # Re-queueing a path with a higher priority moves it to the front
+    queue.put(SyncQueueItem(0, MockFileChangeInfo(path=paths[5])))
+    # A lower priority does not delay an item that is already queued
+    queue.put(SyncQueueItem(1000, MockFileChangeInfo(path=paths[0])))
+
+    assert len(queue) == len(paths)
+    assert queue.get().data.path == paths[5]
+    assert [queue.get().data.path for _ in range(len(paths) - 1)] == paths[:5] + paths[6:]
+
+
+def test_sync_queue_coalesce_latest_change_wins():
+    queue = SyncQueue()
+
+    path = Path("file.txt")
+    first_item = SyncQueueItem(10, MockFileChangeInfo(path=path))
+    queue.put(first_item)
+
+    latest_change = MockFileChangeInfo(path=path)
+    queue.put(SyncQueueItem(5, latest_change))
+
+    item = queue.get()
+    assert item.data is latest_change
+    assert item.priority == 5
+    assert item.enqueued_at == first_item.enqueued_at
+    assert queue.empty()
+
+
+def test_sync_queue_get_many():
+    queue = SyncQueue()
+    assert queue.get_many(10) == []
+
+    n = 100
+    priorities = [random.randint(0, 10) for _ in range(n)]
+    for i, priority in enumerate(priorities):
+        queue.put(SyncQueueItem(priority, MockFileChangeInfo(path=Path(f"file_{i}.txt"))))
+
+    items = queue.get_many(30) + queue.get_many(n)
+    # Sorted by priority, ties are returned in insertion order
+    expected_order = sorted(range(n), key=lambda i: (priorities[i], i))
+    assert [item.data.path for item in items] == [Path(f"file_{i}.txt") for i in expected_order]
+    assert queue.empty()
+    assert len(queue.all_items) == 0
+
+
+def test_sync_queue_blocking_get():
+    queue = SyncQueue()
+    item = SyncQueueItem(1, MockFileChangeInfo(path=Path("file.txt")))
+
+    timer = threading.Timer(0.05, queue.put, args=(item,))
+    timer.start()
+    assert queue.get(block=True, timeout=5) == item
+    timer.join()
+
+    with pytest.raises(Empty):
+        queue.get(block=True, timeout=0.01)
+
+
+def test_sync_queue_blocking_put_coalesces():
+    queue = SyncQueue(maxsize=2)
+    queue.put(SyncQueueItem(1, MockFileChangeInfo(path=Path("a.txt"))))
+    queue.put(SyncQueueItem(1, MockFileChangeInfo(path=Path("b.txt"))))
+
+    # Two producers wait for capacity to queue the same path
+    path = Path("file.txt")
+    producers = [
+        threading.Thread(
+            target=queue.put, args=(SyncQueueItem(priority, MockFileChangeInfo(path=path)),), kwargs={"block": True}
+        )
+        for priority in [2, 3]
+    ]
+    for producer in producers:
+        producer.start()
+    while len(queue.not_full._waiters) < 2:  # type: ignore[attr-defined]
+        time.sleep(0.001)
+
+    assert len(queue.get_many(2)) == 2
+    for producer in producers:
+        producer.join(timeout=5)
+
+    assert len(queue) == 1
+    assert queue.get().priority == 2
+    assert queue.empty()
@@ -3,6 +3,7 @@ from pathlib import Path
 from fastapi.testclient import TestClient
 
 from syftbox.client.base import SyftBoxContextInterface
+from syftbox.client.plugins.sync.constants import PERMISSION_CHECK_MIN_SIZE
 from syftbox.client.plugins.sync.manager import SyncManager
 from syftbox.client.plugins.sync.sync_action import format_rejected_path
 from syftbox.client.utils.dir_tree import create_dir_tree
@@ -114,3 +115,93 @@ def test_modify_without_permissions(
     assert (folder_on_ds1 / "file.txt").read_text() == "Hello, World!"
     assert (folder_on_ds2 / "file.txt").read_text() == "Hello, World!"
     assert format_rejected_path(folder_on_ds2 / "file.txt").read_text() == "Modified"
+
+
+def test_large_upload_rejected_locally(
+    server_client: TestClient,
+    datasite_1: SyftBoxContextInterface,
+    datasite_2: SyftBoxContextInterface,
+    monkeypatch,
+):
+    sync_service_1 = SyncManager(datasite_1)
+    sync_service_2 = SyncManager(datasite_2)
+
+    tree = {
+        "folder_1": {
+            PERM_FILE: SyftPermission.mine_with_public_read(datasite_1, dir=datasite_1.my_datasite / "folder_1"),
+            "file.txt": "Hello, World!",
+        },
+    }
+    create_dir_tree(Path(datasite_1.my_datasite), tree)
+    sync_service_1.run_single_thread()
+    sync_service_2.run_single_thread()
+
+    folder_on_ds2 = datasite_2.workspace.datasites / datasite_1.email / "folder_1"
+    large_content = "x" * PERMISSION_CHECK_MIN_SIZE
+
+    # Small uploads are sent and rejected by the server
+    (folder_on_ds2 / "small_file.txt").write_text("New")
+    sync_service_2.run_single_thread()
+    assert format_rejected_path(folder_on_ds2 / "small_file.txt").read_text() == "New"
+
+    def upload_not_allowed(*args, **kwargs):
+        raise AssertionError("Upload should have been rejected locally")
+
+    # Large uploads that the synced permission file does not allow are checked with the server, and not sent
+    monkeypatch.setattr(datasite_2.client.sync, "create", upload_not_allowed)
+    monkeypatch.setattr(datasite_2.client.sync, "apply_diff", upload_not_allowed)
+    (folder_on_ds2 / "new_file.txt").write_text(large_content)
+    (folder_on_ds2 / "file.txt").write_text(large_content)
+    sync_service_2.run_single_thread()
+
+    assert format_rejected_path(folder_on_ds2 / "new_file.txt").read_text() == large_content
+    assert format_rejected_path(folder_on_ds2 / "file.txt").read_text() == large_content
+    assert (folder_on_ds2 / "file.txt").read_text() == "Hello, World!"
+    monkeypatch.undo()
+
+    # After datasite_1 gives write access, the upload is accepted
+    (datasite_1.my_datasite / "folder_1" / PERM_FILE).write_text(
+        f"- path: '**'\n  user: '{datasite_2.email}'\n  permissions: [read, write, create]\n"
+    )
+    sync_service_1.run_single_thread()
+    sync_service_2.run_single_thread()
+    (folder_on_ds2 / "new_file.txt").write_text(large_content)
+    sync_service_2.run_single_thread()
+    sync_service_1.run_single_thread()
+
+    assert (datasite_1.my_datasite / "folder_1" / "new_file.txt").read_text() == large_content
+
+
+def test_upload_allowed_by_hidden_permfile(
+    server_client: TestClient, datasite_1: SyftBoxContextInterface, datasite_2: SyftBoxContextInterface
+):
+    sync_service_1 = SyncManager(datasite_1)
+    sync_service_2 = SyncManager(datasite_2)
+
+    # datasite_2 can read the root permission file, but not the one in inbox that gives it create access
+    (datasite_1.my_datasite / PERM_FILE).write_text(
+        f"- path: '{PERM_FILE}'\n  user: '*'\n  permissions: [read]\n"
+        "- path: '**/*.csv'\n  user: '*'\n  permissions: [read]\n"
+    )
+    (datasite_1.my_datasite / "inbox").mkdir()
+    (datasite_1.my_datasite / "inbox" / PERM_FILE).write_text(
+        "- path: '*.csv'\n  user: '*'\n  permissions: [create, write]\n"
+    )
+    sync_service_1.run_single_thread()
+    sync_service_2.run_single_thread()
+
+    datasite_on_ds2 = datasite_2.workspace.datasites / datasite_1.email
+    assert (datasite_on_ds2 / PERM_FILE).exists()
+    assert not (datasite_on_ds2 / "inbox" / PERM_FILE).exists()
+
+    # The synced permission files do not allow the upload, the server does
+    content = "a,b\n" * (PERMISSION_CHECK_MIN_SIZE // 4)
+    new_file = datasite_on_ds2 / "inbox" / "x.csv"
+    new_file.parent.mkdir(parents=True, exist_ok=True)
+    new_file.write_text(content)
+    sync_service_2.run_single_thread()
+    sync_service_1.run_single_thread()
+
+    assert not format_rejected_path(new_file).exists()
+    assert new_file.read_text() == content
+    assert (datasite_1.my_datasite / "inbox" / "x.csv").read_text() == content
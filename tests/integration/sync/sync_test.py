@@ -1,22 +1,29 @@
 import os
 import shutil
 import time
+from functools import partial
 from pathlib import Path
 
 import faker
+import httpx
 import pytest
 import yaml
 from fastapi.testclient import TestClient
 
 from syftbox.client.base import SyftBoxContextInterface
+from syftbox.client.plugins.sync import consumer as consumer_module
 from syftbox.client.plugins.sync.constants import MAX_FILE_SIZE_MB
+from syftbox.client.plugins.sync.consumer import split_into_chunks
 from syftbox.client.plugins.sync.datasite_state import DatasiteState
 from syftbox.client.plugins.sync.exceptions import FatalSyncError
+from syftbox.client.plugins.sync.local_state import LocalState
 from syftbox.client.plugins.sync.manager import SyncManager
 from syftbox.client.plugins.sync.queue import SyncQueueItem
+from syftbox.client.server_client import SyncClient
 from syftbox.client.utils.dir_tree import DirTree, create_dir_tree
 from syftbox.lib.constants import PERM_FILE
 from syftbox.lib.permissions import SyftPermission
+from syftbox.server.models.sync_models import FileRecord
 from syftbox.server.settings import ServerSettings
 
 fake = faker.Faker()
@@ -143,6 +150,49 @@ def test_create_file(
     assert_files_on_datasite(datasite_2, [Path(datasite_1.email) / "folder1" / "file.txt"])
 
 
+def test_consume_all_parallel(server_client: TestClient, datasite_1: SyftBoxContextInterface):
+    sync_service = SyncManager(datasite_1)
+    sync_service.run_single_thread()
+
+    num_files = 50
+    tree = {
+        "folder1": {
+            PERM_FILE: SyftPermission.mine_with_public_read(datasite_1, dir=datasite_1.my_datasite / "folder1"),
+            **{f"file_{i}.txt": fake.text(max_nb_chars=100) for i in range(num_files)},
+        },
+    }
+    create_dir_tree(Path(datasite_1.my_datasite), tree)
+
+    # Record the start and end of each processed file
+    events: list[tuple[str, Path]] = []
+    process_filechange = sync_service.consumer.process_filechange
+
+    def process_filechange_with_events(item: SyncQueueItem) -> None:
+        events.append(("start", item.data.path))
+        if item.priority == 0:
+            time.sleep(0.2)
+        process_filechange(item)
+        events.append(("end", item.data.path))
+
+    sync_service.consumer.process_filechange = process_filechange_with_events
+    sync_service.run_single_thread()
+
+    # All files are synced, and the local state is saved once the queue is drained
+    folder = Path(datasite_1.email) / "folder1"
+    assert_files_on_server(server_client, [folder / f"file_{i}.txt" for i in range(num_files)])
+    assert len(events) == 2 * (num_files + 1)
+    assert sync_service.queue.empty()
+
+    saved_state = LocalState(path=sync_service.local_state.path)
+    saved_state.load()
+    assert all(folder / f"file_{i}.txt" in saved_state.states for i in range(num_files))
+
+    # The permission file is fully synced before any other file is started
+    permfile_end = events.index(("end", folder / PERM_FILE))
+    first_file_start = min(i for i, (event, path) in enumerate(events) if event == "start" and path.name != PERM_FILE)
+    assert permfile_end < first_file_start
+
+
 def test_modify(server_client: TestClient, datasite_1: SyftBoxContextInterface):
     server_settings: ServerSettings = server_client.app_state["server_settings"]
     sync_service_1 = SyncManager(datasite_1)
@@ -205,6 +255,35 @@ def test_modify_and_pull(
     assert (Path(datasite_2.workspace.datasites) / datasite_1.email / "folder1" / "file.txt").read_text() == new_content
 
 
+def test_modify_local_large_file(
+    server_client: TestClient, datasite_1: SyftBoxContextInterface, datasite_2: SyftBoxContextInterface
+):
+    sync_service_1 = SyncManager(datasite_1)
+    sync_service_2 = SyncManager(datasite_2)
+
+    tree = {
+        "folder1": {
+            PERM_FILE: SyftPermission.mine_with_public_rw(datasite_1, dir=datasite_1.my_datasite / "folder1"),
+        },
+    }
+    create_dir_tree(Path(datasite_1.my_datasite), tree)
+    file_path = datasite_1.my_datasite / "folder1" / "large.bin"
+    content = os.urandom(2_000_000)
+    file_path.write_bytes(content)
+    sync_service_1.run_single_thread()
+    sync_service_2.run_single_thread()
+
+    # The modified file is patched in place on datasite_2, from a streamed diff
+    new_content = content[:1_000_000] + b"modified" + content[1_000_100:]
+    file_path.write_bytes(new_content)
+    sync_service_1.run_single_thread()
+    sync_service_2.run_single_thread()
+
+    local_path = datasite_2.workspace.datasites / datasite_1.email / "folder1" / "large.bin"
+    assert local_path.read_bytes() == new_content
+    assert not list(local_path.parent.glob("*.tmp"))
+
+
 def test_modify_with_conflict(
     server_client: TestClient, datasite_1: SyftBoxContextInterface, datasite_2: SyftBoxContextInterface
 ):
@@ -291,7 +370,7 @@ def test_delete_file(
 
     # Check if the metadata is gone
     remote_state_1 = sync_service_1.producer.get_datasite_states()[0].get_remote_state()
-    remote_paths = {metadata.path for metadata in remote_state_1}
+    remote_paths = {Path(metadata.path) for metadata in remote_state_1}
     assert Path(datasite_1.email) / "folder1" / "file.txt" not in remote_paths
 
 
@@ -467,3 +546,155 @@ def test_sync_health_check(datasite_1: SyftBoxContextInterface):
     sync_service.context.client.conn.headers["Authorization"] = "Bearer invalid_token"
     with pytest.raises(FatalSyncError):
         sync_service.check_server_status()
+
+
+def test_skip_unchanged_datasites(
+    server_client: TestClient, datasite_1: SyftBoxContextInterface, monkeypatch: pytest.MonkeyPatch
+):
+    sync_service = SyncManager(datasite_1)
+    # First run syncs the datasite setup, second run finds the datasite in sync
+    sync_service.run_single_thread()
+    sync_service.run_single_thread()
+
+    compared_datasites = []
+    original_get_changes = DatasiteState.get_datasite_changes
+
+    def get_datasite_changes(self: DatasiteState, dirs=None):
+        compared_datasites.append(self.email)
+        return original_get_changes(self, dirs=dirs)
+
+    monkeypatch.setattr(DatasiteState, "get_datasite_changes", get_datasite_changes)
+
+    # Nothing changed since the previous sync, datasite is not compared
+    sync_service.run_single_thread()
+    assert compared_datasites == []
+
+    # Local change
+    file_path = datasite_1.my_datasite / "file.txt"
+    file_path.write_text("content")
+    sync_service.run_single_thread()
+    assert compared_datasites == [datasite_1.email]
+    assert_files_on_server(server_client, [Path(datasite_1.email) / "file.txt"])
+
+    # In sync again, the next run does not compare the datasite
+    compared_datasites.clear()
+    sync_service.run_single_thread()
+    sync_service.run_single_thread()
+    assert compared_datasites == [datasite_1.email]
+
+
+def test_compare_changed_remote_dirs_only(
+    datasite_1: SyftBoxContextInterface, datasite_2: SyftBoxContextInterface, monkeypatch: pytest.MonkeyPatch
+):
+    sync_service_1 = SyncManager(datasite_1)
+    sync_service_2 = SyncManager(datasite_2)
+
+    tree = {
+        "folder1": {
+            PERM_FILE: SyftPermission.mine_with_public_read(datasite_1, dir=datasite_1.my_datasite / "folder1"),
+            "a": {"file.txt": "content a", "nested": {"file.txt": "content nested"}},
+            "b": {"file.txt": "content b"},
+        },
+    }
+    create_dir_tree(Path(datasite_1.my_datasite), tree)
+    sync_service_1.run_single_thread()
+    # First run downloads all files, second run finds datasite_1 in sync
+    sync_service_2.run_single_thread()
+    sync_service_2.run_single_thread()
+    assert datasite_1.email in sync_service_2.producer.in_sync_trees
+
+    compared_dirs = {}
+    original_get_changes = DatasiteState.get_datasite_changes
+
+    def get_datasite_changes(self: DatasiteState, dirs=None):
+        compared_dirs[self.email] = dirs
+        return original_get_changes(self, dirs=dirs)
+
+    monkeypatch.setattr(DatasiteState, "get_datasite_changes", get_datasite_changes)
+
+    # Modify a nested file, and delete a folder
+    (datasite_1.my_datasite / "folder1" / "a" / "nested" / "file.txt").write_text("modified")
+    shutil.rmtree(datasite_1.my_datasite / "folder1" / "b")
+    sync_service_1.run_single_thread()
+
+    sync_service_2.run_single_thread()
+    folder1 = f"{datasite_1.email}/folder1"
+    assert compared_dirs[datasite_1.email] == {f"{folder1}/a/nested", f"{folder1}/b"}
+
+    datasite_1_path = datasite_2.workspace.datasites / datasite_1.email
+    assert (datasite_1_path / "folder1" / "a" / "nested" / "file.txt").read_text() == "modified"
+    assert (datasite_1_path / "folder1" / "a" / "file.txt").read_text() == "content a"
+    assert not (datasite_1_path / "folder1" / "b" / "file.txt").exists()
+
+
+def test_split_into_chunks():
+    files = [FileRecord(f"user@openmined.org/file_{i}.txt", b"hash", file_size=i * 10, mtime_ns=0) for i in range(20)]
+    chunks = split_into_chunks(files, max_chunk_bytes=200, max_chunk_files=5)
+
+    assert sorted(file.path for chunk in chunks for file in chunk) == sorted(file.path for file in files)
+    for chunk in chunks:
+        assert len(chunk) <= 5
+        assert len(chunk) == 1 or sum(file.file_size for file in chunk) <= 200
+
+    # Files larger than the chunk size are downloaded on their own
+    large_file = FileRecord("user@openmined.org/large.txt", b"hash", file_size=1000, mtime_ns=0)
+    assert split_into_chunks([large_file] + files[:2], max_chunk_bytes=200)[0] == [large_file]
+
+
+def test_download_all_missing_chunked(
+    datasite_1: SyftBoxContextInterface, datasite_2: SyftBoxContextInterface, monkeypatch: pytest.MonkeyPatch
+):
+    tree = {
+        "folder1": {
+            PERM_FILE: SyftPermission.mine_with_public_read(datasite_1, dir=datasite_1.my_datasite / "folder1"),
+            **{f"file_{i}.txt": fake.text(max_nb_chars=1000) for i in range(10)},
+        },
+    }
+    create_dir_tree(Path(datasite_1.my_datasite), tree)
+    SyncManager(datasite_1).run_single_thread()
+
+    monkeypatch.setattr(consumer_module, "DOWNLOAD_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(consumer_module, "split_into_chunks", partial(split_into_chunks, max_chunk_files=2))
+
+    # Every chunk fails on its first attempt, one chunk always fails
+    original_download = SyncClient.download_files_streaming
+    attempted_chunks: set[tuple[Path, ...]] = set()
+    failing_path = Path(datasite_1.email) / "folder1" / "file_0.txt"
+
+    def download_files_streaming(self, relative_paths, output_dir, pbar=None):
+        chunk = tuple(sorted(relative_paths))
+        if chunk not in attempted_chunks or failing_path in chunk:
+            attempted_chunks.add(chunk)
+            raise httpx.ReadError("Connection dropped")
+        return original_download(self, relative_paths, output_dir, pbar=pbar)
+
+    monkeypatch.setattr(SyncClient, "download_files_streaming", download_files_streaming)
+
+    sync_service_2 = SyncManager(datasite_2)
+    datasite_states = sync_service_2.producer.get_datasite_states()
+    sync_service_2.consumer.download_all_missing(datasite_states)
+
+    # All chunks except the failing one are downloaded, and saved in the local state
+    expected_paths = {Path(datasite_1.email) / "folder1" / name for name in tree["folder1"]} - {failing_path}
+    saved_state = LocalState(path=sync_service_2.local_state.path)
+    saved_state.load()
+    downloaded_paths = {path for path in saved_state.states if path.parent == failing_path.parent}
+    # The failing chunk can contain one other file
+    assert len(downloaded_paths) >= len(expected_paths) - 1
+    assert downloaded_paths <= expected_paths
+    assert_files_on_datasite(datasite_2, list(downloaded_paths))
+
+    # A restarted client resumes, and only downloads the missing files
+    monkeypatch.setattr(SyncClient, "download_files_streaming", original_download)
+    requested_paths: list[Path] = []
+
+    def download_and_track(self, relative_paths, output_dir, pbar=None):
+        requested_paths.extend(relative_paths)
+        return original_download(self, relative_paths, output_dir, pbar=pbar)
+
+    monkeypatch.setattr(SyncClient, "download_files_streaming", download_and_track)
+    sync_service_2 = SyncManager(datasite_2)
+    sync_service_2.consumer.download_all_missing(sync_service_2.producer.get_datasite_states())
+    assert failing_path in requested_paths
+    assert not set(requested_paths) & downloaded_paths
+    assert_files_on_datasite(datasite_2, list(expected_paths | {failing_path}))
@@ -0,0 +1,117 @@
+import base64
+import hashlib
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+import py_fast_rsync
+import pytest
+
+from syftbox.lib.hash import hash_file, hash_file_record
+from syftbox.server.models.sync_models import FileMetadata, FileRecord
+
+NUM_STATE_FILES = 2_000
+NUM_BENCHMARK_STATE_FILES = 100_000
+
+
+def make_serialized_state(num_files: int) -> list[dict]:
+    """Serialized datasite state, as returned by the server"""
+    data = b"x" * 1000
+    metadata = FileMetadata(
+        path=Path("user@openmined.org/file.txt"),
+        hash=hashlib.sha256(data).hexdigest(),
+        signature=base64.b85encode(py_fast_rsync.signature.calculate(data)).decode("utf-8"),
+        file_size=len(data),
+        last_modified=datetime.now(tz=timezone.utc),
+    )
+    serialized = metadata.model_dump(mode="json")
+    return [{**serialized, "path": f"user@openmined.org/folder_{i % 100}/file_{i}.txt"} for i in range(num_files)]
+
+
+def allocated_memory(fn: Callable[[], Any]) -> tuple[Any, int]:
+    """Returns the result of fn and the memory it allocated"""
+    tracemalloc.start()
+    try:
+        result = fn()
+        memory, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, memory
+
+
+def test_file_record_from_metadata():
+    data = b"hello world"
+    metadata = FileMetadata(
+        path=Path("user@openmined.org/file.txt"),
+        hash=hashlib.sha256(data).hexdigest(),
+        signature=base64.b85encode(py_fast_rsync.signature.calculate(data)).decode("utf-8"),
+        file_size=len(data),
+        last_modified=datetime.now(tz=timezone.utc),
+    )
+
+    record = FileRecord.from_metadata(metadata)
+    assert record.path == "user@openmined.org/file.txt"
+    assert record.hash == metadata.hash
+    assert record.last_modified == metadata.last_modified
+    assert record.signature == metadata.signature_bytes
+    assert record.datasite == "user@openmined.org"
+    assert record.to_metadata() == metadata
+
+    json_record = FileRecord.from_json(metadata.model_dump(mode="json"))
+    assert json_record == record
+    assert json_record.mtime_ns == record.mtime_ns
+    assert json_record.signature is None
+
+
+def test_hash_file_record(tmp_path: Path):
+    file_path = tmp_path / "user@openmined.org" / "file.txt"
+    file_path.parent.mkdir()
+    file_path.write_bytes(b"content" * 1000)
+
+    record = hash_file_record(file_path, root_dir=tmp_path)
+    metadata = hash_file(file_path, root_dir=tmp_path)
+    assert record is not None and metadata is not None
+    assert record == FileRecord.from_metadata(metadata)
+    assert record.file_size == metadata.file_size
+    assert record.signature is None
+
+    # Same precision as the datetimes received from the server
+    assert record.mtime_ns == file_path.stat().st_mtime_ns // 1000 * 1000
+    assert FileRecord.from_metadata(record.to_metadata()).mtime_ns == record.mtime_ns
+
+
+def test_file_record_state_memory():
+    serialized_state = make_serialized_state(NUM_STATE_FILES)
+
+    metadatas, metadata_memory = allocated_memory(lambda: [FileMetadata(**item) for item in serialized_state])
+    records, record_memory = allocated_memory(lambda: [FileRecord.from_json(item) for item in serialized_state])
+
+    assert record_memory < metadata_memory / 2
+    assert [record.path for record in records] == [str(metadata.path) for metadata in metadatas]
+    assert all(record == FileRecord.from_metadata(metadata) for record, metadata in zip(records, metadatas))
+
+
+@pytest.mark.benchmark
+def test_benchmark_file_record_state():
+    serialized_state = make_serialized_state(NUM_BENCHMARK_STATE_FILES)
+
+    start = time.perf_counter()
+    metadatas = [FileMetadata(**item) for item in serialized_state]
+    metadata_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    records = [FileRecord.from_json(item) for item in serialized_state]
+    record_time = time.perf_counter() - start
+
+    _, metadata_memory = allocated_memory(lambda: [FileMetadata(**item) for item in serialized_state])
+    _, record_memory = allocated_memory(lambda: [FileRecord.from_json(item) for item in serialized_state])
+
+    print(
+        f"\n{NUM_BENCHMARK_STATE_FILES} files: FileMetadata {metadata_time:.3f}s {metadata_memory / 2**20:.1f}MiB, "
+        f"FileRecord {record_time:.3f}s {record_memory / 2**20:.1f}MiB"
+    )
+    assert len(records) == len(metadatas)
+    assert record_time < metadata_time
+    assert record_memory < metadata_memory / 2
@@ -1,6 +1,9 @@
+import httpx
 import pytest
 
 from syftbox import __version__
+from syftbox.client import base
+from syftbox.client.base import make_client_kwargs
 from syftbox.client.core import SyftBoxRunner, run_migration
 from syftbox.client.exceptions import SyftBoxAlreadyRunning
 from syftbox.lib.client_config import SyftClientConfig
@@ -95,3 +98,20 @@ def test_migration(mock_config):
     # check syncstate migration
     assert not (mock_config.data_dir / ".syft").exists()
     assert (mock_config.data_dir / "plugins" / "local_syncstate.json").is_file()
+
+
+def test_client_connection_pool(mock_config, monkeypatch):
+    mock_config.client_max_connections = 8
+    mock_config.client_max_keepalive_connections = 4
+    mock_config.client_keepalive_expiry = 10.0
+
+    kwargs = make_client_kwargs(mock_config)
+    assert kwargs["limits"] == httpx.Limits(max_connections=8, max_keepalive_connections=4, keepalive_expiry=10.0)
+
+    # HTTP/2 is only used if the h2 package is installed
+    monkeypatch.setattr(base, "http2_available", lambda: False)
+    assert make_client_kwargs(mock_config)["http2"] is False
+    monkeypatch.setattr(base, "http2_available", lambda: True)
+    assert make_client_kwargs(mock_config)["http2"] is True
+    mock_config.client_http2 = False
+    assert make_client_kwargs(mock_config)["http2"] is False
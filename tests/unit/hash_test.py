@@ -1,7 +1,8 @@
+import os
 from pathlib import Path
 
 from syftbox.client.utils.dir_tree import create_dir_tree
-from syftbox.lib.hash import collect_files
+from syftbox.lib.hash import EMPTY_SUMMARY_HASH, collect_files, stat_summary_hash, summary_hash
 
 
 def test_collect_files(tmp_path: Path):
@@ -74,3 +75,30 @@ def test_collect_files(tmp_path: Path):
     regular_file = test_dir / "just_a_file"
     regular_file.touch()
     assert collect_files(regular_file) == []
+
+
+def test_summary_hash():
+    entries = [(f"file_{i}.txt", f"hash_{i}") for i in range(10)]
+
+    # Order independent
+    assert summary_hash(entries) == summary_hash(reversed(entries))
+    assert summary_hash([]) == EMPTY_SUMMARY_HASH
+
+    assert summary_hash(entries[:-1]) != summary_hash(entries)
+    assert summary_hash(entries[:-1] + [("file_9.txt", "new_hash")]) != summary_hash(entries)
+    assert summary_hash([("a", "bc")]) != summary_hash([("ab", "c")])
+
+
+def test_stat_summary_hash(tmp_path: Path):
+    create_dir_tree(tmp_path, {"file.txt": "content", "folder": {"nested.txt": "nested"}, ".hidden": "hidden"})
+    summary = stat_summary_hash(tmp_path)
+    assert summary == stat_summary_hash(tmp_path)
+
+    # Hidden files are skipped
+    (tmp_path / ".hidden").write_text("modified")
+    assert summary == stat_summary_hash(tmp_path)
+
+    nested_file = tmp_path / "folder" / "nested.txt"
+    stat = nested_file.stat()
+    os.utime(nested_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert stat_summary_hash(tmp_path) != summary
@@ -0,0 +1,47 @@
+import pytest
+
+from syftbox.lib.compression import (
+    ENCODING_GZIP,
+    ENCODING_IDENTITY,
+    ENCODING_ZSTD,
+    compress,
+    decompress,
+    negotiate_encoding,
+    should_compress,
+    supported_encodings,
+    zstd_available,
+)
+
+
+@pytest.mark.parametrize("encoding", supported_encodings() + [ENCODING_IDENTITY])
+def test_compress_roundtrip(encoding: str):
+    data = b"a,b,c\n1,2,3\n" * 1000
+    compressed = compress(data, encoding)
+    if encoding != ENCODING_IDENTITY:
+        assert len(compressed) < len(data)
+    assert decompress(compressed, encoding) == data
+
+
+def test_decompress_errors():
+    data = compress(b"x" * 10_000, ENCODING_GZIP)
+    with pytest.raises(ValueError):
+        decompress(data, ENCODING_GZIP, max_size=1000)
+    with pytest.raises(ValueError):
+        decompress(b"not gzip", ENCODING_GZIP)
+    with pytest.raises(ValueError):
+        decompress(data, "br")
+
+
+def test_should_compress():
+    assert should_compress("user@openmined.org/data.csv", 10_000)
+    assert not should_compress("user@openmined.org/data.csv", 10)
+    assert not should_compress("user@openmined.org/image.PNG", 10_000)
+    assert not should_compress("user@openmined.org/archive.tar.gz", 10_000)
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("br") is None
+    assert negotiate_encoding("br, gzip;q=0.5") == ENCODING_GZIP
+    expected = ENCODING_ZSTD if zstd_available() else ENCODING_GZIP
+    assert negotiate_encoding("gzip, zstd") == expected
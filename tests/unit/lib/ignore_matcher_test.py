@@ -0,0 +1,261 @@
+import os
+import time
+from pathlib import Path
+
+import pathspec
+import pytest
+
+from syftbox.lib.constants import REJECTED_FILE_SUFFIX
+from syftbox.lib.hash import collect_files, hash_dir
+from syftbox.lib.ignore import (
+    DEFAULT_IGNORE,
+    IGNORE_FILENAME,
+    IgnoreMatcher,
+    ScanResult,
+    filter_ignored_paths,
+    filter_symlinks,
+    get_ignore_matcher,
+    get_ignore_rules,
+    is_within_symlinked_path,
+    scan_dir,
+)
+
+NUM_PATHS = 2_000
+NUM_BENCHMARK_PATHS = 20_000
+
+RULES_WITH_NEGATIONS = """
+/alice@example.com
+bob@example.com
+*/large/*
+!/john@example.com/large/important_file.pdf
+*.tmp
+!keep.tmp
+docs/
+*.py[cod]
+"""
+
+PATHS = [
+    "alice@example.com/file.txt",
+    "john@example.com/alice@example.com/file.txt",
+    "john@example.com/results/bob@example.com/file.txt",
+    "john@example.com/large/file.txt",
+    "john@example.com/large/important_file.pdf",
+    "john@example.com/docs/file.txt",
+    "john@example.com/docs",
+    "john@example.com/file.tmp",
+    "john@example.com/keep.tmp",
+    "john@example.com/.venv/lib/site.py",
+    "john@example.com/__pycache__/module.pyc",
+    "john@example.com/apps/app/main.py",
+    "apps/app/main.py",
+    "_.syftignore",
+    "john@example.com/Icon",
+    "john@example.com/file.txt",
+]
+
+
+@pytest.mark.parametrize("rules", [DEFAULT_IGNORE, RULES_WITH_NEGATIONS, ""])
+def test_matcher_matches_pathspec(rules: str):
+    spec = pathspec.PathSpec.from_lines("gitwildmatch", rules.splitlines())
+    matcher = IgnoreMatcher(spec)
+    for path in PATHS:
+        assert matcher.match_file(path) == spec.match_file(path), path
+        assert matcher.match_file(Path(path)) == spec.match_file(path), path
+
+
+def test_match_dir():
+    matcher = IgnoreMatcher.from_lines(DEFAULT_IGNORE.splitlines())
+    assert matcher.match_dir("john@example.com/.venv")
+    assert matcher.match_dir(Path("john@example.com/__pycache__"))
+    assert matcher.match_dir("apps")
+    assert not matcher.match_dir("john@example.com/apps")
+    assert not matcher.match_dir("john@example.com/results")
+
+    # A negated pattern could re-include files in an ignored directory
+    matcher = IgnoreMatcher.from_lines(RULES_WITH_NEGATIONS.splitlines())
+    assert not matcher.match_dir("alice@example.com")
+
+
+def test_ignore_matcher_cache(tmp_path: Path):
+    assert get_ignore_matcher(tmp_path) is None
+
+    ignore_file = tmp_path / IGNORE_FILENAME
+    ignore_file.write_text("*.tmp\n")
+    matcher = get_ignore_matcher(tmp_path)
+    assert matcher is not None
+    assert get_ignore_matcher(tmp_path) is matcher
+    assert filter_ignored_paths(tmp_path, [Path("a.tmp"), Path("a.txt")]) == [Path("a.txt")]
+
+    # Modifying the ignore file invalidates the cache
+    ignore_file.write_text("*.txt\n")
+    stat = ignore_file.stat()
+    os.utime(ignore_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    new_matcher = get_ignore_matcher(tmp_path)
+    assert new_matcher is not matcher
+    assert filter_ignored_paths(tmp_path, [Path("a.tmp"), Path("a.txt")]) == [Path("a.tmp")]
+
+    ignore_file.unlink()
+    assert get_ignore_matcher(tmp_path) is None
+
+
+def test_hash_dir_skips_ignored_dirs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    (tmp_path / IGNORE_FILENAME).write_text(DEFAULT_IGNORE)
+    datasite = tmp_path / "user@openmined.org"
+    for path in ["file.txt", "venv/__pycache__/module.pyc", "app/__pycache__/cache.pyc", "app/main.py"]:
+        (datasite / path).parent.mkdir(parents=True, exist_ok=True)
+        (datasite / path).write_text(path)
+
+    walked: list[Path] = []
+    scandir = os.scandir
+
+    def tracking_scandir(path):
+        walked.append(Path(path))
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", tracking_scandir)
+    records = hash_dir(datasite, tmp_path)
+
+    assert sorted(r.path for r in records) == ["user@openmined.org/app/main.py", "user@openmined.org/file.txt"]
+    assert walked and not any(path.name == "__pycache__" for path in walked)
+
+
+def test_scan_dir(tmp_path: Path):
+    (tmp_path / IGNORE_FILENAME).write_text(DEFAULT_IGNORE + "\n/user@openmined.org/private\n")
+    datasite = tmp_path / "user@openmined.org"
+    files = [
+        "file.txt",
+        "file.tmp",
+        f"file{REJECTED_FILE_SUFFIX}.txt",
+        "app/main.py",
+        "app/__pycache__/main.pyc",
+        "private/secret.txt",
+        ".git/config",
+        "app/.hidden",
+    ]
+    for path in files:
+        (datasite / path).parent.mkdir(parents=True, exist_ok=True)
+        (datasite / path).write_text(path)
+    (tmp_path / "target").mkdir()
+    (tmp_path / "target" / "file.txt").write_text("content")
+    (datasite / "link").symlink_to(tmp_path / "target")
+
+    result = scan_dir(tmp_path, datasite)
+    assert sorted(p.as_posix() for p in result.included) == [
+        "user@openmined.org/app/main.py",
+        "user@openmined.org/file.txt",
+    ]
+    assert sorted(p.as_posix() for p in result.ignored) == [
+        "user@openmined.org/app/__pycache__",
+        f"user@openmined.org/file{REJECTED_FILE_SUFFIX}.txt",
+        "user@openmined.org/file.tmp",
+        "user@openmined.org/private",
+    ]
+
+    # Same included files as filtering all files afterwards
+    all_files = [file.relative_to(tmp_path) for file in collect_files(datasite)]
+    assert sorted(result.included) == sorted(filter_ignored_paths(tmp_path, all_files))
+
+    non_recursive = scan_dir(tmp_path, datasite, recursive=False)
+    assert sorted(p.name for p in non_recursive.included) == ["file.txt"]
+
+    assert scan_dir(tmp_path, datasite / "private").ignored == [Path("user@openmined.org/private")]
+    assert scan_dir(tmp_path, datasite / "link") == ScanResult()
+    assert scan_dir(tmp_path, datasite / ".git") == ScanResult()
+    assert scan_dir(tmp_path, datasite / "nonexistent") == ScanResult()
+
+
+def make_datasite_paths(num_paths: int) -> list[Path]:
+    return [
+        Path(f"user@openmined.org/folder_{i % 100}/file_{i}.{'tmp' if i % 10 == 0 else 'txt'}")
+        for i in range(num_paths)
+    ]
+
+
+def test_ignore_matcher_matches_pathspec(tmp_path: Path):
+    (tmp_path / IGNORE_FILENAME).write_text(DEFAULT_IGNORE)
+    paths = make_datasite_paths(NUM_PATHS)
+
+    rules = get_ignore_rules(tmp_path)
+    assert rules is not None
+    expected = [path for path in paths if not rules.match_file(path)]
+
+    matcher = get_ignore_matcher(tmp_path)
+    assert matcher is not None
+    assert [path for path in paths if not matcher.match_file(path)] == expected
+    assert filter_ignored_paths(tmp_path, paths) == expected
+    # The ignore file is parsed once
+    assert get_ignore_matcher(tmp_path) is matcher
+
+
+@pytest.mark.benchmark
+def test_benchmark_ignore_matcher(tmp_path: Path):
+    (tmp_path / IGNORE_FILENAME).write_text(DEFAULT_IGNORE)
+    paths = make_datasite_paths(NUM_BENCHMARK_PATHS)
+
+    start = time.perf_counter()
+    rules = get_ignore_rules(tmp_path)
+    assert rules is not None
+    expected = [path for path in paths if not rules.match_file(path)]
+    pathspec_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = get_ignore_matcher(tmp_path)
+    assert matcher is not None
+    result = [path for path in paths if not matcher.match_file(path)]
+    matcher_time = time.perf_counter() - start
+
+    print(f"\n{NUM_BENCHMARK_PATHS} paths: pathspec {pathspec_time:.3f}s, compiled matcher {matcher_time:.3f}s")
+    assert result == expected
+    assert matcher_time < pathspec_time
+
+
+def test_filter_symlinks_cache(tmp_path: Path):
+    target = tmp_path / "target"
+    (target / "sub").mkdir(parents=True)
+    datasites = tmp_path / "datasites"
+    (datasites / "user@openmined.org" / "folder").mkdir(parents=True)
+    (datasites / "user@openmined.org" / "link").symlink_to(target)
+
+    paths = [
+        Path("user@openmined.org/link/file.txt"),
+        Path("user@openmined.org/folder/file.txt"),
+        Path("user@openmined.org/link/sub/file.txt"),
+        Path("user@openmined.org/folder/sub/file.txt"),
+        Path("user@openmined.org/link"),
+    ]
+    assert filter_symlinks(datasites, paths) == [
+        Path("user@openmined.org/folder/file.txt"),
+        Path("user@openmined.org/folder/sub/file.txt"),
+    ]
+
+    symlinked_dirs: dict[Path, bool] = {}
+    for path in paths:
+        expected = is_within_symlinked_path(datasites / path, datasites)
+        assert is_within_symlinked_path(datasites / path, datasites, symlinked_dirs) == expected
+
+
+def test_filter_symlinks_lstat_calls(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Paths 8 directories deep, most files share their parent directories
+    paths = [
+        Path("user@openmined.org", *(f"dir_{i % (depth + 2)}" for depth in range(7)), f"file_{i}.txt")
+        for i in range(NUM_PATHS)
+    ]
+
+    num_checks = 0
+    is_symlink = Path.is_symlink
+
+    def counting_is_symlink(self: Path) -> bool:
+        nonlocal num_checks
+        num_checks += 1
+        return is_symlink(self)
+
+    monkeypatch.setattr(Path, "is_symlink", counting_is_symlink)
+
+    expected = [path for path in paths if not is_within_symlinked_path(tmp_path / path, tmp_path)]
+    uncached_checks = num_checks
+
+    num_checks = 0
+    result = filter_symlinks(tmp_path, paths)
+    assert result == expected
+    # One check per file, and one per distinct directory
+    assert num_checks < uncached_checks / 4
@@ -1,16 +1,23 @@
+import time
 from pathlib import Path
 
 import pytest
+import wcmatch.glob
 
 from syftbox.lib.constants import PERM_FILE
 from syftbox.lib.permissions import (
     ComputedPermission,
     PermissionParsingError,
     PermissionRule,
+    PermissionTree,
     PermissionType,
     SyftPermission,
+    compile_path_pattern,
 )
 
+NUM_CHECKS = 1_000
+NUM_BENCHMARK_CHECKS = 20_000
+
 
 def test_parsing_dicts():
     d = {"permissions": "read", "path": "x.txt", "user": "user@example.org"}
@@ -231,3 +238,126 @@ def test_permission_file_add_rule():
     assert computed_permission.has_permission(PermissionType.READ)
     assert computed_permission.has_permission(PermissionType.WRITE)
     assert computed_permission.has_permission(PermissionType.CREATE)
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    ["**", "*.txt", "**/*.txt", "a/*", "a/**", "a/**/b.txt", "*/x/**", "[ab].txt", "?.txt", "{useremail}/**"],
+)
+def test_compiled_path_pattern_matches_globmatch(pattern: str):
+    paths = ["a.txt", "b.txt", "ab.txt", "a/b.txt", "a/x/b.txt", "b/x/c/d.txt", "a/.hidden", ".hidden/a.txt", "a"]
+    paths += ["user@example.org/a.txt", "user@example.org/a/b.txt"]
+    for path in paths:
+        expected = wcmatch.glob.globmatch(
+            path, pattern.replace("{useremail}", "user@example.org"), flags=wcmatch.glob.GLOBSTAR
+        )
+        assert bool(compile_path_pattern(pattern, "user@example.org").match(path)) == expected, path
+
+
+def test_rule_from_db_row():
+    rule = PermissionRule.from_rule_dict(
+        dir_path=Path("user@example.org/test"),
+        rule_dict={"path": "{useremail}/*.txt", "permissions": ["read", "write"], "user": "*", "type": "disallow"},
+        priority=3,
+    )
+    row = {**rule.to_db_row()}
+    assert PermissionRule.from_db_row(row) == rule  # type: ignore[arg-type]
+
+    assert rule.filepath_matches_rule_path(Path("user@example.org/test/user_2@example.org/a.txt")) == (
+        True,
+        "user_2@example.org",
+    )
+    assert rule.filepath_matches_rule_path(Path("user@example.org/test/a.txt")) == (False, None)
+    assert rule.filepath_matches_rule_path(Path("user@example.org/test_2/user_2@example.org/a.txt")) == (False, None)
+
+
+def _globmatch_rule_applies_to_path(rule: PermissionRule, user: str, file_path: Path) -> bool:
+    """Rule matching without compiled patterns, used as the reference for the compiled patterns"""
+    pattern = rule.resolve_path_pattern(user) if rule.has_email_template else rule.path
+    if rule.dir_path not in file_path.parents:
+        return False
+    return wcmatch.glob.globmatch(file_path.relative_to(rule.dir_path), pattern, flags=wcmatch.glob.GLOBSTAR)
+
+
+def make_shared_folder_checks(user: str, num_paths: int) -> tuple[list[PermissionRule], list[Path]]:
+    """Rules of a shared folder where every user can write to their own subfolder, and paths to check them on"""
+    rules = SyftPermission.from_rule_dicts(
+        Path("user@example.org/shared") / PERM_FILE,
+        [
+            {"path": "**", "user": "user@example.org", "permissions": ["admin"]},
+            {"path": "**", "user": "*", "permissions": ["read"]},
+            {"path": "{useremail}/**", "user": "*", "permissions": ["write", "create"]},
+            {"path": "**/*.secret", "user": "*", "permissions": ["read"], "type": "disallow"},
+        ],
+    ).rules
+    paths = [
+        Path(f"user@example.org/shared/{user if i % 2 else 'other@example.org'}/dir_{i % 10}/file_{i}.txt")
+        for i in range(num_paths)
+    ]
+    return rules, paths
+
+
+def test_compiled_permission_checks_match_globmatch():
+    user = "user_2@example.org"
+    rules, paths = make_shared_folder_checks(user, NUM_CHECKS)
+
+    expected = [
+        [_globmatch_rule_applies_to_path(rule, user, path) and rule.user in ("*", user) for rule in rules]
+        for path in paths
+    ]
+    computed = [ComputedPermission.from_user_rules_and_path(rules=rules, user=user, path=path) for path in paths]
+
+    for permission, matches in zip(computed, expected):
+        assert [permission.user_matches(rule) and permission.rule_applies_to_path(rule) for rule in rules] == matches
+    assert sum(permission.has_permission(PermissionType.WRITE) for permission in computed) == NUM_CHECKS // 2
+
+
+@pytest.mark.benchmark
+def test_benchmark_permission_checks():
+    user = "user_2@example.org"
+    rules, paths = make_shared_folder_checks(user, NUM_BENCHMARK_CHECKS)
+
+    start = time.perf_counter()
+    expected = [
+        [_globmatch_rule_applies_to_path(rule, user, path) and rule.user in ("*", user) for rule in rules]
+        for path in paths
+    ]
+    globmatch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    computed = [ComputedPermission.from_user_rules_and_path(rules=rules, user=user, path=path) for path in paths]
+    allowed = sum(permission.has_permission(PermissionType.WRITE) for permission in computed)
+    compiled_time = time.perf_counter() - start
+
+    print(
+        f"\nPermission checks per second: globmatch {NUM_BENCHMARK_CHECKS / globmatch_time:.0f}, "
+        f"compiled {NUM_BENCHMARK_CHECKS / compiled_time:.0f}"
+    )
+    for permission, matches in zip(computed, expected):
+        assert [permission.user_matches(rule) and permission.rule_applies_to_path(rule) for rule in rules] == matches
+    assert allowed == NUM_BENCHMARK_CHECKS // 2
+    assert compiled_time < globmatch_time
+
+
+def test_permission_tree_skip_invalid(tmp_path: Path):
+    valid_dir = tmp_path / "user@example.org"
+    invalid_dir = valid_dir / "invalid"
+    invalid_dir.mkdir(parents=True)
+    (valid_dir / PERM_FILE).write_text("- path: '**'\n  user: '*'\n  permissions: [read]\n")
+    (invalid_dir / PERM_FILE).write_text("not a list of rules")
+
+    with pytest.raises(ValueError):
+        PermissionTree(tmp_path).get_rules_for_path(Path("user@example.org/invalid/file.txt"))
+    # Only the permission files of the parent directories are parsed
+    assert len(PermissionTree(tmp_path).get_rules_for_path(Path("user@example.org/file.txt"))) == 1
+
+    tree = PermissionTree(tmp_path, skip_invalid=True)
+    assert tree.computed_permission("other@example.org", Path("user@example.org/file.txt")).has_permission(
+        PermissionType.READ
+    )
+    assert not tree.has_invalid_permfile(Path("user@example.org/file.txt"))
+    assert tree.has_invalid_permfile(Path("user@example.org/invalid/file.txt"))
+
+    (invalid_dir / PERM_FILE).write_text("- path: '**'\n  user: '*'\n  permissions: [write]\n")
+    tree.update(Path("user@example.org/invalid") / PERM_FILE)
+    assert not tree.has_invalid_permfile(Path("user@example.org/invalid/file.txt"))
@@ -0,0 +1,106 @@
+import hashlib
+import io
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import py_fast_rsync
+import pytest
+
+from syftbox.lib.rsync import (
+    EMPTY_SIGNATURE,
+    MAX_BLOCK_SIZE,
+    MIN_BLOCK_SIZE,
+    SMALL_FILE_THRESHOLD,
+    apply_diff_stream,
+    block_size_for,
+    calculate_diff,
+    calculate_file_signature,
+    calculate_signature,
+    mmap_file,
+    signature_block_size,
+)
+
+
+def test_block_size_for():
+    assert block_size_for(0) == MIN_BLOCK_SIZE
+    assert block_size_for(SMALL_FILE_THRESHOLD) == MIN_BLOCK_SIZE
+    assert block_size_for(100_000_000) == 16 * 1024
+    assert block_size_for(10**12) == MAX_BLOCK_SIZE
+
+    sizes = [block_size_for(2**i) for i in range(40)]
+    assert sizes == sorted(sizes)
+
+
+def test_small_files_have_empty_signature():
+    data = b"small file"
+    assert calculate_signature(data) == EMPTY_SIGNATURE
+    assert signature_block_size(calculate_signature(data)) is None
+    # Older clients diff against the remote signature directly
+    assert py_fast_rsync.apply(b"any other content", py_fast_rsync.diff(calculate_signature(data), data)) == data
+
+    # A literal diff can be applied to any base file
+    diff = calculate_diff(b"", data)
+    assert py_fast_rsync.apply(b"any other content", diff) == data
+    assert calculate_diff(EMPTY_SIGNATURE, data) == diff
+
+
+@pytest.mark.parametrize("size", [SMALL_FILE_THRESHOLD, 1_000_000, 5_000_000])
+def test_adaptive_signature_roundtrip(size: int):
+    base = os.urandom(size)
+    modified = base[: size // 2] + b"inserted" + base[size // 2 :]
+
+    signature = calculate_signature(base)
+    assert signature_block_size(signature) == block_size_for(size)
+
+    diff = calculate_diff(signature, modified)
+    assert py_fast_rsync.apply(base, diff) == modified
+    assert len(diff) < size // 10
+
+
+@pytest.mark.parametrize("chunk_size", [1, 1000, 1024 * 1024])
+def test_apply_diff_stream(tmp_path: Path, chunk_size: int):
+    base = os.urandom(3_000_000)
+    modified = b"prefix" + base[:1_000_000] + os.urandom(5000) + base[1_500_000:]
+    base_path = tmp_path / "base.bin"
+    base_path.write_bytes(base)
+
+    with open(base_path, "rb") as f, mmap_file(f) as mapped:
+        file_signature = calculate_file_signature(f, len(mapped))
+        assert file_signature == calculate_signature(base)
+
+        diff = calculate_diff(file_signature, modified)
+        chunks = (diff[i : i + chunk_size] for i in range(0, len(diff), chunk_size))
+        out = io.BytesIO()
+        digest = apply_diff_stream(mapped, chunks, out)
+
+    assert out.getvalue() == modified
+    assert digest == hashlib.sha256(modified).hexdigest()
+
+
+def test_apply_diff_stream_errors(tmp_path: Path):
+    base = os.urandom(100_000)
+    diff = calculate_diff(calculate_signature(base), base)
+
+    with pytest.raises(ValueError):
+        apply_diff_stream(base, [diff[:-1]], io.BytesIO())
+    with pytest.raises(ValueError):
+        apply_diff_stream(base[:1000], [diff], io.BytesIO())
+    with pytest.raises(ValueError):
+        apply_diff_stream(base, [b"invalid" + diff], io.BytesIO())
+
+    empty_path = tmp_path / "empty.bin"
+    empty_path.touch()
+    with open(empty_path, "rb") as f, mmap_file(f) as mapped:
+        assert (
+            apply_diff_stream(mapped, [calculate_diff(b"", b"data")], io.BytesIO())
+            == hashlib.sha256(b"data").hexdigest()
+        )
+
+
+@pytest.mark.parametrize("module", ["syftbox.server.models.sync_models", "syftbox.lib.rsync"])
+def test_import_in_fresh_interpreter(module: str):
+    # Catches circular imports that are hidden when other modules are imported first
+    result = subprocess.run([sys.executable, "-c", f"import {module}"], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
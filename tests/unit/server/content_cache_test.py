@@ -0,0 +1,74 @@
+import hashlib
+from pathlib import Path
+
+from syftbox.lib.rsync import calculate_signature
+from syftbox.server.content_cache import ContentCache, DiskSignatureCache, LRUByteCache
+from syftbox.server.db.file_store import FileStore
+from syftbox.server.settings import ServerSettings
+
+
+def test_lru_byte_cache_evicts_by_size():
+    cache = LRUByteCache(max_bytes=100, max_item_bytes=50)
+    cache.put("a", b"a" * 40)
+    cache.put("b", b"b" * 40)
+    assert cache.get("a") is not None
+
+    # "b" is the least recently used item
+    cache.put("c", b"c" * 40)
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.size == 80
+
+    # Items larger than max_item_bytes are not cached
+    assert not cache.put("d", b"d" * 60)
+    assert "d" not in cache and len(cache) == 2
+
+
+def test_disk_signature_cache(tmp_path: Path):
+    cache = DiskSignatureCache(tmp_path, max_bytes=100)
+    digests = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(3)]
+    cache.put(digests[0], b"0" * 40)
+    cache.put(digests[1], b"1" * 40)
+
+    # Signatures are persisted across processes
+    reloaded = DiskSignatureCache(tmp_path, max_bytes=100)
+    assert reloaded.size == 80
+    assert reloaded.get(digests[0]) == b"0" * 40
+
+    # Least recently used signatures are deleted from disk
+    reloaded.put(digests[2], b"2" * 40)
+    assert reloaded.get(digests[1]) is None
+    assert not list(tmp_path.glob(f"*/{digests[1]}*"))
+    assert reloaded.size == 80
+
+
+def test_content_cache_signature(tmp_path: Path):
+    data = b"content" * 2000
+    digest = hashlib.sha256(data).hexdigest()
+    cache = ContentCache(max_memory_bytes=1024 * 1024, cache_dir=tmp_path, max_disk_bytes=1024 * 1024)
+    assert cache.get_or_calculate_signature(data) == calculate_signature(data)
+
+    # A new cache, e.g. after a restart, reads the signature from disk
+    cache = ContentCache(max_memory_bytes=1024 * 1024, cache_dir=tmp_path, max_disk_bytes=1024 * 1024)
+    assert cache.get_signature(digest) == calculate_signature(data)
+
+
+def test_file_store_reads_from_cache(tmp_path: Path, monkeypatch):
+    settings = ServerSettings.from_data_folder(tmp_path)
+    cache = ContentCache(max_memory_bytes=1024 * 1024, cache_dir=settings.cache_folder, max_disk_bytes=1024 * 1024)
+    store = FileStore(settings, content_cache=cache)
+    user = "user@openmined.org"
+    path = Path(user) / "results.csv"
+    contents = b"a,b,c\n" * 2000
+    store.put(path, contents, user, skip_permission_check=True)
+
+    def fail_read(*args, **kwargs):
+        raise AssertionError("file should be read from the cache")
+
+    monkeypatch.setattr(store, "_read_bytes", fail_read)
+    file = store.get(path, user)
+    assert file.data == contents
+    assert file.metadata.signature == calculate_signature(contents)
+
+    # Without a cache, the file is read from disk
+    assert FileStore(settings).get(path, user).data == contents
@@ -1,9 +1,17 @@
 import uuid
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
 
-from syftbox.lib.hash import hash_file
-from syftbox.server.db.file_store import FileStore
+import yaml
+
+from syftbox.lib.constants import PERM_FILE
+from syftbox.lib.hash import dir_summary_hashes, hash_file
+from syftbox.lib.permissions import PermissionType, SyftPermission, get_computed_permission
+from syftbox.server.db import db, file_store
+from syftbox.server.db.db import AncestorRulesCache, UserTreeCache
+from syftbox.server.db.file_store import FileStore, computed_permission_for_user_and_path
+from syftbox.server.db.schema import get_db
 from syftbox.server.settings import ServerSettings
 
 
@@ -25,3 +33,273 @@ def test_put_atomic(tmpdir):
     assert system_path.exists()
     metadata = FileStore(settings).get_metadata(syft_path, user, skip_permission_check=True)
     assert metadata.hash_bytes == hash_file(system_path).hash_bytes
+
+
+def test_dir_hashes(tmpdir):
+    settings = ServerSettings.from_data_folder(tmpdir)
+    store = FileStore(settings)
+    user = "user@openmined.org"
+
+    def assert_dir_hashes_match_files():
+        with get_db(settings.file_db_path) as conn:
+            files = [(m.path.as_posix(), m.hash) for m in db.get_all_metadata(conn)]
+            rows = db.get_dir_hashes(conn, user)
+        expected = dir_summary_hashes(files)
+        assert {row["path"]: (row["hash"], row["files_hash"], row["file_count"]) for row in rows} == expected
+        return expected
+
+    paths = [Path(user) / p for p in ["file.txt", "a/file.txt", "a/b/file.txt", "a/b/other.txt", "c/file.txt"]]
+    for path in paths:
+        store.put(path, uuid.uuid4().bytes, user, skip_permission_check=True)
+    hashes = assert_dir_hashes_match_files()
+    assert hashes[user][2] == len(paths)
+    assert hashes[f"{user}/a"][2] == 3
+
+    # Modifying a file changes the hash of all parents
+    store.put(paths[2], b"modified", user, skip_permission_check=True)
+    new_hashes = assert_dir_hashes_match_files()
+    for dir in [user, f"{user}/a", f"{user}/a/b"]:
+        assert new_hashes[dir][0] != hashes[dir][0]
+    assert new_hashes[f"{user}/a"][1] == hashes[f"{user}/a"][1]
+    assert new_hashes[f"{user}/c"] == hashes[f"{user}/c"]
+
+    # Directories without files are removed
+    store.delete(paths[4], user, skip_permission_check=True)
+    assert f"{user}/c" not in assert_dir_hashes_match_files()
+
+    with get_db(settings.file_db_path) as conn:
+        assert [row["path"] for row in db.get_dir_hashes(conn, user, depth=1)] == [user, f"{user}/a"]
+        assert [row["path"] for row in db.get_dir_hashes(conn, f"{user}/a", depth=0)] == [f"{user}/a"]
+
+
+def test_check_permissions(tmpdir):
+    settings = ServerSettings.from_data_folder(tmpdir)
+    store = FileStore(settings)
+    owner = "user@openmined.org"
+    user = "user_2@openmined.org"
+
+    public = SyftPermission.from_rule_dicts(
+        Path(owner) / "public" / PERM_FILE,
+        [
+            {"path": "**", "user": "*", "permissions": ["read"]},
+            {"path": "private/**", "user": "*", "permissions": ["read"], "type": "disallow"},
+        ],
+    )
+    store.put(public.relative_filepath, yaml.dump(public.to_dict()).encode(), owner, skip_permission_check=True)
+    nested = SyftPermission.from_rule_dicts(
+        Path(owner) / "public" / "private" / "shared" / PERM_FILE,
+        [{"path": "*.txt", "user": user, "permissions": ["read"]}],
+    )
+    store.put(nested.relative_filepath, yaml.dump(nested.to_dict()).encode(), owner, skip_permission_check=True)
+
+    paths = [
+        Path(owner) / p
+        for p in [
+            "file.txt",
+            "public/file.txt",
+            "public/a/b/file.txt",
+            "public/private/file.txt",
+            "public/private/shared/file.txt",
+            "public/private/shared/file.csv",
+        ]
+    ]
+    for path in paths:
+        store.put(path, path.as_posix().encode(), owner, skip_permission_check=True)
+
+    permissions = store.check_permissions(user, paths, PermissionType.READ)
+    with get_db(settings.file_db_path) as conn:
+        expected = {
+            path: computed_permission_for_user_and_path(conn, user, path).has_permission(PermissionType.READ)
+            for path in paths
+        }
+    assert permissions == expected
+    assert [path for path in paths if permissions[path]] == [
+        Path(owner) / "public/file.txt",
+        Path(owner) / "public/a/b/file.txt",
+        Path(owner) / "public/private/shared/file.txt",
+    ]
+    assert all(store.check_permissions(owner, paths, PermissionType.WRITE).values())
+
+    files = list(store.get_many(paths + [Path(owner) / "public/missing.txt"], user))
+    assert [file.metadata.path for file in files] == [path for path in paths if permissions[path]]
+    assert all(file.data == file.metadata.path.as_posix().encode() for file in files)
+
+    # Duplicates are returned in the requested order, files missing on disk are skipped and their metadata deleted
+    readable_file = Path(owner) / "public/file.txt"
+    deleted_file = Path(owner) / "public/a/b/file.txt"
+    (settings.snapshot_folder / deleted_file).unlink()
+    files = list(store.get_many([readable_file, deleted_file, readable_file], user))
+    assert [file.metadata.path for file in files] == [readable_file, readable_file]
+    assert not store.exists(deleted_file)
+
+
+def test_permission_tree_cache(tmpdir, monkeypatch):
+    settings = ServerSettings.from_data_folder(tmpdir)
+    store = FileStore(settings)
+    owner = "user@openmined.org"
+    user = "user_2@openmined.org"
+    path = Path(owner) / "shared" / "file.txt"
+    permfile_path = Path(owner) / "shared" / PERM_FILE
+
+    def can_read() -> bool:
+        return get_computed_permission(
+            snapshot_folder=settings.snapshot_folder, user_email=user, path=path
+        ).has_permission(PermissionType.READ)
+
+    def put_permfile(rule_dicts: list[dict]) -> None:
+        store.put(permfile_path, yaml.dump(rule_dicts).encode(), owner, skip_permission_check=True)
+
+    num_parsed = 0
+    from_file = SyftPermission.from_file.__func__  # type: ignore[attr-defined]
+
+    def counting_from_file(cls, *args, **kwargs):
+        nonlocal num_parsed
+        num_parsed += 1
+        return from_file(cls, *args, **kwargs)
+
+    monkeypatch.setattr(SyftPermission, "from_file", classmethod(counting_from_file))
+
+    put_permfile([{"path": "*.txt", "user": user, "permissions": ["read"]}])
+    assert can_read()
+    assert can_read()
+    assert num_parsed == 1
+
+    # Writing or deleting a permfile updates the tree
+    put_permfile([{"path": "*.csv", "user": user, "permissions": ["read"]}])
+    assert not can_read()
+    put_permfile([{"path": "**", "user": "*", "permissions": ["read"]}])
+    assert can_read()
+    assert num_parsed == 3
+
+    store.delete(permfile_path, owner, skip_permission_check=True)
+    assert not can_read()
+
+    # Permission files changed outside the store, for example by another server process, are parsed again
+    abs_permfile_path = settings.snapshot_folder / permfile_path
+    abs_permfile_path.write_text(yaml.dump([{"path": "*.txt", "user": user, "permissions": ["read"]}]))
+    assert can_read()
+    abs_permfile_path.write_text(yaml.dump([{"path": "*.csv", "user": user, "permissions": ["read", "write"]}]))
+    assert not can_read()
+    abs_permfile_path.unlink()
+    assert not can_read()
+
+
+def test_put_links_rules_once(tmpdir, monkeypatch):
+    settings = ServerSettings.from_data_folder(tmpdir)
+    rules_cache = AncestorRulesCache()
+    store = FileStore(settings, rules_cache=rules_cache)
+    owner = "user@openmined.org"
+    user = "user_2@openmined.org"
+
+    linked_paths = []
+    link_existing_rules_to_file = file_store.link_existing_rules_to_file
+
+    def tracking_link(conn, path, rules_cache=None):
+        linked_paths.append(path)
+        return link_existing_rules_to_file(conn, path, rules_cache)
+
+    monkeypatch.setattr(file_store, "link_existing_rules_to_file", tracking_link)
+
+    def put_permfile(rule_dicts: list[dict]) -> None:
+        permfile_path = Path(owner) / PERM_FILE
+        store.put(permfile_path, yaml.dump(rule_dicts).encode(), owner, skip_permission_check=True)
+
+    def readable_paths() -> list[str]:
+        return sorted(file.path.as_posix() for file in store.list_for_user(email=user) if file.path.suffix != ".yaml")
+
+    put_permfile([{"path": "**/*.txt", "user": user, "permissions": ["read"]}])
+    paths = [Path(owner) / "a" / f"file_{i}.txt" for i in range(3)] + [Path(owner) / "a" / "file.csv"]
+    for path in paths:
+        store.put(path, b"content", owner, skip_permission_check=True)
+    assert readable_paths() == [p.as_posix() for p in paths[:3]]
+
+    # Modifications keep the existing links
+    linked_paths.clear()
+    for _ in range(3):
+        store.put(paths[0], uuid.uuid4().bytes, owner, skip_permission_check=True)
+    assert linked_paths == []
+    assert readable_paths() == [p.as_posix() for p in paths[:3]]
+
+    # Changing a permfile clears the cached rules of all directories
+    put_permfile([{"path": "**/*.csv", "user": user, "permissions": ["read"]}])
+    new_path = Path(owner) / "a" / "new.csv"
+    store.put(new_path, b"content", owner, skip_permission_check=True)
+    assert readable_paths() == [paths[3].as_posix(), new_path.as_posix()]
+
+
+def test_rules_cache_cleared_before_commit(tmpdir, monkeypatch):
+    settings = ServerSettings.from_data_folder(tmpdir)
+    rules_cache = AncestorRulesCache()
+    store = FileStore(settings, rules_cache=rules_cache)
+    owner = "user@openmined.org"
+    permfile_path = Path(owner) / PERM_FILE
+
+    # Rules that other connections see whenever the cache is cleared
+    committed_rules = []
+    clear = rules_cache.clear
+
+    def tracking_clear() -> None:
+        with get_db(store.db_path) as conn:
+            rules = db.get_rules_for_dirs(conn, [owner])
+        committed_rules.append(sorted(rule.path for rule in rules))
+        clear()
+
+    monkeypatch.setattr(rules_cache, "clear", tracking_clear)
+
+    store.put(
+        permfile_path,
+        yaml.dump([{"path": "**/*.txt", "user": "*", "permissions": ["read"]}]).encode(),
+        owner,
+        skip_permission_check=True,
+    )
+    # Cleared once before the new rules are committed, and once after
+    assert committed_rules == [[], ["**/*.txt"]]
+
+    committed_rules.clear()
+    store.delete(permfile_path, owner, skip_permission_check=True)
+    assert committed_rules == [["**/*.txt"], []]
+
+
+def test_get_tree_cache(tmpdir, monkeypatch):
+    settings = ServerSettings.from_data_folder(tmpdir)
+    store = FileStore(settings, rules_cache=AncestorRulesCache(), tree_cache=UserTreeCache())
+    uncached_store = FileStore(settings)
+    owner = "user@openmined.org"
+    user = "user_2@openmined.org"
+
+    def put_permfile(rule_dicts: list[dict]) -> None:
+        store.put(Path(owner) / PERM_FILE, yaml.dump(rule_dicts).encode(), owner, skip_permission_check=True)
+
+    put_permfile([{"path": "**/*.txt", "user": user, "permissions": ["read"]}])
+    for path in ["a/file.txt", "a/b/file.txt", "a/file.csv"]:
+        store.put(Path(owner) / path, path.encode(), owner, skip_permission_check=True)
+
+    num_calculated = 0
+    get_readable_tree = store._get_readable_tree
+
+    def counting_get_readable_tree(*args, **kwargs):
+        nonlocal num_calculated
+        num_calculated += 1
+        return get_readable_tree(*args, **kwargs)
+
+    monkeypatch.setattr(store, "_get_readable_tree", counting_get_readable_tree)
+
+    def get_tree(depth: Optional[int] = 1) -> list[tuple[str, int]]:
+        tree = store.get_tree(Path(owner), user, depth)
+        assert tree == uncached_store.get_tree(Path(owner), user, depth)
+        return [(dir_hash.path.as_posix(), dir_hash.file_count) for dir_hash in tree]
+
+    assert get_tree() == [(owner, 2), (f"{owner}/a", 2)]
+    assert get_tree() == [(owner, 2), (f"{owner}/a", 2)]
+    assert num_calculated == 1
+    assert len(get_tree(depth=None)) == 3
+    assert num_calculated == 2
+
+    # Any change in the datasite invalidates the cached trees
+    store.put(Path(owner) / "a/new.txt", b"new", owner, skip_permission_check=True)
+    assert get_tree() == [(owner, 3), (f"{owner}/a", 3)]
+    store.put(Path(owner) / "a/new.txt", b"modified", owner, skip_permission_check=True)
+    get_tree()
+    put_permfile([{"path": "**/*.csv", "user": user, "permissions": ["read"]}])
+    assert get_tree() == [(owner, 1), (f"{owner}/a", 1)]
+    assert num_calculated == 5
@@ -0,0 +1,127 @@
+import random
+import time
+from pathlib import Path
+
+import pytest
+import yaml
+
+from syftbox.lib.constants import PERM_FILE
+from syftbox.lib.permissions import PermissionType, get_computed_permission
+from syftbox.server.db.file_store import FileStore, computed_permission_for_user_and_path
+from syftbox.server.db.schema import get_db
+from syftbox.server.settings import ServerSettings
+
+PATH_PATTERNS = ["**", "*", "*.txt", "**/*.csv", "sub_0/**", "sub_1/*.txt", "{useremail}/**", "{useremail}/*.txt"]
+PERMISSIONS = ["read", "write", "create", "admin"]
+
+# Minimum bulk permission checks per second in the benchmark, well below the usual ~30k/s to only catch regressions
+MIN_BULK_CHECKS_PER_SECOND = 5_000
+
+
+def make_users(num_users: int) -> list[str]:
+    return [f"user_{i}@example.org" for i in range(num_users)]
+
+
+def random_dir(rng: random.Random, users: list[str], max_depth: int) -> list[str]:
+    """Directory names below a datasite, including user emails to match {useremail} templates"""
+    return [rng.choice([f"sub_{rng.randrange(3)}", rng.choice(users)]) for _ in range(rng.randrange(max_depth + 1))]
+
+
+def random_rule(rng: random.Random, users: list[str]) -> dict:
+    rule = {
+        "path": rng.choice(PATH_PATTERNS),
+        "user": rng.choice(["*"] + users),
+        "permissions": rng.sample(PERMISSIONS, rng.randint(1, len(PERMISSIONS))),
+    }
+    if rng.random() < 0.3:
+        rule["type"] = "disallow"
+    return rule
+
+
+def make_synthetic_datasites(
+    store: FileStore, seed: int, num_users: int, num_permfiles: int, num_files: int
+) -> tuple[list[str], list[Path]]:
+    """
+    Create datasites for `num_users` users, with `num_permfiles` random permission files and `num_files` files.
+    Returns the users and the paths of all files, including the permission files.
+    """
+    rng = random.Random(seed)
+    users = make_users(num_users)
+    paths = []
+    for _ in range(num_permfiles):
+        owner = rng.choice(users)
+        path = Path(owner, *random_dir(rng, users, max_depth=2), PERM_FILE)
+        rules = [random_rule(rng, users) for _ in range(rng.randint(1, 4))]
+        store.put(path, yaml.dump(rules).encode(), owner, skip_permission_check=True)
+        paths.append(path)
+
+    for i in range(num_files):
+        owner = rng.choice(users)
+        path = Path(owner, *random_dir(rng, users, max_depth=3), f"file_{i}.{rng.choice(['txt', 'csv'])}")
+        store.put(path, f"content {i}".encode(), owner, skip_permission_check=True)
+        paths.append(path)
+    return users, sorted(set(paths))
+
+
+def sql_readable_paths(store: FileStore, user: str) -> set[Path]:
+    return {metadata.path for metadata in store.list_for_user(email=user)}
+
+
+def python_readable_paths(store: FileStore, user: str, paths: list[Path]) -> set[Path]:
+    with get_db(store.db_path) as conn:
+        return {
+            path
+            for path in paths
+            if computed_permission_for_user_and_path(conn, user, path).has_permission(PermissionType.READ)
+        }
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_permission_implementations_agree(tmp_path: Path, seed: int):
+    store = FileStore(ServerSettings.from_data_folder(tmp_path))
+    users, paths = make_synthetic_datasites(store, seed, num_users=4, num_permfiles=12, num_files=150)
+
+    for user in users:
+        expected = python_readable_paths(store, user, paths)
+        assert sql_readable_paths(store, user) == expected
+
+        bulk = store.check_permissions(user, paths, PermissionType.READ)
+        assert {path for path, allowed in bulk.items() if allowed} == expected
+
+        tree = {
+            path
+            for path in paths
+            if get_computed_permission(
+                snapshot_folder=store.server_settings.snapshot_folder, user_email=user, path=path
+            ).has_permission(PermissionType.READ)
+        }
+        assert tree == expected
+
+
+@pytest.mark.benchmark
+def test_benchmark_permissions(tmp_path: Path):
+    store = FileStore(ServerSettings.from_data_folder(tmp_path))
+    users, paths = make_synthetic_datasites(store, seed=0, num_users=10, num_permfiles=50, num_files=2000)
+    user = users[0]
+
+    start = time.perf_counter()
+    sql_result = sql_readable_paths(store, user)
+    list_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    python_result = python_readable_paths(store, user, paths)
+    check_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bulk = store.check_permissions(user, paths, PermissionType.READ)
+    bulk_time = time.perf_counter() - start
+
+    print(
+        f"\n{len(paths)} files: list_for_user {list_time * 1000:.1f}ms, "
+        f"single checks {len(paths) / check_time:.0f}/s ({check_time / len(paths) * 1e6:.0f}us per check), "
+        f"bulk check {len(paths) / bulk_time:.0f}/s"
+    )
+    assert sql_result == python_result
+    assert {path for path, allowed in bulk.items() if allowed} == python_result
+    assert bulk_time < check_time
+    assert len(paths) / bulk_time > MIN_BULK_CHECKS_PER_SECOND
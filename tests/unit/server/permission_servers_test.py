@@ -5,12 +5,13 @@ from typing import Optional
 import pytest
 
 from syftbox.lib.constants import PERM_FILE
-from syftbox.lib.permissions import PermissionType, SyftPermission
+from syftbox.lib.permissions import RULE_PRIORITY_BITS, PermissionType, SyftPermission
 from syftbox.server.db.db import (
     get_read_permissions_for_user,
     get_rules_for_permfile,
     link_existing_rules_to_file,
     print_table,
+    read_permissions_query,
     set_rules_for_permfile,
 )
 from syftbox.server.db.file_store import computed_permission_for_user_and_path
@@ -44,16 +45,18 @@ def insert_rule(
 ):
     permfile_dir = permfile_path.rsplit("/", 1)[0]
     permfile_depth = len(Path(permfile_path).parts)
+    effective_priority = (permfile_depth << RULE_PRIORITY_BITS) | priority
     cursor.execute(
         """
-    INSERT INTO rules (permfile_path, permfile_dir, permfile_depth, priority, path, user, can_read, can_create, can_write, admin, disallow) VALUES
-          (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    INSERT INTO rules (permfile_path, permfile_dir, permfile_depth, priority, effective_priority, path, user, can_read, can_create, can_write, admin, disallow) VALUES
+          (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """,
         (
             permfile_path,
             permfile_dir,
             permfile_depth,
             priority,
+            effective_priority,
             path,
             user,
             can_read,
@@ -528,6 +531,11 @@ def test_for_email(connection_with_tables: sqlite3.Connection):
     assert res[0]["path"] == "alice@example.org/test/bob@example.org/data.txt"
     assert res[0]["read_permission"]
 
+    # The template only matched bob, the wildcard user does not give anyone else access
+    res = [dict(x) for x in get_read_permissions_for_user(connection_with_tables, "charlie@example.org")]
+    assert len(res) == 1
+    assert not res[0]["read_permission"]
+
 
 def test_like_clause(connection_with_tables: sqlite3.Connection):
     cursor = connection_with_tables.cursor()
@@ -585,3 +593,47 @@ def test_like_clause(connection_with_tables: sqlite3.Connection):
     assert len(res) == 1
     assert res[0]["path"] == "alice@example.org/data.txt"
     assert res[0]["read_permission"]
+
+
+def test_more_than_1000_rules_per_permfile(connection_with_tables: sqlite3.Connection):
+    cursor = connection_with_tables.cursor()
+    insert_file_metadata(cursor=cursor, fileid=1, path="alice@example.org/test/data.txt")
+
+    # A late rule in a permfile never overrides a rule in a deeper permfile
+    insert_rule(
+        cursor=cursor,
+        permfile_path=f"alice@example.org/{PERM_FILE}",
+        priority=1500,
+        path="**",
+        user="*",
+        can_read=True,
+        admin=False,
+        disallow=False,
+    )
+    insert_rule(
+        cursor=cursor,
+        permfile_path=f"alice@example.org/test/{PERM_FILE}",
+        priority=0,
+        path="*",
+        user="*",
+        can_read=True,
+        admin=False,
+        disallow=True,
+    )
+    insert_rule_files(cursor=cursor, permfile_path=f"alice@example.org/{PERM_FILE}", priority=1500, fileid=1)
+    insert_rule_files(cursor=cursor, permfile_path=f"alice@example.org/test/{PERM_FILE}", priority=0, fileid=1)
+    connection_with_tables.commit()
+
+    res = [dict(x) for x in get_read_permissions_for_user(connection_with_tables, "bob@example.org")]
+    assert len(res) == 1
+    assert not res[0]["read_permission"]
+
+
+def test_read_permissions_query_plan(connection_with_tables: sqlite3.Connection):
+    query, params = read_permissions_query("bob@example.org", "alice@example.org/test")
+    plan = [row["detail"] for row in connection_with_tables.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+    # Rules are only looked up through indexes, the rule tables are never scanned
+    assert not any(detail.startswith(("SCAN r", "SCAN rf")) for detail in plan), plan
+    assert sum("USING COVERING INDEX idx_rules_user (user=?)" in detail for detail in plan) == 2, plan
+    assert any("USING INDEX idx_rule_files_match_for_email (match_for_email=?)" in detail for detail in plan), plan
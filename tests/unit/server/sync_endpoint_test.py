@@ -1,17 +1,31 @@
 import base64
 import hashlib
+import os
+import sqlite3
 from pathlib import Path
 
+import httpx
 import py_fast_rsync
 import pytest
 import yaml
 from fastapi.testclient import TestClient
 from py_fast_rsync import signature
 
+from syftbox import __version__
 from syftbox.client.exceptions import SyftServerError
-from syftbox.client.server_client import SyncClient
+from syftbox.client.server_client import (
+    SyncClient,
+    is_missing_route,
+    make_temp_file,
+    remove_temp_files,
+    write_file_atomic,
+)
+from syftbox.lib.compression import ENCODING_GZIP
 from syftbox.lib.constants import PERM_FILE
-from syftbox.server.models.sync_models import ApplyDiffResponse, DiffResponse, FileMetadata
+from syftbox.lib.hash import dir_summary_hashes, hash_file_record, summary_hash
+from syftbox.lib.http import HEADER_SYFTBOX_FILE_HASH, HEADER_SYFTBOX_VERSION
+from syftbox.lib.rsync import EMPTY_SIGNATURE, calculate_diff, calculate_signature
+from syftbox.server.models.sync_models import ApplyDiffResponse, DiffResponse, FileRecord
 from tests.unit.server.conftest import TEST_DATASITE_NAME, TEST_FILE
 
 
@@ -58,8 +72,10 @@ def test_syft_client_push_flow(client: TestClient):
     response.raise_for_status()
     server_signature_b85 = response.json()["signature"]
     server_signature = base64.b85decode(server_signature_b85)
-    assert server_signature
+    # Small files are always sent in full, they have the signature of an empty file
+    assert server_signature == EMPTY_SIGNATURE
 
+    # Diff like older clients, which do not check the file size
     local_data = b"This is my local data"
     delta = py_fast_rsync.diff(server_signature, local_data)
     delta_b85 = base64.b85encode(delta).decode("utf-8")
@@ -97,12 +113,22 @@ def test_get_metadata(sync_client: SyncClient):
     assert isinstance(metadata.signature_bytes, bytes)
 
 
+def test_has_permission(client: TestClient, sync_client: SyncClient):
+    # The path does not have to exist
+    assert sync_client.has_permission(Path(TEST_DATASITE_NAME) / "new_file.txt", "create")
+    assert sync_client.has_permission(Path(TEST_DATASITE_NAME) / TEST_FILE, "write")
+    assert sync_client.has_permission(Path("other@openmined.org") / TEST_FILE, "write") is False
+
+    response = client.post("/sync/has_permission", params={"path": TEST_FILE, "permission": "execute"})
+    assert response.status_code == 400
+
+
 def test_apply_diff(sync_client: SyncClient):
     local_data = b"This is my local data"
 
     remote_metadata = sync_client.get_metadata(Path(TEST_DATASITE_NAME) / TEST_FILE)
 
-    diff = py_fast_rsync.diff(remote_metadata.signature_bytes, local_data)
+    diff = calculate_diff(remote_metadata.signature_bytes, local_data)
     expected_hash = hashlib.sha256(local_data).hexdigest()
 
     # Apply local_data to server
@@ -117,7 +143,7 @@ def test_apply_diff(sync_client: SyncClient):
 
     # another diff with incorrect hash
     remote_metadata = sync_client.get_metadata(Path(TEST_DATASITE_NAME) / TEST_FILE)
-    diff = py_fast_rsync.diff(remote_metadata.signature_bytes, local_data)
+    diff = calculate_diff(remote_metadata.signature_bytes, local_data)
     wrong_hash = "wrong_hash"
 
     with pytest.raises(SyftServerError):
@@ -133,7 +159,7 @@ def test_get_diff(sync_client: SyncClient):
     assert response.path == file_path
 
     # apply and check hash
-    new_data = py_fast_rsync.apply(local_data, base64.b85decode(response.diff))
+    new_data = py_fast_rsync.apply(local_data, response.diff)
     new_hash = hashlib.sha256(new_data).hexdigest()
 
     assert new_hash == response.hash
@@ -144,6 +170,43 @@ def test_get_diff(sync_client: SyncClient):
         sync_client.get_diff(file_path, sig)
 
 
+def test_signatures_are_not_compressed(sync_client: SyncClient):
+    content_encodings = []
+    sync_client.conn.event_hooks["request"].append(
+        lambda request: content_encodings.append(request.headers.get("Content-Encoding"))
+    )
+    local_data = os.urandom(1024 * 1024)
+    sig = calculate_signature(local_data)
+    file_path = Path(TEST_DATASITE_NAME) / TEST_FILE
+
+    diff = sync_client.get_diff(file_path, sig)
+    with sync_client.stream_diff(file_path, sig) as (remote_hash, chunks):
+        assert remote_hash == diff.hash
+        assert b"".join(chunks) == diff.diff
+    assert content_encodings == [None, None]
+
+
+def test_get_diff_raw(client: TestClient):
+    local_data = b"This is my local data"
+    file_path = Path(TEST_DATASITE_NAME) / TEST_FILE
+
+    response = client.post(
+        "/sync/get_diff_raw",
+        params={"path": file_path.as_posix()},
+        content=signature.calculate(local_data),
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    response.raise_for_status()
+    new_data = py_fast_rsync.apply(local_data, response.content)
+    assert hashlib.sha256(new_data).hexdigest() == response.headers[HEADER_SYFTBOX_FILE_HASH]
+
+    # Signatures are stored as raw bytes
+    db_path = client.app_state["server_settings"].file_db_path
+    with sqlite3.connect(db_path) as conn:
+        types = {row[0] for row in conn.execute("SELECT typeof(signature) FROM file_metadata")}
+    assert types == {"blob"}
+
+
 def test_delete_file(sync_client: SyncClient):
     sync_client.delete(Path(TEST_DATASITE_NAME) / TEST_FILE)
 
@@ -170,6 +233,79 @@ def test_create_file(sync_client: SyncClient):
     assert path.exists()
 
 
+def test_upload_compressed(client: TestClient, sync_client: SyncClient):
+    snapshot_folder = sync_client.conn.app_state["server_settings"].snapshot_folder
+    relative_path = Path(TEST_DATASITE_NAME) / "data.csv"
+    contents = b"a,b,c\n1,2,3\n" * 1000
+
+    sync_client.request_encoding = ENCODING_GZIP
+    sync_client.create(relative_path, contents)
+    assert (snapshot_folder / relative_path).read_bytes() == contents
+    assert sync_client.raw_endpoints
+
+    local_data = contents + b"4,5,6\n" * 1000
+    diff = calculate_diff(sync_client.get_metadata(relative_path).signature_bytes, local_data)
+    sync_client.apply_diff(relative_path, diff, hashlib.sha256(local_data).hexdigest())
+    assert (snapshot_folder / relative_path).read_bytes() == local_data
+
+    # Unsupported encodings are rejected, with the supported encodings in the response
+    response = client.post(
+        "/sync/upload",
+        params={"path": (Path(TEST_DATASITE_NAME) / "other.csv").as_posix()},
+        content=contents,
+        headers={"Content-Encoding": "br"},
+    )
+    assert response.status_code == 415
+    assert ENCODING_GZIP in response.headers["accept-encoding"]
+
+    response = client.post(
+        "/sync/upload",
+        params={"path": (Path(TEST_DATASITE_NAME) / "other.csv").as_posix()},
+        content=b"not gzip",
+        headers={"Content-Encoding": ENCODING_GZIP},
+    )
+    assert response.status_code == 400
+
+
+def test_is_missing_route(client: TestClient):
+    assert is_missing_route(client.post("/sync/does_not_exist"))
+    assert not is_missing_route(httpx.Response(404, json={"detail": "file not found"}))
+    assert not is_missing_route(httpx.Response(404, text="Not Found"))
+    assert not is_missing_route(httpx.Response(200, json={"detail": "Not Found"}))
+
+
+def test_raw_endpoint_file_not_found(sync_client: SyncClient):
+    requested_paths = []
+    sync_client.conn.event_hooks["request"].append(lambda request: requested_paths.append(request.url.path))
+    missing_path = Path(TEST_DATASITE_NAME) / "missing.txt"
+
+    # A missing file is an error of the raw endpoint, not a reason to retry with the legacy endpoint
+    with pytest.raises(SyftServerError):
+        sync_client.get_diff(missing_path, b"")
+    with pytest.raises(SyftServerError):
+        with sync_client.stream_diff(missing_path, b""):
+            pass
+    assert requested_paths == ["/sync/get_diff_raw", "/sync/get_diff_raw"]
+    assert sync_client.raw_endpoints
+
+
+def test_legacy_server_fallback():
+    requested_paths = []
+
+    def legacy_server(request: httpx.Request) -> httpx.Response:
+        requested_paths.append(request.url.path)
+        if request.url.path in ["/sync/upload", "/sync/has_permission"]:
+            return httpx.Response(404, json={"detail": "Not Found"})
+        return httpx.Response(200, json={}, headers={HEADER_SYFTBOX_VERSION: __version__})
+
+    sync_client = SyncClient(httpx.Client(transport=httpx.MockTransport(legacy_server), base_url="http://server"))
+    assert sync_client.has_permission(Path(TEST_DATASITE_NAME) / "file.txt", "create") is None
+    sync_client.create(Path(TEST_DATASITE_NAME) / "file.txt", b"content")
+    sync_client.create(Path(TEST_DATASITE_NAME) / "file.txt", b"content")
+    assert requested_paths == ["/sync/has_permission", "/sync/upload", "/sync/create", "/sync/create"]
+    assert not sync_client.raw_endpoints
+
+
 def test_create_permfile(sync_client: SyncClient):
     invalid_contents = b"wrong permfile"
     folder = "test"
@@ -205,7 +341,7 @@ def test_update_permfile_success(sync_client: SyncClient):
 
     remote_metadata = sync_client.get_metadata(Path(TEST_DATASITE_NAME) / PERM_FILE)
 
-    diff = py_fast_rsync.diff(remote_metadata.signature_bytes, local_data)
+    diff = calculate_diff(remote_metadata.signature_bytes, local_data)
     expected_hash = hashlib.sha256(local_data).hexdigest()
 
     response = sync_client.apply_diff(Path(TEST_DATASITE_NAME) / PERM_FILE, diff, expected_hash)
@@ -219,7 +355,7 @@ def test_update_permfile_failure(sync_client: SyncClient):
 
     remote_metadata = sync_client.get_metadata(Path(TEST_DATASITE_NAME) / PERM_FILE)
 
-    diff = py_fast_rsync.diff(remote_metadata.signature_bytes, local_data)
+    diff = calculate_diff(remote_metadata.signature_bytes, local_data)
     expected_hash = hashlib.sha256(local_data).hexdigest()
 
     with pytest.raises(SyftServerError):
@@ -238,16 +374,69 @@ def test_get_all_datasite_states(sync_client: SyncClient):
 
     metadatas = response[TEST_DATASITE_NAME]
     assert len(metadatas) == 3
-    assert all(isinstance(m, FileMetadata) for m in metadatas)
+    assert all(isinstance(m, FileRecord) for m in metadatas)
+
+
+def test_get_datasite_listings(sync_client: SyncClient):
+    listings = sync_client.get_datasite_listings()
+    assert len(listings) == 1
+
+    summary, records = listings[TEST_DATASITE_NAME]
+    assert records == sync_client.get_datasite_states()[TEST_DATASITE_NAME]
+    assert summary == summary_hash((record.path, record.hash) for record in records)
+
+
+def test_get_tree(sync_client: SyncClient):
+    records = sync_client.get_datasite_states()[TEST_DATASITE_NAME]
+    tree = sync_client.get_tree(Path(TEST_DATASITE_NAME))
+
+    expected = dir_summary_hashes((record.path, record.hash) for record in records)
+    assert {d.path.as_posix(): (d.hash, d.files_hash, d.file_count) for d in tree} == expected
+    # The hash of the datasite is the same as its summary hash
+    assert tree[0].path == Path(TEST_DATASITE_NAME)
+    assert tree[0].hash == sync_client.get_datasite_listings()[TEST_DATASITE_NAME][0]
+
+    assert len(sync_client.get_tree(Path(TEST_DATASITE_NAME), depth=0)) == 1
 
 
 def test_download_snapshot(sync_client: SyncClient, tmpdir: Path):
     tmpdir = Path(tmpdir)
     metadata = sync_client.get_remote_state(Path(TEST_DATASITE_NAME))
-    paths = [m.path for m in metadata]
+    paths = [Path(m.path) for m in metadata]
     filelist = sync_client.download_files_streaming(paths, tmpdir)
     assert len(filelist) == 3
 
+    # Files are hashed while writing, no temporary files are left behind
+    assert set(filelist) == set(metadata)
+    for record in filelist:
+        assert hash_file_record(tmpdir / record.path, tmpdir) == record
+    assert not [p for p in tmpdir.rglob("*") if p.name.endswith(".tmp")]
+
+
+def test_write_file_atomic(tmp_path: Path):
+    record = write_file_atomic(tmp_path, "user@openmined.org/folder/file.txt", b"content")
+    assert (tmp_path / "user@openmined.org" / "folder" / "file.txt").read_bytes() == b"content"
+    assert record.hash == hashlib.sha256(b"content").hexdigest()
+
+    with pytest.raises(ValueError):
+        write_file_atomic(tmp_path, "../file.txt", b"content")
+    with pytest.raises(ValueError):
+        write_file_atomic(tmp_path, "/tmp/file.txt", b"content")
+
+
+def test_remove_temp_files(tmp_path: Path):
+    path = tmp_path / "user@openmined.org" / "folder" / "file.txt"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"content")
+    (path.parent / ".hidden.tmp").write_bytes(b"not a temporary file")
+    fd, tmp_file = make_temp_file(path)
+    os.close(fd)
+
+    assert remove_temp_files(tmp_path) == 1
+    assert not Path(tmp_file).exists()
+    assert path.exists()
+    assert (path.parent / ".hidden.tmp").exists()
+
 
 def test_whoami(client: TestClient):
     response = client.post("/auth/whoami")